@@ -259,6 +259,10 @@ class Config:
             'display-scroller': False,
             'display-caption': False,
             'record-actions': False,
+            # Number of events kept in memory when recording actions
+            'event-history-size': 10000,
+            # File to which recorded events are appended. Empty to disable.
+            'event-history-log': '',
             # Imagecache save on exit: 'never', 'ask' or 'always'
             'imagecache-save-on-exit': 'ask',
             'quicksearch-ignore-case': True,
@@ -319,8 +323,28 @@ class Config:
             'apply-edited-elements-on-save': True,
             'frameselector-width': 140,
             'frameselector-count': 8,
+            # Interval (in ms) between the snapshots of the keyframe
+            # strip, displayed while scrubbing. 0 to disable.
+            'keyframe-interval': 10000,
+            # Number of worker processes used to re-encode montages. 0
+            # for the number of processors. Parallel encoding is not
+            # used by default until it has been benchmarked (see
+            # scripts/benchmark_montage.py).
+            'montage-workers': 1,
+            # Copy the video stream (smart rendering) when rendering
+            # montages to the source format. It is not used by default
+            # until it has been benchmarked (see
+            # scripts/benchmark_montage.py).
+            'montage-stream-copy': False,
+            # Memory budget (in MB) of the montage worker processes. 0
+            # for no limit.
+            'montage-memory-budget': 2048,
+            # Number of worker threads of the background job scheduler
+            'background-threads': 2,
             # Cache settings for import filters
             'filter-options': {},
+            # Maximum size (in bytes) of the analysis results cache. 0 for no limit.
+            'analysis-cache-size': 512 * 1024 * 1024,
             # Use UUIDs for element ids. If false, generate readable ids.
             'use-uuid': True
             }
@@ -358,6 +382,8 @@ class Config:
             'displaymode': 'raw',
             # engine: simple (for SimpleHTTPServer) or cherrypy (for CherryPy)
             'engine': 'simple',
+            # Maximum number of cached responses. 0 to disable the cache.
+            'response-cache-size': 256,
             }
 
         # Global context options
@@ -493,6 +519,9 @@ class Config:
 
         # Global methods (user-defined)
         self.global_methods = {}
+        # Incremented on each global method registration, so that
+        # cached TALES contexts are built again
+        self.global_methods_version = 0
 
         # Try to fix paths when necessary
         if not self.path['resources'].exists() or not self.path['web'].exists():
@@ -681,6 +710,7 @@ class Config:
         if name is None:
             name=method.__name__
         self.global_methods[name]=method
+        self.global_methods_version += 1
         return True
 
     def register_player(self, player):
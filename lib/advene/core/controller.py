@@ -32,6 +32,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 import atexit
+import contextlib
 from gi.repository import GObject
 import html
 import itertools
@@ -60,6 +61,9 @@ import advene.core.plugin
 from advene.core.mediacontrol import PlayerFactory
 from advene.core.imagecache import ImageCache
 import advene.core.idgenerator
+from advene.core.textindex import TextIndex
+from advene.core.evaluationcache import EvaluationCache
+from advene.core.scheduler import JobScheduler, PRIORITY_NORMAL, PRIORITY_LOW
 
 from advene.rules.elements import RuleSet, RegisteredAction, SimpleQuery, Quicksearch
 import advene.rules.ecaengine
@@ -84,6 +88,7 @@ import advene.util.helper as helper
 from advene.util.tools import unescape_string
 import advene.util.importer
 from advene.util.exporter import get_exporter, register_exporter, init_templateexporters
+from advene.util.rwlock import ReadWriteLock, write_locked
 import xml.etree.ElementTree as ET
 from advene.util.audio import SoundPlayer
 
@@ -160,6 +165,60 @@ class GlobalPackage:
             for s in p.schemas:
                 yield s
 
+class NotificationBatch:
+    """Events collected in a AdveneController.batch_notifications scope.
+
+    Annotation events are coalesced into a single change per
+    annotation: a created then modified annotation is reported as
+    created, a created then deleted annotation is not reported at
+    all. The other events are kept in order, the AnnotationBatch
+    notification taking the place of the first annotation event.
+    """
+    coalesced_events = ('AnnotationCreate', 'AnnotationEditEnd', 'AnnotationDelete')
+
+    def __init__(self, batch=None, comment=None):
+        # Nesting level of batch_notifications scopes
+        self.depth = 0
+        self.batch = batch
+        self.comment = comment
+        # Event name for each modified annotation, in the order of
+        # their first modification
+        self.changes = {}
+        # True if all collected events were generated by an undo
+        self.undone = None
+        # Pending (event_name, param, kw) notifications. None
+        # stands for the AnnotationBatch notification.
+        self.pending = []
+
+    def add(self, event_name, param, kw):
+        """Collect an event.
+        """
+        if event_name not in self.coalesced_events:
+            self.pending.append( (event_name, param, kw) )
+            return
+        if not self.changes and None not in self.pending:
+            self.pending.append(None)
+        annotation = kw['annotation']
+        previous = self.changes.get(annotation)
+        if event_name == 'AnnotationCreate':
+            if previous == 'AnnotationDelete':
+                # Deleted then created again (undo)
+                self.changes[annotation] = 'AnnotationEditEnd'
+            else:
+                self.changes[annotation] = event_name
+        elif event_name == 'AnnotationEditEnd':
+            if previous is None:
+                self.changes[annotation] = event_name
+        elif previous == 'AnnotationCreate':
+            # Transient annotation
+            del self.changes[annotation]
+        else:
+            self.changes[annotation] = event_name
+        if self.batch is None:
+            self.batch = kw.get('batch')
+        undone = bool(kw.get('undone'))
+        self.undone = undone if self.undone is None else (self.undone and undone)
+
 class AdveneController:
     """AdveneController class.
 
@@ -225,11 +284,27 @@ class AdveneController:
 
         # Reverse mapping indexed by package
         self.aliases = {}
+        # Prototype contexts, indexed by base URL. See build_context
+        self._context_prototypes = {}
+        # Lock protecting the packages model from concurrent
+        # access by the webserver threads. Model modifications
+        # (methods decorated with write_locked) hold it for writing.
+        self.package_lock = ReadWriteLock()
+        # Active NotificationBatch of each thread, in its current
+        # attribute. See batch_notifications
+        self._notification_batch = threading.local()
         self.current_alias = None
 
         # Imagecache indexed by media
         self.imagecache = {}
 
+        # Background jobs (snapshots, indexing...), run in idle time
+        # or in worker threads
+        self.scheduler = JobScheduler(idle_add=GObject.idle_add,
+                                      timeout_add=GObject.timeout_add,
+                                      threads=config.data.preferences['background-threads'],
+                                      callback_runner=self.queue_action)
+
         # Unknown arguments (neither a package nor a video file)
         self.unknown_args = []
 
@@ -589,8 +664,7 @@ class AdveneController:
                     if self.restricted_annotations:
                         l=self.restricted_annotations
                     else:
-                        l=[ an.fragment.begin for an in at.annotations ]
-                        l.sort()
+                        l=[ an.fragment.begin for an in self.get_type_annotations(at) ]
                     self.queue_action(self.update_status, "set", position=l[0])
             return True
 
@@ -606,9 +680,8 @@ class AdveneController:
                     pass
                 self.update_status("resume")
             else:
-                l=[ a.fragment.begin for a in at.annotations ]
+                l=[ a.fragment.begin for a in self.get_type_annotations(at) ]
                 if l:
-                    l.sort()
                     self.update_status("start", position=l[0])
 
         self.notify('RestrictType', annotationtype=at)
@@ -651,10 +724,36 @@ class AdveneController:
             else:
                 return s.lower()
 
-        if case_sensitive:
-            data_func=lambda e: e.content.data
-        else:
-            data_func=lambda e: normalize_case(e.content.data)
+        def content_data(e):
+            return normalize_case(e.content.data)
+
+        def tags_data(e):
+            return [ normalize_case(t) for t in e.tags ]
+
+        def matcher(w, tags=False):
+            """Return a predicate checking whether w is found in an element.
+
+            The package full-text indexes are used to discard
+            non-matching annotations and relations, the actual data
+            is checked only for the remaining candidates.
+            """
+            candidates={}
+            data_func=tags_data if tags else content_data
+            def match(e):
+                if isinstance(e, (Annotation, Relation)):
+                    try:
+                        c=candidates[e.ownerPackage]
+                    except KeyError:
+                        index=self.get_text_index(e.ownerPackage)
+                        if tags:
+                            c=index.tagged(w, case_sensitive)
+                        else:
+                            c=index.candidates(w, case_sensitive)
+                        candidates[e.ownerPackage]=c
+                    if c is not None and e.id not in c:
+                        return False
+                return w in data_func(e)
+            return match
 
         if sources is None:
             sources=[ "all_annotations" ]
@@ -669,19 +768,17 @@ class AdveneController:
             # know it should be escaped.
             words=[ w.replace('%n', "\n").replace('%t', "\t") for w in searched.split() ]
 
-        mandatory=[ w[1:] for w in words if w.startswith('+') ]
-        exceptions=[ w[1:] for w in words if w.startswith('-') ]
-        normal=[ w for w in words if not w.startswith('+') and not w.startswith('-') ]
+        mandatory=[ normalize_case(w[1:]) for w in words if w.startswith('+') ]
+        exceptions=[ normalize_case(w[1:]) for w in words if w.startswith('-') ]
+        normal=[ normalize_case(w) for w in words if not w.startswith('+') and not w.startswith('-') ]
 
         result=[]
 
         for source in sources:
+            tags=False
             if source == 'tags':
                 sourcedata=itertools.chain( p.annotations, p.relations )
-                if case_sensitive:
-                    data_func=lambda e: e.tags
-                else:
-                    data_func=lambda e: [ normalize_case(t) for t in e.tags ]
+                tags=True
             elif source == 'ids':
                 # Special search.
                 for i in searched.split():
@@ -700,24 +797,101 @@ class AdveneController:
                     sourcedata=c.evaluateValue(source)
 
             for w in mandatory:
-                w=normalize_case(w)
-                sourcedata=[ el for el in sourcedata if w in data_func(el) ]
+                match=matcher(w, tags)
+                sourcedata=[ el for el in sourcedata if match(el) ]
             for w in exceptions:
-                w=normalize_case(w)
-                sourcedata=[ el for el in sourcedata if w not in data_func(el) ]
+                match=matcher(w, tags)
+                sourcedata=[ el for el in sourcedata if not match(el) ]
             if not normal:
                 # No "normal" search terms. Return the result.
                 result.extend(sourcedata)
             else:
-                normal=[ normalize_case(el) for el in normal ]
-                for e in sourcedata:
-                    data=data_func(e)
-                    for w in normal:
-                        if w in data:
-                            result.append(e)
-                            break
+                matchers=[ matcher(w, tags) for w in normal ]
+                result.extend(e for e in sourcedata if any(m(e) for m in matchers))
         return result
 
+    def get_text_index(self, package=None):
+        """Return the full-text index for the given package.
+
+        The index is created if necessary.
+        """
+        if package is None:
+            package=self.package
+        try:
+            return package._textindex
+        except AttributeError:
+            package._textindex=TextIndex(package)
+            return package._textindex
+
+    def get_evaluation_cache(self, package=None):
+        """Return the evaluation cache (colors, titles, sorted annotations) for the given package.
+
+        The cache is created if necessary.
+        """
+        if package is None:
+            package=self.package
+        try:
+            return package._evaluation_cache
+        except AttributeError:
+            package._evaluation_cache=EvaluationCache(package)
+            return package._evaluation_cache
+
+    def clear_evaluation_cache(self, package=None):
+        """Invalidate the evaluation caches.
+
+        Evaluated expressions may refer to any loaded package, so that
+        the caches of all loaded packages (and of the given package,
+        which may be an imported one) are cleared.
+        """
+        packages = list(self.packages.values())
+        if package is not None:
+            packages.append(package)
+        for p in packages:
+            cache = getattr(p, '_evaluation_cache', None)
+            if cache is not None:
+                cache.clear()
+
+    def get_type_annotations(self, annotation_type):
+        """Return the annotations of the given type, sorted by begin time.
+
+        It is equivalent to annotation_type.annotations, but the sort
+        order is cached until the next package modification.
+        """
+        return self.get_evaluation_cache(annotation_type.rootPackage).type_annotations(annotation_type)
+
+    def prepare_evaluation_cache(self, package=None, chunk=100):
+        """Evaluate the colors and titles of the package elements in idle time.
+
+        @return: the job
+        """
+        if package is None:
+            package = self.package
+        cache = self.get_evaluation_cache(package)
+
+        def evaluation_job():
+            generation = cache.generation
+            if not cache.is_sorted():
+                cache.sort_annotations()
+                yield
+            elements = itertools.chain(package.annotationTypes, package.relationTypes,
+                                       package.annotations)
+            for i, el in enumerate(elements):
+                if cache.generation != generation:
+                    # Modified in the meantime. The cache will be
+                    # filled on demand.
+                    return
+                self.get_element_color(el)
+                self.get_title(el)
+                if i % chunk == chunk - 1:
+                    yield
+
+        return self.scheduler.submit(evaluation_job,
+                                     name=_("Colors and titles"),
+                                     priority=PRIORITY_LOW,
+                                     cost=len(package.annotations),
+                                     package=package,
+                                     key=('evaluation', id(package)))
+
     def evaluate_query(self, query=None, context=None, expr=None):
         """Evaluate a Query in a given context.
 
@@ -773,37 +947,38 @@ class AdveneController:
     def build_context(self, here=None, alias=None, baseurl=None):
         """Build a context object with additional information.
 
-        The information is cached if no additional parameter (alias,
-        baseurl) is specified.
+        Contexts are derived from a prototype context, which is built
+        once for each base URL, and built again when the current
+        package, the player or the global methods change.
         """
         if here is None:
             here=self.package
-        if alias is None and baseurl is None:
-            try:
-                c = here._cached_context
-                c.restore()
-                return c
-            except AttributeError:
-                pass
         if baseurl is None:
             baseurl=self.get_default_url(root=True, alias=alias)
-        c=advene.model.tal.context.AdveneContext(here,
-                                                 options={
-                                                     'package_url': baseurl,
-                                                     'snapshot': self.package.imagecache,
-                                                     'namespace_prefix': config.data.namespace_prefix,
-                                                     'config': config.data.web,
-                                                     'aliases': self.aliases,
-                                                     'controller': self,
-                                                 })
-        c.addGlobal('package', self.package)
-        c.addGlobal('packages', self.packages)
-        c.addGlobal('player', self.player)
-        for name, method in config.data.global_methods.items():
-            c.addMethod(name, method)
-        # Preserve a copy of globals/locals for later restoring
-        c.checkpoint()
-        return c
+        state = (self.package, self.player, self.package.imagecache)
+        methods_version = config.data.global_methods_version
+        try:
+            proto_state, proto_methods_version, proto = self._context_prototypes[baseurl]
+            if (proto_methods_version != methods_version
+                or any(a is not b for a, b in zip(state, proto_state))):
+                raise KeyError(baseurl)
+        except KeyError:
+            proto=advene.model.tal.context.AdveneContext(None,
+                                                         options={
+                                                             'package_url': baseurl,
+                                                             'snapshot': self.package.imagecache,
+                                                             'namespace_prefix': config.data.namespace_prefix,
+                                                             'config': config.data.web,
+                                                             'aliases': self.aliases,
+                                                             'controller': self,
+                                                         })
+            proto.addGlobal('package', self.package)
+            proto.addGlobal('packages', self.packages)
+            proto.addGlobal('player', self.player)
+            for name, method in config.data.global_methods.items():
+                proto.addMethod(name, method)
+            self._context_prototypes[baseurl] = (state, methods_version, proto)
+        return proto.derive(here)
 
     def busy_port_info(self):
         """Display the processes using the webserver port.
@@ -864,6 +1039,9 @@ class AdveneController:
 
         self.event_handler.internal_rule (event="PackageLoad",
                                           method=self.manage_package_load)
+        for event in ("PackageActivate", "DurationUpdate"):
+            self.event_handler.internal_rule (event=event,
+                                              method=self.manage_keyframe_strip)
 
         media=None
         # Arguments handling
@@ -931,6 +1109,7 @@ class AdveneController:
                 self.server = None
         return True
 
+    @write_locked
     def create_annotation(self, position, type, duration=None, content=None):
         position=int(position)
         if position > self.cached_duration:
@@ -1010,19 +1189,98 @@ class AdveneController:
             el=kw[el_name]
             p=el.ownerPackage
             p._modified = True
+            index = getattr(p, '_textindex', None)
             if event_name.endswith('Delete'):
                 # We removed an element, so remove its id from the _idgenerator set
                 p._idgenerator.remove(el.id)
+                if index is not None:
+                    index.remove(el)
             elif event_name.endswith('Create'):
                 # We created an element. Make sure its id is registered in the _idgenerator
                 p._idgenerator.add(el.id)
-
-        if 'immediate' in kw:
+                if index is not None:
+                    index.add(el)
+            elif index is not None:
+                index.update(el)
+            if self.server is not None:
+                self.server.response_cache.invalidate()
+            self.clear_evaluation_cache(p)
+        elif event_name in ('TagUpdate', 'PackageActivate'):
+            # Tag colors were modified, or the package was globally
+            # updated.
+            self.clear_evaluation_cache()
+
+        batch = getattr(self._notification_batch, 'current', None)
+        if batch is not None and not kw.get('immediate'):
+            # Some callers explicitly pass immediate=False
+            kw.pop('immediate', None)
+            batch.add(event_name, param, kw)
+        elif 'immediate' in kw:
             self.event_handler.notify(event_name, *param, **kw)
         else:
             self.queue_action(self.event_handler.notify, event_name, *param, **kw)
         return
 
+    @contextlib.contextmanager
+    def batch_notifications(self, batch=None, comment=None):
+        """Collect the notifications of bulk modifications.
+
+        In this scope, the non-immediate (immediate parameter absent
+        or False) AnnotationCreate, AnnotationEditEnd and
+        AnnotationDelete notifications are coalesced into a single
+        AnnotationBatch notification, sent when leaving the scope. Its changes parameter holds
+        (annotation, event_name) pairs, its annotations parameter the
+        modified annotations. The other non-immediate notifications
+        are delayed until the end of the scope.
+
+        The event handler dispatches the AnnotationBatch notification
+        as individual annotation events to the rules which do not
+        handle AnnotationBatch themselves (see
+        ECAEngine.expand_annotation_batch), so that user rules and
+        plugins still see each change.
+
+        Scopes can be nested, the notifications are sent when leaving
+        the outermost one. Each thread has its own scope.
+
+        with controller.batch_notifications(comment="Import"):
+            for a in annotations:
+                ...
+                controller.notify('AnnotationCreate', annotation=a)
+        """
+        current = getattr(self._notification_batch, 'current', None)
+        if current is None:
+            current = NotificationBatch(batch, comment)
+            self._notification_batch.current = current
+        current.depth += 1
+        try:
+            yield current
+        finally:
+            current.depth -= 1
+            if current.depth == 0:
+                self._notification_batch.current = None
+                self.flush_notification_batch(current)
+
+    def flush_notification_batch(self, batch):
+        """Queue the notifications collected in a NotificationBatch.
+        """
+        for item in batch.pending:
+            if item is not None:
+                (event_name, param, kw) = item
+                self.queue_action(self.event_handler.notify, event_name, *param, **kw)
+            elif batch.changes:
+                kw = {}
+                if batch.undone:
+                    kw['undone'] = True
+                if batch.comment is not None:
+                    kw['comment'] = batch.comment
+                self.queue_action(self.event_handler.notify, 'AnnotationBatch',
+                                  changes=list(batch.changes.items()),
+                                  annotations=list(batch.changes.keys()),
+                                  batch=batch.batch or object(),
+                                  **kw)
+        batch.pending = []
+        batch.changes = {}
+
     def set_volume(self, v):
         """Set the audio volume.
         """
@@ -1102,6 +1360,9 @@ class AdveneController:
 
     def get_title(self, element, representation=None, max_size=None):
         """Return the title for the given element.
+
+        Titles evaluated from the annotation type representation
+        are cached until the next package modification.
         """
         def trim_size(s):
             if max_size is not None and len(s) > max_size:
@@ -1144,13 +1405,17 @@ class AdveneController:
                     r=element.id
                 return cleanup(r)
             else:
-                c=self.build_context(here=element)
-                try:
-                    r=c.evaluateValue(expr)
-                except AdveneTalesException:
-                    r=element.content.data
-                if not r:
-                    r=element.id
+                titles = self.get_evaluation_cache(element.ownerPackage).titles
+                r = titles.get(element.id)
+                if r is None:
+                    c=self.build_context(here=element)
+                    try:
+                        r=c.evaluateValue(expr)
+                    except AdveneTalesException:
+                        r=element.content.data
+                    if not r:
+                        r=element.id
+                    titles[element.id] = r
                 return cleanup(r)
         if isinstance(element, RelationType):
             arrow = helper.chars.arrow_to
@@ -1172,8 +1437,14 @@ class AdveneController:
                 logger.error("Cannot find %s media in imagecache (keys: %s).", snap.media, list(self.imagecache.keys()))
                 return
             t = ic.round_timestamp(snap.date)
+            keyframe = t in ic.pending_keyframes
             ic[t] = helper.snapshot2png(snap)
             self.notify('SnapshotUpdate', position=t, media=snap.media)
+            if keyframe and not ic.pending_keyframes:
+                # The keyframe strip is complete. Store it so that
+                # it is available in the next sessions.
+                count = ic.save_keyframes(helper.mediafile2id(snap.media))
+                logger.info("Saved keyframe strip (%d snapshots) for %s", count, snap.media)
             if t >= self.cached_duration - 2000 * ic.framerate:
                 # Also store this same data for the very last frame,
                 # which cannot be fetched normally.
@@ -1181,9 +1452,13 @@ class AdveneController:
                 ic[ic.round_timestamp(snap.date)] = helper.snapshot2png(snap)
                 self.notify('SnapshotUpdate', position=t, media=snap.media)
 
-    def update_snapshot (self, position=None, media=None, force=False):
+    def update_snapshot (self, position=None, media=None, force=False, background=False):
         """Event handler used to take a snapshot for the given position.
 
+        If background is True, the snapshot is captured (by players
+        with the async-snapshot capability) after all other pending
+        snapshots.
+
         @return: a boolean (~desactivation)
        """
         if position is None:
@@ -1206,7 +1481,10 @@ class AdveneController:
         # Check if the player has async_snapshot capability.
         if 'async-snapshot' in self.player.player_capabilities:
             logger.debug("Calling async_snapshot %d", position)
-            self.player.async_snapshot(position, self.snapshot_taken)
+            if background:
+                self.player.async_snapshot(position, self.snapshot_taken, background=True)
+            else:
+                self.player.async_snapshot(position, self.snapshot_taken)
             return True
         elif 'snapshot' in self.player.player_capabilities:
             # only 0-relative position for the moment
@@ -1226,6 +1504,91 @@ class AdveneController:
             logger.debug("Player does not support snapshotting.")
         return True
 
+    def build_keyframe_strip(self, media=None):
+        """Request the missing snapshots of the keyframe strip.
+
+        The keyframe strip is a set of equidistant snapshots of the
+        media (see the keyframe-interval preference), used to display
+        a preview while scrubbing without seeking the player. The
+        snapshots are captured in the background, and the strip is
+        saved with the imagecache once complete.
+
+        @return: the number of requested snapshots
+        """
+        if media is None:
+            media = self.get_default_media()
+        ic = self.imagecache.get(media)
+        interval = config.data.preferences['keyframe-interval']
+        if (ic is None or not interval or self.cached_duration <= 0
+            or not config.data.player['snapshot']
+            # The player can only capture snapshots of its own media
+            or media != self.get_default_media()):
+            return 0
+        # Do not request the very last frames, which cannot be captured
+        missing = ic.set_keyframes(self.cached_duration - 1000 * ic.framerate, interval)
+        self.prefetch_snapshots(missing, media=media, priority=PRIORITY_LOW,
+                                force=True, background=True)
+        if missing:
+            logger.info("Requesting %d keyframes for %s", len(missing), media)
+        return len(missing)
+
+    # Number of pending snapshot requests above which prefetch jobs
+    # wait for the snapshotter
+    SNAPSHOT_QUEUE_LIMIT = 4
+
+    def prefetch_snapshots(self, positions, media=None, priority=PRIORITY_NORMAL,
+                           force=False, background=False):
+        """Request snapshots for the given positions as background jobs.
+
+        Snapshot requests are submitted to the snapshotter a few at a
+        time, in idle time, so that positions in the visible range of
+        the views (see JobScheduler.set_visible_range) are captured
+        first.
+
+        @return: the list of jobs
+        """
+        if media is None:
+            media = self.get_default_media()
+
+        def snapshot_job(t):
+            snapshotter = getattr(self.player, 'snapshotter', None)
+            while (snapshotter is not None
+                   and snapshotter.timestamp_queue.qsize() >= self.SNAPSHOT_QUEUE_LIMIT):
+                yield False
+            self.update_snapshot(t, media=media, force=force, background=background)
+
+        return [ self.scheduler.submit(snapshot_job, t,
+                                       name="Snapshot %s" % helper.format_time(t),
+                                       priority=priority,
+                                       position=t,
+                                       package=self.package,
+                                       key=('snapshot', media, t),
+                                       resource='snapshotter')
+                 for t in positions ]
+
+    def build_text_index(self, package=None):
+        """Build the full-text index of the package in idle time.
+
+        @return: the job
+        """
+        if package is None:
+            package = self.package
+        index = self.get_text_index(package)
+        return self.scheduler.submit(index.build,
+                                     name=_("Text index"),
+                                     priority=PRIORITY_LOW,
+                                     cost=len(package.annotations) + len(package.relations),
+                                     package=package,
+                                     key=('textindex', id(package)))
+
+    def manage_keyframe_strip(self, context, parameters):
+        """Event Handler executed when the media or its duration changes.
+
+        @return: a boolean (~desactivation)
+        """
+        self.build_keyframe_strip()
+        return True
+
     def round_timestamp(self, t, media=None):
         """Round the given timestamp to the appropriate time wrt. framerate.
         """
@@ -1402,6 +1765,7 @@ class AdveneController:
         # Update package title and description if necessary
         self.update_package_title()
 
+    @write_locked
     def delete_element (self, el, immediate_notify=False, batch=None, undone=False):
         """Delete an element from its package.
 
@@ -1460,6 +1824,7 @@ class AdveneController:
             self.notify('ResourceDelete', resource=el, immediate=immediate_notify, undone=undone)
         return True
 
+    @write_locked
     def transmute_annotation(self, annotation, annotationType, delete=False, position=None, notify=True):
         """Transmute an annotation to a new type.
 
@@ -1551,6 +1916,7 @@ class AdveneController:
 
         return an
 
+    @write_locked
     def offset_element(self, el, offset, batch_id=None):
         """Offset (by time) the specified element.
 
@@ -1565,12 +1931,13 @@ class AdveneController:
             self.notify('EditSessionEnd', element=el)
         elif isinstance(el, AnnotationType):
             batch_id =  batch_id or object()
-            for a in el.annotations:
-                self.notify('EditSessionStart', element=a, immediate=True)
-                a.fragment.begin += offset
-                a.fragment.end += offset
-                self.notify('AnnotationEditEnd', annotation=a, batch=batch_id)
-                self.notify('EditSessionEnd', element=a)
+            with self.batch_notifications(batch=batch_id):
+                for a in el.annotations:
+                    self.notify('EditSessionStart', element=a, immediate=True)
+                    a.fragment.begin += offset
+                    a.fragment.end += offset
+                    self.notify('AnnotationEditEnd', annotation=a, batch=batch_id)
+                    self.notify('EditSessionEnd', element=a)
         elif isinstance(el, Package):
             for a in el.annotations:
                 a.fragment.begin += offset
@@ -1578,19 +1945,22 @@ class AdveneController:
             self.notify('PackageActivate', package=el)
         elif isinstance(el, Schema):
             batch_id =  batch_id or object()
-            for at in el.annotationTypes:
-                for a in at.annotations:
-                    self.notify('EditSessionStart', element=a, immediate=True)
-                    a.fragment.begin += offset
-                    a.fragment.end += offset
-                    self.notify('AnnotationEditEnd', annotation=a, batch=batch_id)
-                    self.notify('EditSessionEnd', element=a)
+            with self.batch_notifications(batch=batch_id):
+                for at in el.annotationTypes:
+                    for a in at.annotations:
+                        self.notify('EditSessionStart', element=a, immediate=True)
+                        a.fragment.begin += offset
+                        a.fragment.end += offset
+                        self.notify('AnnotationEditEnd', annotation=a, batch=batch_id)
+                        self.notify('EditSessionEnd', element=a)
         elif isinstance(el, list):
             # List of elements
             batch_id = batch_id or object()
-            for e in el:
-                self.offset_element(e, offset, batch_id)
+            with self.batch_notifications(batch=batch_id):
+                for e in el:
+                    self.offset_element(e, offset, batch_id)
 
+    @write_locked
     def quick_completion_fill_annotation(self, annotation, index):
         """Quickly edit an annotation by using a completion at the given index.
 
@@ -1629,6 +1999,7 @@ class AdveneController:
         self.notify('EditSessionEnd', element=annotation)
         return True
 
+    @write_locked
     def duplicate_annotation(self, annotation):
         """Duplicate an annotation.
         """
@@ -1647,6 +2018,7 @@ class AdveneController:
         self.notify("AnnotationCreate", annotation=an, comment="Duplicate annotation")
         return an
 
+    @write_locked
     def split_annotation(self, annotation, position):
         """Split an annotation at the given position
         """
@@ -1677,6 +2049,7 @@ class AdveneController:
         self.notify("AnnotationCreate", annotation=an, comment="Split annotation")
         return an
 
+    @write_locked
     def merge_annotations(self, s, d, extend_bounds=False):
         """Merge annotation s into annotation d.
         """
@@ -1714,6 +2087,7 @@ class AdveneController:
         self.notify('EditSessionEnd', element=d)
         return d
 
+    @write_locked
     def split_package_by_type(self, atype, callback=None):
         """Generate packages corresponding to annotations in the given annotation type.
 
@@ -1857,8 +2231,26 @@ class AdveneController:
         If not defined (or evaluating to None), it will try to use the
         'color' metadata of the container (annotation-type for
         annotations, schema for types).
+
+        The color is cached until the next package modification (see
+        get_evaluation_cache).
         """
+        package = getattr(element, 'ownerPackage', None)
+        key = (getattr(element, 'id', None), metadata)
+        if package is None or not key[0]:
+            return self.evaluate_element_color(element, metadata)
+        cache = self.get_evaluation_cache(package).colors
+        try:
+            return cache[key]
+        except KeyError:
+            color = cache[key] = self.evaluate_element_color(element, metadata)
+            return color
+
+    def evaluate_element_color(self, element, metadata='color'):
+        """Evaluate the color for the given element, without using the cache.
 
+        See get_element_color.
+        """
         def shortcut_evaluateValue(element, expr):
             """Optimized version of evaluateValue
 
@@ -1999,6 +2391,8 @@ class AdveneController:
         # This will initialize the package imagecache
         self.set_default_media(self.package.getMedia(), self.package)
         self.package._idgenerator = advene.core.idgenerator.Generator(self.package)
+        # Full-text index, built on first search
+        self.package._textindex = TextIndex(self.package)
         self.package._modified = False
 
         # State dictionary
@@ -2093,6 +2487,7 @@ class AdveneController:
         """
         # FIXME: check if the unregistered package was the current one
         p = self.packages[alias]
+        self.scheduler.cancel(package=p)
         del self.aliases[p]
         del self.packages[alias]
         if self.package == p:
@@ -2109,6 +2504,9 @@ class AdveneController:
         """Activate the package.
         """
         if alias:
+            if self.package is not None and self.package is not self.packages[alias]:
+                # Background jobs of the previous package are obsolete
+                self.scheduler.cancel(package=self.package)
             self.package = self.packages[alias]
             self.current_alias = alias
         else:
@@ -2135,7 +2533,11 @@ class AdveneController:
             if view:
                 self.activate_stbv(view)
 
+        self.build_text_index()
+
         self.notify ("PackageActivate", package=self.package)
+        # After the notification, which clears the evaluation cache
+        self.prepare_evaluation_cache()
 
     def reset(self):
         """Reset all packages.
@@ -2421,6 +2823,9 @@ class AdveneController:
             self.event_handler.clear_state()
             self.event_handler.update_rulesets()
 
+            # Stop the background jobs
+            self.scheduler.shutdown()
+
             # Save preferences
             config.data.save_preferences()
 
@@ -2436,6 +2841,7 @@ class AdveneController:
             for tr in self.tracers:
                 tr.equeue.put(tr.exit_code)
                 tr.join()
+            self.event_handler.event_history.close()
             # Terminate the video player
             try:
                 self.player.exit()
@@ -0,0 +1,83 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Cache of the expensive evaluations on package elements.
+
+Colors and titles are often defined by TALES expressions, which are
+evaluated for every element on each view redraw, and the annotations
+of a type are sorted by the model each time they are accessed. The
+cache keeps these results until the next modification of the
+package. It is filled in idle time by the controller scheduler (see
+AdveneController.prepare_evaluation_cache) and cleared by the
+controller on modification notifications.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+class EvaluationCache:
+    """Evaluation results for the elements of a package.
+
+    Colors and titles are indexed by element id, and the sorted
+    annotations of each type are stored as positions in
+    package.annotations, so that the cache does not keep the
+    annotation instances alive.
+    """
+    def __init__(self, package=None):
+        self.package = package
+        self.clear()
+
+    def clear(self):
+        """Invalidate the whole cache.
+        """
+        # Colors, indexed by (element id, metadata name)
+        self.colors = {}
+        # Titles, indexed by element id
+        self.titles = {}
+        # Annotation positions sorted by begin time, indexed by
+        # annotation type
+        self._sorted = None
+        # Number of annotations when the positions were computed,
+        # used to detect modifications that were not notified.
+        self._count = None
+        # Modification counter, used by the background evaluation
+        self.generation = getattr(self, 'generation', 0) + 1
+
+    def sort_annotations(self):
+        """Sort the annotations of all types in a single pass.
+        """
+        annotations = self.package.annotations
+        positions = {}
+        for i, a in enumerate(annotations):
+            positions.setdefault(a.type, []).append( (a.fragment.begin, i) )
+        self._sorted = dict( (at, [ i for (begin, i) in sorted(l) ])
+                             for (at, l) in positions.items() )
+        self._count = len(annotations)
+
+    def is_sorted(self):
+        return self._sorted is not None and self._count == len(self.package.annotations)
+
+    def type_annotations(self, annotation_type):
+        """Return the annotations of the given type, sorted by begin time.
+
+        It returns the same list as annotation_type.annotations.
+        """
+        if not self.is_sorted():
+            self.sort_annotations()
+        annotations = self.package.annotations
+        return [ annotations[i] for i in self._sorted.get(annotation_type, ()) ]
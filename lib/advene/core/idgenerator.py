@@ -34,7 +34,17 @@ import advene.util.helper as helper
 class Generator:
     """Identifier generator.
 
-    It keeps a track of ids for all elements from the package.
+    It keeps a track of ids for all elements from the package, in a
+    set, along with the highest index used for each prefix, so that
+    checking and generating ids does not depend on the package size.
+
+    Generated ids are prefix + index (or UUIDs if the use-uuid
+    preference is set). The sequence is gap-free: the index follows
+    the highest index found in the package, then the last issued
+    index, and ids which were issued but not used can be given back
+    with release. Ids added by other means (imports, merges) do not
+    move the sequence forward, they are only skipped when it reaches
+    them.
     """
     prefix = {
         Package: "p",
@@ -49,11 +59,16 @@ class Generator:
         ResourceData: "res_",
         }
 
+    re_id = re.compile("^(" + "|".join(prefix.values()) + ")([0-9]+)")
+
     def __init__(self, package=None):
-        self.last_used={}
-        self.existing=[]
-        for k in self.prefix:
-            self.last_used[k]=0
+        # Highest index used for each prefix
+        self.last_used = dict( (k, 0) for k in self.prefix.values() )
+        self.existing = set()
+        # Ids returned by get_id, not added yet
+        self.issued = set()
+        # Lowest index that may be available, for each new_from_title root
+        self.title_index = {}
         if package is not None:
             self.init(package)
 
@@ -65,63 +80,98 @@ class Generator:
     def add(self, id_):
         """Add a new known id.
         """
-        self.existing.append(id_)
+        self.existing.add(id_)
+        self.issued.discard(id_)
+
+    def release(self, id_):
+        """Give back an id returned by get_id which was not used.
+
+        Its index will be generated again.
+        """
+        if id_ not in self.issued:
+            return
+        self.issued.discard(id_)
+        m = self.re_id.match(id_)
+        if m and m.group(0) == id_:
+            n = int(m.group(2))
+            k = m.group(1)
+            if self.last_used[k] >= n:
+                self.last_used[k] = n - 1
 
     def remove(self, id_):
         """Remove an id from the existing set.
         """
-        try:
-            self.existing.remove(id_)
-        except ValueError:
-            pass
+        self.existing.discard(id_)
+        # Make the index available again for new_from_title. The
+        # root may itself end with digits, so check all splits.
+        i = len(id_)
+        while i > 0 and id_[i - 1].isdigit():
+            i -= 1
+            root = id_[:i]
+            # new_from_title indexes start at 1
+            index = max(int(id_[i:]), 1)
+            if self.title_index.get(root, 1) > index:
+                self.title_index[root] = index
 
     def init(self, package):
         """Initialize the indexes for the given package."""
-        prefixes=list(self.prefix.values())
-        re_id = re.compile("^(" + "|".join(prefixes) + ")([0-9]+)")
-        last_id={}
-        for k in prefixes:
-            last_id[k]=0
+        last_id = dict( (k, 0) for k in self.prefix.values() )
+        match = self.re_id.match
 
         # FIXME: find all package ids
         for l in (package.annotations, package.relations,
                   package.schemas,
                   package.annotationTypes, package.relationTypes,
                   package.views, package.queries):
-            for i in l.ids():
-                self.existing.append(i)
-                m=re_id.match(i)
+            ids = l.ids()
+            self.existing.update(ids)
+            for i in ids:
+                m = match(i)
                 if m:
-                    n=int(m.group(2))
-                    k=m.group(1)
+                    n = int(m.group(2))
+                    k = m.group(1)
                     if last_id[k] < n:
                         last_id[k] = n
         # last_id contains the last index used for each prefix
-        self.last_used = dict(last_id)
+        self.last_used = last_id
+        self.issued = set()
+        self.title_index = {}
 
     def get_id(self, elementtype):
         """Return a not-yet used id.
+
+        The id is not added to the existing ids: this is done when
+        the element is created (see add). Until then, it is not
+        returned again, unless it is released (see release).
         """
         if config.data.preferences['use-uuid']:
             id_ = str(uuid.uuid1())
+            while id_ in self.existing:
+                id_ = str(uuid.uuid1())
         else:
-            prefix=self.prefix[elementtype]
-            index=self.last_used[prefix] + 1
-            self.last_used[prefix]=index
+            prefix = self.prefix[elementtype]
+            index = self.last_used[prefix] + 1
             id_ = prefix + str(index)
-            # Do not append yet.
-            #self.existing.append(id_)
+            while id_ in self.existing or id_ in self.issued:
+                index += 1
+                id_ = prefix + str(index)
+            self.last_used[prefix] = index
+        self.issued.add(id_)
         return id_
 
     def new_from_title(self, title):
         """Generate a new (title, identifier) from a given title.
+
+        The identifier uses the lowest available index for the title.
         """
-        root=helper.title2id(title)
-        index=1
-        i="%s%d" % (root, index)
+        root = helper.title2id(title)
+        index = self.title_index.get(root, 1)
+        i = "%s%d" % (root, index)
         while i in self.existing:
             index += 1
-            i="%s%d" % (root, index)
+            i = "%s%d" % (root, index)
+        # Lower indexes are used (or released through remove)
+        self.title_index[root] = index
         if index != 1:
-            title="%s%d" % (title, index)
+            title = "%s%d" % (title, index)
         return title, i
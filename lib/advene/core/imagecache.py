@@ -23,12 +23,14 @@ import logging
 logger = logging.getLogger(__name__)
 
 import advene.core.config as config
+import bisect
 import operator
 
 from collections import defaultdict
 import math
 import os
 import re
+import threading
 
 class CachedString:
     """String cached in a file.
@@ -116,6 +118,16 @@ class ImageCache:
         self.uri = uri
 
         self._dict = defaultdict(lambda: self.not_yet_available_image)
+        # Sorted list of keys, built on demand by positions()
+        self._sorted_keys = None
+        # Lock protecting _sorted_keys, which is used from webserver
+        # threads while snapshots are added from the GUI thread
+        self._keys_lock = threading.Lock()
+        # Positions of the keyframe strip (see set_keyframes)
+        self.keyframes = []
+        self.keyframe_interval = 0
+        # Keyframe positions requested but not yet captured
+        self.pending_keyframes = set()
 
         # Store requested_timestamps (not yet valid timestamps)
         self.requested_timestamps = set()
@@ -178,7 +190,9 @@ class ImageCache:
         return best[0]
 
     def clear(self):
-        self._dict.clear()
+        with self._keys_lock:
+            self._dict.clear()
+            self._sorted_keys = None
 
     def __contains__(self, key):
         return self.round_timestamp(key) in self._dict
@@ -200,7 +214,9 @@ class ImageCache:
         return self._dict.get(self.round_timestamp(key), self.not_yet_available_image)
 
     def __delitem__(self, key):
-        self._dict.__delitem__(key)
+        with self._keys_lock:
+            self._dict.__delitem__(key)
+            self._sorted_keys = None
 
     def __iter__(self):
         return self._dict.__iter__()
@@ -258,8 +274,12 @@ class ImageCache:
                 value = TypedString(value)
                 value.timestamp = key
                 value.contenttype = 'image/png'
-            self._dict[key] = value
+            with self._keys_lock:
+                if key not in self._dict:
+                    self._sorted_keys = None
+                self._dict[key] = value
             self.requested_timestamps.discard(key)
+            self.pending_keyframes.discard(key)
             return value
         else:
             return self.not_yet_available_image
@@ -273,7 +293,9 @@ class ImageCache:
         if key is None:
             return
         key = self.round_timestamp(key)
-        del self._dict[key]
+        with self._keys_lock:
+            del self._dict[key]
+            self._sorted_keys = None
         return key
 
     def valid_snapshots (self):
@@ -283,6 +305,127 @@ class ImageCache:
         """
         return list(self._dict.keys())
 
+    def sorted_keys(self):
+        """Return the sorted list of keys.
+
+        The list must not be modified.
+        """
+        with self._keys_lock:
+            if self._sorted_keys is None:
+                self._sorted_keys = sorted(self._dict)
+            return self._sorted_keys
+
+    def positions(self, begin=None, end=None, valid_only=True):
+        """Return the sorted list of snapshot positions in [begin, end].
+
+        The sorted key list is kept between calls, and only rebuilt
+        when keys are added or removed.
+
+        @param begin: the minimum position (in ms)
+        @param end: the maximum position (in ms)
+        @param valid_only: only return positions with an available snapshot
+        @return: a list of keys
+        """
+        keys = self.sorted_keys()
+        i = 0 if begin is None else bisect.bisect_left(keys, begin)
+        j = len(keys) if end is None else bisect.bisect_right(keys, end)
+        if valid_only:
+            return [ k for k in keys[i:j] if not self._dict[k].is_default ]
+        return keys[i:j]
+
+    def nearest(self, key, max_distance=None):
+        """Return the valid snapshot closest to the position key.
+
+        This is a cheap lookup (no snapshot is requested), used to
+        display a preview while scrubbing. If there is no valid
+        snapshot within max_distance, return
+        ImageCache.not_yet_available_image.
+
+        @param key: the position (in ms)
+        @param max_distance: the maximum distance (in ms)
+        @return: an image
+        """
+        if key is None or key < 0:
+            return self.not_yet_available_image
+        keys = self.sorted_keys()
+        i = bisect.bisect_left(keys, key)
+        # Look for the closest valid snapshot on both sides
+        before = i - 1
+        while before >= 0 and self._dict[keys[before]].is_default:
+            before -= 1
+        after = i
+        while after < len(keys) and self._dict[keys[after]].is_default:
+            after += 1
+        candidates = []
+        if before >= 0:
+            candidates.append(keys[before])
+        if after < len(keys):
+            candidates.append(keys[after])
+        if not candidates:
+            return self.not_yet_available_image
+        best = min(candidates, key=lambda pos: abs(pos - key))
+        if max_distance is not None and abs(best - key) > max_distance:
+            return self.not_yet_available_image
+        return self._dict[best]
+
+    def set_keyframes(self, duration, interval):
+        """Define the keyframe strip for a media of the given duration.
+
+        Keyframes are equidistant positions, interval ms apart, that
+        are captured in the background so that a preview is always
+        available for any position.
+
+        @param duration: the media duration (in ms)
+        @param interval: the interval between keyframes (in ms)
+        @return: the list of keyframe positions without a valid snapshot,
+                 which are then considered as pending
+        """
+        if duration <= 0 or interval <= 0:
+            self.keyframes = []
+        else:
+            self.keyframes = sorted(set(self.round_timestamp(t)
+                                        for t in range(0, int(duration), int(interval))))
+        self.keyframe_interval = interval
+        missing = self.missing_keyframes()
+        self.pending_keyframes = set(missing)
+        return missing
+
+    def missing_keyframes(self):
+        """Return the positions of the keyframe strip without a valid snapshot.
+        """
+        return [ t for t in self.keyframes if self[t].is_default ]
+
+    def save_keyframes(self, name):
+        """Store the keyframe strip snapshots on disk.
+
+        Only the in-memory keyframes are written, in the directory
+        used by save(), so that the strip is loaded again with the
+        imagecache in later sessions. Stored snapshots are then read
+        from disk when needed.
+
+        @param name: the name (id) of the imagecache
+        @type name: string
+        @return: the number of saved keyframes
+        """
+        d = config.data.path['imagecache'] / name
+        count = 0
+        for t in self.keyframes:
+            i = self._dict.get(t)
+            if not isinstance(i, TypedString) or i.is_default:
+                continue
+            if not d.is_dir():
+                d.mkdir(parents=True)
+            filename = d / ("%010d.png" % t)
+            with open(filename, 'wb') as f:
+                f.write(i)
+            s = CachedString(filename)
+            s.contenttype = 'image/png'
+            self._dict[t] = s
+            count += 1
+        if count and self.name is None:
+            self.name = name
+        return count
+
     def missing_snapshots (self):
         """Return the list of timestamps queried but missing a snapshot.
         """
@@ -355,7 +498,9 @@ class ImageCache:
                     continue
                 s = CachedString(d / filename)
                 s.contenttype = 'image/png'
-                self._dict[i] = s
+                with self._keys_lock:
+                    self._dict[i] = s
+                    self._sorted_keys = None
         self._modified=False
 
     def stats(self):
@@ -157,6 +157,27 @@ class Plugin:
             name="loaded from %s" % self.filename
         return "Plugin %s" % name
 
+def run_plugin_function(filename, function, *args):
+    """Load a plugin from its source file and call one of its functions.
+
+    This function is meant to be run in worker processes (through
+    concurrent.futures): plugin modules are not registered in
+    sys.modules, so their functions cannot be pickled by reference.
+
+    @param filename: the plugin source file
+    @param function: the function name
+    @return: the function return value
+    """
+    name, ext = os.path.splitext(os.path.basename(filename))
+    module_name = '_'.join(('plugins', name))
+    if import_method == 'new':
+        spec = spec_from_file_location(module_name, filename)
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = SourceFileLoader(module_name, filename).load_module()
+    return getattr(module, function)(*args)
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     l = PluginCollection('plugins')
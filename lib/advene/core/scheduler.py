@@ -0,0 +1,419 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Background job scheduler.
+
+Expensive maintenance tasks (snapshot capture, index building...)
+are submitted as jobs to the controller scheduler, instead of being
+run on demand in the GUI thread. Jobs are run:
+
+  - in idle time, in the application mainloop, for jobs accessing
+    the packages or the player. A job function can return a
+    generator: each step (yield) gives back the control to the
+    mainloop, so that the interface stays responsive. Yielding
+    False means that the job is waiting for its resource: other
+    jobs using the same resource are not run before the next idle
+    slice.
+  - in worker threads (thread=True), for jobs that do not need the
+    mainloop.
+
+Jobs are run by priority (lowest value first), jobs with a position
+in the visible range (see L{JobScheduler.set_visible_range}) being
+run first. Jobs related to a package are cancelled when the package
+is deactivated.
+
+  scheduler.submit(index.build, name="Text index", package=p,
+                   priority=PRIORITY_LOW, cost=len(p.annotations))
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import inspect
+import itertools
+import threading
+import time
+
+# Job priorities. Lower values are run first.
+PRIORITY_VISIBLE = 0
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 50
+PRIORITY_LOW = 100
+
+class Job:
+    """Background job.
+
+    @ivar state: 'queued', 'running', 'waiting', 'done', 'failed' or 'cancelled'
+    @ivar cost: the estimated cost of the job (arbitrary unit, for
+                instance the number of processed elements)
+    @ivar position: the media position (in ms) the job is related to, or None
+    @ivar package: the package the job is related to, or None
+    @ivar key: a key identifying the job. Submitting a job with the
+               key of an active job returns the active job.
+    @ivar resource: the name of the resource used by the job, or None
+    @ivar elapsed: the time spent running the job (in s)
+    """
+    def __init__(self, function, args=(), name=None, priority=PRIORITY_NORMAL, cost=1,
+                 position=None, package=None, key=None, resource=None,
+                 thread=False, callback=None):
+        self.function = function
+        self.args = args
+        self.name = name or getattr(function, '__name__', str(function))
+        self.priority = priority
+        self.cost = cost
+        self.position = position
+        self.package = package
+        self.key = key
+        self.resource = resource
+        self.thread = thread
+        self.callback = callback
+        self.state = 'queued'
+        self.submitted = time.time()
+        self.steps = 0
+        self.elapsed = 0
+        self.result = None
+        self.error = None
+        self._generator = None
+        # Sequence number of the valid queue entry
+        self._seq = None
+
+    @property
+    def cancelled(self):
+        return self.state == 'cancelled'
+
+    def is_active(self):
+        return self.state in ('queued', 'running', 'waiting')
+
+    def status(self):
+        """Return a dictionary describing the job.
+        """
+        return {
+            'name': self.name,
+            'state': self.state,
+            'priority': self.priority,
+            'cost': self.cost,
+            'position': self.position,
+            'thread': self.thread,
+            'steps': self.steps,
+            'elapsed': self.elapsed,
+            'age': time.time() - self.submitted,
+        }
+
+    def __repr__(self):
+        return "<Job %s (%s, priority %d)>" % (self.name, self.state, self.priority)
+
+class JobScheduler:
+    """Prioritised background job scheduler.
+
+    idle_add and timeout_add are the mainloop functions used to run
+    the jobs in idle time (GObject.idle_add and
+    GObject.timeout_add). If they are None, run_idle must be called
+    explicitly.
+
+    callback_runner(callback, result) is used to run the callbacks
+    of thread jobs (controller.queue_action, so that they are run in
+    the mainloop).
+    """
+    # Maximum duration of an idle slice, in s
+    SLICE = .02
+    # Delay before running waiting jobs again, in ms
+    WAIT_DELAY = 100
+
+    def __init__(self, idle_add=None, timeout_add=None, threads=2, callback_runner=None):
+        self.idle_add = idle_add
+        self.timeout_add = timeout_add
+        self.threads = max(1, threads)
+        self.callback_runner = callback_runner or (lambda callback, result: callback(result))
+        # Heap of (effective priority, seq, job)
+        self._queue = []
+        self._counter = itertools.count()
+        # Active jobs, indexed by key
+        self._keys = {}
+        # Running thread jobs
+        self._running = set()
+        # Idle job being stepped
+        self._current = None
+        self._lock = threading.RLock()
+        self._executor = None
+        self._scheduled = False
+        self.visible_range = None
+
+    def effective_priority(self, job):
+        if (self.visible_range is not None and job.position is not None
+            and self.visible_range[0] <= job.position <= self.visible_range[1]):
+            return min(job.priority, PRIORITY_VISIBLE)
+        return job.priority
+
+    def _push(self, job):
+        job._seq = next(self._counter)
+        heapq.heappush(self._queue, (self.effective_priority(job), job._seq, job))
+
+    def _queued_jobs(self):
+        return [ job for (prio, seq, job) in self._queue
+                 if seq == job._seq and job.state in ('queued', 'waiting') ]
+
+    def _schedule(self):
+        """Make sure that the idle processing is scheduled.
+        """
+        with self._lock:
+            if self._scheduled or self.idle_add is None or not self._queue:
+                return
+            self._scheduled = True
+        self.idle_add(self._idle)
+
+    def _idle(self):
+        if self.run_idle():
+            return True
+        with self._lock:
+            self._scheduled = False
+        if self._queue and self.timeout_add is not None:
+            # Only waiting jobs remain. Check them again later.
+            self._scheduled = True
+            self.timeout_add(self.WAIT_DELAY, self._resume)
+        return False
+
+    def _resume(self):
+        with self._lock:
+            self._scheduled = False
+        self._schedule()
+        return False
+
+    def submit(self, function, *args, name=None, priority=PRIORITY_NORMAL, cost=1,
+               position=None, package=None, key=None, resource=None,
+               thread=False, callback=None):
+        """Submit a job.
+
+        function(*args) is run in idle time, or in a worker thread if
+        thread is True. If it returns a generator, the job is
+        processed step by step. callback(result) is called in the
+        mainloop when the job is done.
+
+        @return: the Job
+        """
+        if key is not None:
+            job = self._keys.get(key)
+            if job is not None and job.is_active():
+                if priority < job.priority:
+                    job.priority = priority
+                    if job.state in ('queued', 'waiting'):
+                        self._push(job)
+                return job
+        job = Job(function, args, name=name, priority=priority, cost=cost,
+                  position=position, package=package, key=key, resource=resource,
+                  thread=thread, callback=callback)
+        if key is not None:
+            self._keys[key] = job
+        self._push(job)
+        self._schedule()
+        return job
+
+    def _finish(self, job, state):
+        with self._lock:
+            if job.state != 'cancelled':
+                job.state = state
+            if job.key is not None and self._keys.get(job.key) is job:
+                del self._keys[job.key]
+        if job.state == 'done' and job.callback is not None:
+            if job.thread:
+                self.callback_runner(job.callback, job.result)
+            else:
+                try:
+                    job.callback(job.result)
+                except Exception:
+                    logger.error("Exception in %s job callback", job.name, exc_info=True)
+
+    def _step(self, job):
+        """Run one step of an idle job.
+        """
+        t = time.time()
+        job.state = 'running'
+        self._current = job
+        try:
+            if job._generator is None:
+                result = job.function(*job.args)
+                if not inspect.isgenerator(result):
+                    job.result = result
+                    self._finish(job, 'done')
+                    return
+                job._generator = result
+            try:
+                value = next(job._generator)
+            except StopIteration as e:
+                job.result = e.value
+                self._finish(job, 'done')
+                return
+            if job.cancelled:
+                # Cancelled during the step: cancel could not close
+                # the executing generator.
+                job._generator.close()
+            elif job.state == 'running':
+                job.state = 'waiting' if value is False else 'queued'
+        except Exception as e:
+            logger.error("Exception in %s job", job.name, exc_info=True)
+            job.error = e
+            self._finish(job, 'failed')
+        finally:
+            self._current = None
+            job.steps += 1
+            job.elapsed += time.time() - t
+
+    def _run_thread(self, job):
+        t = time.time()
+        try:
+            result = job.function(*job.args)
+            if inspect.isgenerator(result):
+                try:
+                    while not job.cancelled:
+                        if next(result) is False:
+                            time.sleep(self.WAIT_DELAY / 1000)
+                        job.steps += 1
+                    result.close()
+                except StopIteration as e:
+                    result = e.value
+            job.result = result
+            state = 'done'
+        except Exception as e:
+            logger.error("Exception in %s job", job.name, exc_info=True)
+            job.error = e
+            state = 'failed'
+        job.elapsed = time.time() - t
+        with self._lock:
+            self._running.discard(job)
+        self._finish(job, state)
+        self._schedule()
+
+    def run_idle(self):
+        """Run queued idle jobs during at most SLICE seconds.
+
+        Thread jobs are started if there is an available worker.
+
+        @return: True if some jobs could be run immediately
+        """
+        deadline = time.time() + self.SLICE
+        blocked = set()
+        deferred = []
+        while self._queue and time.time() < deadline:
+            prio, seq, job = heapq.heappop(self._queue)
+            if seq != job._seq or job.state not in ('queued', 'waiting'):
+                # Obsolete entry
+                continue
+            if job.resource is not None and job.resource in blocked:
+                deferred.append(job)
+                continue
+            if job.thread:
+                with self._lock:
+                    if len(self._running) >= self.threads:
+                        deferred.append(job)
+                        continue
+                    job.state = 'running'
+                    self._running.add(job)
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='advene-job')
+                self._executor.submit(self._run_thread, job)
+                continue
+            self._step(job)
+            if job.state == 'waiting':
+                if job.resource is not None:
+                    blocked.add(job.resource)
+                deferred.append(job)
+            elif job.state == 'queued':
+                # Round-robin between jobs of the same priority
+                self._push(job)
+        runnable = bool(self._queue)
+        for job in deferred:
+            self._push(job)
+        return runnable
+
+    def cancel(self, job=None, package=None):
+        """Cancel jobs.
+
+        Cancel the given job, or all the jobs related to package, or
+        all the jobs if both are None. Running thread jobs stop at
+        their next step if they are generators, else their result is
+        ignored.
+
+        @return: the number of cancelled jobs
+        """
+        with self._lock:
+            if job is not None:
+                jobs = [ job ] if job.is_active() else []
+            else:
+                jobs = self._queued_jobs() + list(self._running)
+                if self._current is not None and self._current.is_active():
+                    jobs.append(self._current)
+                if package is not None:
+                    jobs = [ j for j in jobs if j.package is package ]
+            for j in jobs:
+                j.state = 'cancelled'
+                if j.key is not None and self._keys.get(j.key) is j:
+                    del self._keys[j.key]
+                if j._generator is not None and j is not self._current:
+                    # The running job generator is closed by _step
+                    j._generator.close()
+        if jobs:
+            # Remove obsolete entries
+            self._queue = [ entry for entry in self._queue if entry[2].is_active() ]
+            heapq.heapify(self._queue)
+            logger.debug("Cancelled %d jobs", len(jobs))
+        return len(jobs)
+
+    def set_visible_range(self, begin, end):
+        """Run first the jobs related to positions in [begin, end].
+
+        Set to None, None to disable.
+        """
+        if begin is None or end is None:
+            visible_range = None
+        else:
+            visible_range = (begin, end)
+        if visible_range == self.visible_range:
+            return
+        self.visible_range = visible_range
+        self._queue = [ (self.effective_priority(job), job._seq, job)
+                        for job in self._queued_jobs() ]
+        heapq.heapify(self._queue)
+
+    def jobs(self):
+        """Return the active jobs, in execution order.
+
+        @return: a list of Job
+        """
+        with self._lock:
+            running = sorted(self._running, key=lambda j: j.submitted)
+        return running + [ job for (prio, seq, job) in sorted(self._queue)
+                           if seq == job._seq and job.state in ('queued', 'waiting') ]
+
+    def stats(self):
+        """Return statistics about the active jobs.
+        """
+        jobs = self.jobs()
+        return {
+            'queued': sum(1 for j in jobs if j.state in ('queued', 'waiting')),
+            'running': sum(1 for j in jobs if j.state == 'running'),
+            'cost': sum(j.cost for j in jobs),
+        }
+
+    def shutdown(self):
+        """Cancel all jobs and stop the worker threads.
+        """
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
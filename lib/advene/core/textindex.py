@@ -0,0 +1,257 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Full-text index module.
+
+The index maintains n-gram posting lists over annotation and relation
+contents, and tag lists, for a given package. It is only used as a
+candidate filter: the index guarantees that an element which is not
+in the candidate set for a term does not contain it, so that callers
+only have to check the actual data of the candidate elements.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from collections import defaultdict
+import itertools
+
+from advene.model.annotation import Annotation, Relation
+
+class TextIndex:
+    """N-gram inverted index over annotation/relation contents and tags.
+
+    Posting lists are indexed by element id. They are built lazily
+    on first use (one set of postings for case-insensitive searches,
+    one for case-sensitive searches), and then maintained through the
+    L{add}, L{update} and L{remove} methods. Content and tags
+    modifications call L{update} from the model (see
+    Modeled._dataModified), even when they are not notified.
+
+    @ivar size: the n-gram size
+    @type size: int
+    """
+    def __init__(self, package=None, size=3):
+        self.package = package
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        """Invalidate the whole index.
+        """
+        # Postings, indexed by case_sensitive flag, then by n-gram
+        self._grams = {}
+        # Indexed n-grams for each element id, indexed by case_sensitive flag
+        self._element_grams = {}
+        # Ids of elements whose content could not be indexed
+        # (non-textual data). They always are candidates.
+        self._unindexed = {}
+        # Tag postings, indexed by case_sensitive flag, then by tag
+        self._tags = {}
+        self._element_tags = {}
+        # Number of indexed elements, used to detect modifications
+        # that were not notified.
+        self._count = None
+        # Modification counter, used by build
+        self._generation = getattr(self, '_generation', 0) + 1
+
+    def elements(self):
+        """Return an iterator on the indexed elements.
+        """
+        if self.package is None:
+            return iter(())
+        return itertools.chain(self.package.annotations, self.package.relations)
+
+    def _element_count(self):
+        if self.package is None:
+            return 0
+        return len(self.package.annotations) + len(self.package.relations)
+
+    def _check_count(self):
+        """Invalidate the index if the package has been modified behind our back.
+        """
+        count = self._element_count()
+        if self._count is not None and self._count != count:
+            logger.debug("Unnotified package modification - rebuilding index")
+            self.clear()
+        self._count = count
+
+    def _normalize(self, s, case_sensitive):
+        if case_sensitive:
+            return s
+        else:
+            return s.lower()
+
+    def _ngrams(self, s):
+        n = self.size
+        return set(s[i:i+n] for i in range(len(s) - n + 1))
+
+    def _index_content(self, el, case_sensitive, postings=None, element_grams=None, unindexed=None):
+        if postings is None:
+            postings = self._grams[case_sensitive]
+            element_grams = self._element_grams[case_sensitive]
+            unindexed = self._unindexed[case_sensitive]
+        data = el.content.data
+        if not isinstance(data, str):
+            unindexed.add(el.id)
+            return
+        grams = self._ngrams(self._normalize(data, case_sensitive))
+        element_grams[el.id] = grams
+        for g in grams:
+            postings[g].add(el.id)
+
+    def _unindex_content(self, id_, case_sensitive):
+        self._unindexed[case_sensitive].discard(id_)
+        grams = self._element_grams[case_sensitive].pop(id_, ())
+        postings = self._grams[case_sensitive]
+        for g in grams:
+            s = postings.get(g)
+            if s is not None:
+                s.discard(id_)
+                if not s:
+                    del postings[g]
+
+    def _index_tags(self, el, case_sensitive):
+        tags = set(self._normalize(t, case_sensitive) for t in el.tags)
+        self._element_tags[case_sensitive][el.id] = tags
+        postings = self._tags[case_sensitive]
+        for t in tags:
+            postings[t].add(el.id)
+
+    def _unindex_tags(self, id_, case_sensitive):
+        postings = self._tags[case_sensitive]
+        for t in self._element_tags[case_sensitive].pop(id_, ()):
+            s = postings.get(t)
+            if s is not None:
+                s.discard(id_)
+                if not s:
+                    del postings[t]
+
+    def _content_postings(self, case_sensitive):
+        if case_sensitive not in self._grams:
+            self._grams[case_sensitive] = defaultdict(set)
+            self._element_grams[case_sensitive] = {}
+            self._unindexed[case_sensitive] = set()
+            for el in self.elements():
+                self._index_content(el, case_sensitive)
+        return self._grams[case_sensitive]
+
+    def _tag_postings(self, case_sensitive):
+        if case_sensitive not in self._tags:
+            self._tags[case_sensitive] = defaultdict(set)
+            self._element_tags[case_sensitive] = {}
+            for el in self.elements():
+                self._index_tags(el, case_sensitive)
+        return self._tags[case_sensitive]
+
+    def build(self, case_sensitive=False, chunk=500):
+        """Build the content postings step by step.
+
+        This generator indexes chunk elements at each step, so that
+        the index can be built in idle time by the controller
+        scheduler. The postings are only used if the index was not
+        modified during the build.
+        """
+        if case_sensitive in self._grams:
+            return
+        generation = self._generation
+        postings = defaultdict(set)
+        element_grams = {}
+        unindexed = set()
+        elements = list(self.elements())
+        for i, el in enumerate(elements):
+            self._index_content(el, case_sensitive, postings, element_grams, unindexed)
+            if i % chunk == chunk - 1:
+                yield
+                if self._generation != generation or case_sensitive in self._grams:
+                    # Modified (or built on demand) in the meantime
+                    return
+        if self._generation == generation and case_sensitive not in self._grams:
+            self._grams[case_sensitive] = postings
+            self._element_grams[case_sensitive] = element_grams
+            self._unindexed[case_sensitive] = unindexed
+
+    def add(self, el):
+        """Index a new element.
+        """
+        if not isinstance(el, (Annotation, Relation)):
+            return
+        self._generation += 1
+        for case_sensitive in self._grams:
+            self._index_content(el, case_sensitive)
+        for case_sensitive in self._tags:
+            self._index_tags(el, case_sensitive)
+        if self._count is not None:
+            self._count += 1
+
+    def remove(self, el):
+        """Remove an element from the index.
+        """
+        if not isinstance(el, (Annotation, Relation)):
+            return
+        self._generation += 1
+        for case_sensitive in self._grams:
+            self._unindex_content(el.id, case_sensitive)
+        for case_sensitive in self._tags:
+            self._unindex_tags(el.id, case_sensitive)
+        if self._count is not None:
+            self._count -= 1
+
+    def update(self, el):
+        """Update the index for a modified element.
+        """
+        if not isinstance(el, (Annotation, Relation)):
+            return
+        self._generation += 1
+        for case_sensitive in self._grams:
+            self._unindex_content(el.id, case_sensitive)
+            self._index_content(el, case_sensitive)
+        for case_sensitive in self._tags:
+            self._unindex_tags(el.id, case_sensitive)
+            self._index_tags(el, case_sensitive)
+
+    def candidates(self, term, case_sensitive=False):
+        """Return the ids of the elements whose content may contain term.
+
+        term is expected to be already normalized (i.e. lowercase if
+        case_sensitive is False). If the term is too short to be
+        looked up in the index, return None, meaning that all elements
+        are candidates.
+        """
+        if len(term) < self.size:
+            return None
+        self._check_count()
+        postings = self._content_postings(case_sensitive)
+        result = None
+        # Start with the smallest posting lists
+        for s in sorted((postings.get(g, ()) for g in self._ngrams(term)), key=len):
+            if result is None:
+                result = set(s)
+            else:
+                result.intersection_update(s)
+            if not result:
+                break
+        return result.union(self._unindexed[case_sensitive])
+
+    def tagged(self, tag, case_sensitive=False):
+        """Return the ids of the elements tagged with tag.
+
+        tag is expected to be already normalized.
+        """
+        self._check_count()
+        return self._tag_postings(case_sensitive).get(tag, set())
@@ -37,9 +37,14 @@ logger = logging.getLogger(__name__)
 import advene.core.config as config
 import advene.core.version
 
+import collections
+import hashlib
+import json
 import sys
 import os
 import re
+import threading
+import time
 import urllib.request, urllib.parse, urllib.error
 import html
 import socket
@@ -48,6 +53,7 @@ import imghdr
 from gettext import gettext as _
 
 import cherrypy
+from cherrypy.lib import cptools, httputil
 
 if int(cherrypy.__version__.split('.')[0]) < 3:
     raise Exception("The webserver requires version 3.0 of CherryPy at least.")
@@ -57,12 +63,94 @@ from advene.model.annotation import Annotation, Relation
 from advene.model.view import View
 from advene.model.resources import Resources
 from advene.model.exception import AdveneException
+from advene.model.tal.context import track_volatile_access, volatile_access
 import advene.util.helper as helper
 
 import simpletal.simpleTAL
 import simpletal.simpleTALES as simpleTALES
 
 
+def package_lock():
+    """Hold the controller package lock during the request.
+
+    GET and HEAD requests hold it for reading, so that they are
+    processed in parallel. Other methods may modify the packages,
+    they hold it for writing. The lock is released once the response
+    has been sent.
+    """
+    request = cherrypy.request
+    lock = request.app.root.controller.package_lock
+    if request.method in ('GET', 'HEAD'):
+        lock.acquire_read()
+        request.hooks.attach('on_end_request', lock.release_read)
+    else:
+        lock.acquire_write()
+        request.hooks.attach('on_end_request', lock.release_write)
+cherrypy.tools.package_lock = cherrypy.Tool('before_handler', package_lock)
+
+CachedResponse = collections.namedtuple('CachedResponse', ('package', 'body', 'contenttype', 'etag'))
+
+class ResponseCache:
+    """Cache for the responses to package element requests.
+
+    Entries are indexed by (package alias, TALES expression, query,
+    display mode) and are all invalidated when a package is modified.
+    Responses depending on the application state (see
+    advene.model.tal.context.VOLATILE_PATHS) are not cached.
+    The least recently used entries are dropped when the cache holds
+    more than size entries.
+
+    @ivar size: the maximum number of entries (0 disables the cache)
+    @type size: int
+    @ivar last_modified: the time of the last invalidation
+    @type last_modified: float
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.last_modified = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key, package):
+        """Return the entry for key, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.package is not package:
+                # The package has been reloaded with the same alias
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def put(self, key, package, body, contenttype):
+        """Store a response.
+
+        @return: the new entry
+        @rtype: CachedResponse
+        """
+        entry = CachedResponse(package, body, contenttype,
+                               '"%s"' % hashlib.sha1(body).hexdigest())
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        """Invalidate all entries.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.last_modified = time.time()
+
 DEBUG=True
 class Common:
     """Common functionalities for all cherrypy nodes.
@@ -383,6 +471,37 @@ class Media(Common):
        Accessing a specific snapshot is done by suffixing the URL with
        the snapshot index : C{/media/snapshot/package_alias/12321}
 
+     The X{/media/snapshot_positions} element
+     ----------------------------------------
+
+       C{/media/snapshot_positions/package_alias} returns the sorted
+       list of positions of the available snapshots, as a JSON
+       list. The optional C{begin} and C{end} parameters (in ms)
+       restrict the list to the given time range.
+
+     The X{/media/snapshot_batch} element
+     ------------------------------------
+
+       C{/media/snapshot_batch/package_alias} returns many snapshots
+       in a single C{multipart/mixed} response. The snapshots are
+       either specified by the C{positions} parameter (a
+       comma-separated list of positions in ms), or by the C{begin}
+       and C{end} parameters (all available snapshots in the
+       range). Each part holds a snapshot, with its position in the
+       C{X-Advene-Position} header. Snapshots which are not available
+       are not included.
+
+     The X{/media/keyframes} element
+     -------------------------------
+
+       C{/media/keyframes/package_alias} returns the keyframe strip of
+       the package media (equidistant snapshots captured in the
+       background), as a JSON object with the C{interval} between
+       keyframes (in ms), the C{positions} of the available keyframes
+       and the number of C{pending} ones. The keyframes can then be
+       fetched at once through C{/media/snapshot_batch}, to display
+       previews while scrubbing.
+
      The X{/media/play} element
      --------------------------
 
@@ -454,16 +573,12 @@ class Media(Common):
                 res.append (_("""<p><a href="/media/snapshot/%s?mode=inline">Display with inline images</a></p>""") % alias)
             res.append ("<ul>")
 
-            k = list(p.imagecache.keys())
-            k.sort ()
-            for position in k:
-                if position in p.imagecache:
-                    m = _("Done")
-                else:
-                    m = _("Pending")
-                res.append (template % { 'alias': alias,
-                                         'position': position,
-                                         'status': m })
+            done = _("Done")
+            pending = _("Pending")
+            res.extend(template % { 'alias': alias,
+                                    'position': position,
+                                    'status': pending if p.imagecache[position].is_default else done }
+                       for position in p.imagecache.positions(valid_only=False))
             res.append ("</ul>")
             return "".join(res)
 
@@ -473,6 +588,83 @@ class Media(Common):
         return res
     snapshot.exposed=True
 
+    def snapshot_package(self, alias):
+        """Return the package for alias, or send an error.
+        """
+        try:
+            return self.controller.packages[alias]
+        except KeyError:
+            return self.send_error(400, _("Unknown package alias"))
+
+    def snapshot_range(self, params):
+        """Return the (begin, end) time range specified in params.
+        """
+        try:
+            begin = int(params['begin']) if params.get('begin') else None
+            end = int(params['end']) if params.get('end') else None
+        except ValueError:
+            return self.send_error(400, _("Invalid time range"))
+        return begin, end
+
+    def snapshot_positions(self, alias, **params):
+        """Return the positions of the available snapshots as JSON.
+        """
+        p = self.snapshot_package(alias)
+        begin, end = self.snapshot_range(params)
+        cherrypy.response.headers['Content-type'] = 'application/json'
+        self.no_cache()
+        return json.dumps(p.imagecache.positions(begin, end)).encode('utf-8')
+    snapshot_positions.exposed=True
+
+    def snapshot_batch(self, alias, **params):
+        """Return many snapshots as a multipart/mixed response.
+        """
+        p = self.snapshot_package(alias)
+        imagecache = p.imagecache
+        if params.get('positions'):
+            try:
+                positions = [ int(t) for t in params['positions'].split(',') ]
+            except ValueError:
+                return self.send_error(400, _("Invalid positions"))
+        else:
+            begin, end = self.snapshot_range(params)
+            positions = imagecache.positions(begin, end)
+
+        boundary = 'advene-snapshot-%s' % hashlib.sha1(repr(positions).encode()).hexdigest()[:16]
+        res = []
+        for position in positions:
+            snapshot = imagecache[position]
+            if snapshot.is_default:
+                continue
+            data = bytes(snapshot)
+            res.append(("--%s\r\n"
+                        "Content-Type: %s\r\n"
+                        "Content-Length: %d\r\n"
+                        "Content-Location: /media/snapshot/%s/%d\r\n"
+                        "X-Advene-Position: %d\r\n\r\n" % (boundary, snapshot.contenttype, len(data),
+                                                             alias, position, position)).encode('ascii'))
+            res.append(data)
+            res.append(b"\r\n")
+        res.append(("--%s--\r\n" % boundary).encode('ascii'))
+        cherrypy.response.headers['Content-type'] = 'multipart/mixed; boundary=%s' % boundary
+        self.no_cache()
+        return res
+    snapshot_batch.exposed=True
+
+    def keyframes(self, alias):
+        """Return the keyframe strip description as JSON.
+        """
+        p = self.snapshot_package(alias)
+        imagecache = p.imagecache
+        cherrypy.response.headers['Content-type'] = 'application/json'
+        self.no_cache()
+        return json.dumps({
+            'interval': imagecache.keyframe_interval,
+            'positions': [ t for t in imagecache.keyframes if not imagecache[t].is_default ],
+            'pending': len(imagecache.pending_keyframes),
+        }).encode('utf-8')
+    keyframes.exposed=True
+
     def overlay(self, *args, **params):
         """Return the overlayed snapshot for the given annotation.
 
@@ -922,6 +1114,7 @@ class Admin(Common):
       - C{/admin/access} : display access control list
       - C{/admin/status} : display current status
       - C{/admin/display} : display or set the default webserver display mode
+      - C{/admin/clear_cache} : clear the response cache
       - C{/admin/methods} : list the available global methods
       - C{/admin/halt} : halt the webserver
 
@@ -971,6 +1164,7 @@ class Admin(Common):
         <p><a href="/admin/list">List available files</a></p>
         <p><a href="/packages">List loaded packages</a> (%(packagelist)s)</p>
         <p>Display mode : %(displaymode)s</p>
+        <p>Response cache : %(cache)s (<a href="/admin/clear_cache">clear</a>)</p>
         <hr>
         <p>Load a package :
         <form action="/admin/load" method="GET">
@@ -981,10 +1175,31 @@ class Admin(Common):
         </body></html>
         """) % { 'packagelist': " | ".join( ['<a href="/packages/%s">%s</a>' % (alias, alias)
                                              for alias in self.controller.packages] ),
-                 'displaymode': mode_sw })
+                 'displaymode': mode_sw,
+                 'cache': self.cache_status() })
         return "".join(res)
     index.exposed=True
 
+    def cache_status(self):
+        """Return a description of the response cache status.
+        """
+        cache = self.controller.server.response_cache
+        if not cache.size:
+            return _("disabled")
+        return _("%(entries)d/%(size)d entries, %(hits)d hits, %(misses)d misses, %(not_modified)d not modified") % {
+            'entries': len(cache.entries),
+            'size': cache.size,
+            'hits': cache.hits,
+            'misses': cache.misses,
+            'not_modified': cache.not_modified }
+
+    def clear_cache(self):
+        """Clear the response cache.
+        """
+        self.controller.server.response_cache.invalidate()
+        return self.send_redirect("/admin")
+    clear_cache.exposed=True
+
     def list(self):
         """Display available Advene files.
 
@@ -1315,6 +1530,9 @@ class Packages(Common):
                 #import pdb; pdb.set_trace()
                 if isinstance(objet, str):
                     res.append(objet.encode('utf-8'))
+                elif isinstance(objet, int):
+                    # bytes(int) would return a null-filled buffer
+                    res.append(str(objet).encode('utf-8'))
                 else:
                     try:
                         res.append(bytes(objet))
@@ -1390,6 +1608,59 @@ class Packages(Common):
                 'value': html.escape(str(type(objet)))})
         return res
 
+    def cached_package_element(self, p, tales, query):
+        """Display a view for a TALES expression, using the response cache.
+
+        Responses are sent with ETag and Last-Modified headers, so
+        that clients can revalidate them with conditional requests
+        (answered with 304 Not Modified).
+
+        See L{display_package_element} for the parameters.
+        """
+        server = self.controller.server
+        cache = server.response_cache
+        if not cache.size:
+            return self.display_package_element(p, tales, query)
+
+        key = (self.controller.aliases[p],
+               tales,
+               tuple(sorted( (k, str(v)) for k, v in query.items() )),
+               server.displaymode)
+        entry = cache.get(key, p)
+        if entry is None:
+            track_volatile_access()
+            res = self.display_package_element(p, tales, query)
+            if res is None:
+                return res
+            body = b"".join(r if isinstance(r, bytes) else str(r).encode('utf-8')
+                            for r in res)
+            if volatile_access():
+                # The response depends on the player, the options or
+                # the snapshots, which change without notification:
+                # do not cache it.
+                return body
+            entry = cache.put(key, p, body, cherrypy.response.headers.get('Content-type'))
+        else:
+            cherrypy.response.status = 200
+            if entry.contenttype:
+                cherrypy.response.headers['Content-type'] = entry.contenttype
+
+        # The response may be stored by clients, but has to be revalidated.
+        cherrypy.response.headers.pop('Pragma', None)
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        cherrypy.response.headers['ETag'] = entry.etag
+        cherrypy.response.headers['Last-Modified'] = httputil.HTTPDate(cache.last_modified)
+        try:
+            cptools.validate_etags()
+            # Last-Modified has a 1s resolution: only use it if the
+            # client did not provide an ETag.
+            if 'If-None-Match' not in cherrypy.request.headers:
+                cptools.validate_since()
+        except cherrypy.HTTPRedirect:
+            cache.not_modified += 1
+            raise
+        return entry.body
+
     def default(self, *args, **query):
         """Access a specific package.
 
@@ -1448,16 +1719,24 @@ class Packages(Common):
 
         tales = "/".join (args[1:])
 
-        if cherrypy.request.method == 'PUT':
-            return self.handle_put_request(*args, **query)
-        elif cherrypy.request.method == 'POST':
-            return self.handle_post_request(*args, **query)
+        if cherrypy.request.method in ('PUT', 'POST'):
+            try:
+                if cherrypy.request.method == 'PUT':
+                    return self.handle_put_request(*args, **query)
+                else:
+                    return self.handle_post_request(*args, **query)
+            finally:
+                # Elements may have been modified without notification
+                self.controller.server.response_cache.invalidate()
         elif cherrypy.request.method != 'GET':
             return self.send_error(400, 'Unknown method: %s' % cherrypy.request.method)
 
         logger.debug("Evaluating %s", tales)
         try:
-            return self.display_package_element (p , tales, query)
+            return self.cached_package_element (p , tales, query)
+        except cherrypy.HTTPRedirect:
+            # 304 Not Modified responses
+            raise
         except simpletal.simpleTAL.TemplateParseException as e:
             res=[ self.start_html(_("Error")) ]
             res.append(_("<h1>Error</h1>"))
@@ -2171,6 +2450,8 @@ class AdveneWebServer:
 
         self.displaymode = config.data.webserver['displaymode']
 
+        self.response_cache = ResponseCache(config.data.webserver['response-cache-size'])
+
         # Not used for the moment.
         self.authorized_hosts = {'127.0.0.1': 'localhost'}
 
@@ -2178,13 +2459,16 @@ class AdveneWebServer:
 
         app_config={
             '/': {
-                'tools.encode.on': True
+                'tools.encode.on': True,
+                'tools.package_lock.on': True,
             },
             '/favicon.ico': {
+                'tools.package_lock.on': False,
                 'tools.staticfile.on': True,
                 'tools.staticfile.filename': str(config.data.advenefile( ( 'pixmaps', 'advene.ico' ) )),
                 },
             '/data': {
+                'tools.package_lock.on': False,
                 'tools.staticdir.on': True,
                 'tools.staticdir.dir': str(config.data.path['web'])
                 },
@@ -66,12 +66,14 @@ class CreateElementPopup:
         self.parent=parent
         self.controller=controller
         self.dialog=None
+        self.generated_id=None
 
     def display(self):
         pass
 
     def generate_id(self):
-        return self.controller.package._idgenerator.get_id(self.type_)
+        self.generated_id = self.controller.package._idgenerator.get_id(self.type_)
+        return self.generated_id
 
     def build_widget(self, modal=False):
         i=self.generate_id()
@@ -338,6 +340,10 @@ class CreateElementPopup:
                 break
         d.destroy()
 
+        if retval is None or getattr(retval, 'id', None) != self.generated_id:
+            # The proposed id was not used
+            self.controller.package._idgenerator.release(self.generated_id)
+
         if retval is not None and not modal and not isinstance(retval, Resources):
             if self.controller.gui:
                 self.controller.gui.edit_element(retval)
@@ -224,8 +224,9 @@ class EditElementPopup (AdhocView, metaclass=EditPopupClass):
             if not f.check_validity():
                 return False
 
-        for f in self.forms:
-            f.update_element ()
+        with self.controller.package_lock.write():
+            for f in self.forms:
+                f.update_element ()
 
         # The children classes can define a notify method, which will
         # be called upon modification of the element, in order to
@@ -98,7 +98,7 @@ import advene.util.merger
 # GUI elements
 from advene.gui.util import get_pixmap_button, get_small_stock_button, image_from_position,\
     dialog, encode_drop_parameters, overlay_svg_as_png,\
-    name2color, predefined_content_mimetypes, get_drawable
+    name2color, predefined_content_mimetypes, get_drawable, png_to_pixbuf
 from advene.gui.util.playpausebutton import PlayPauseButton
 import advene.gui.plugins.actions
 import advene.gui.plugins.contenthandlers
@@ -469,6 +469,9 @@ class AdveneGUI:
 
         # Frequently used GUI widgets
         self.slider_move = False
+        # Keyframe preview displayed while moving the slider. Will be
+        # initialized in display_scrub_preview
+        self.scrub_preview = None
         # Will be initialized in get_visualisation_widget
         self.gui.stbv_combo = None
 
@@ -698,6 +701,50 @@ class AdveneGUI:
             e.refresh()
         return True
 
+    def annotation_batch_lifecycle(self, context, parameters):
+        """Method used to update the active views after bulk modifications.
+
+        Views defining a update_annotation_batch method are given the
+        whole list of (annotation, event) changes, the other ones
+        get a update_annotation call for each change.
+        """
+        changes = [ (annotation, event)
+                    for (annotation, event) in context.evaluateValue('changes')
+                    if annotation.ownerPackage == self.controller.package ]
+        if not changes:
+            return True
+        for (annotation, event) in changes:
+            self.updated_element(event, annotation)
+        for v in self.adhoc_views:
+            try:
+                m = getattr(v, 'update_annotation_batch', None)
+                if m:
+                    m(changes)
+                    continue
+                m = getattr(v, 'update_annotation', None)
+                if m:
+                    for (annotation, event) in changes:
+                        m(annotation=annotation, event=event)
+            except Exception:
+                logger.error(_("Exception in update_annotation_batch"), exc_info=True)
+        # Update the type fieldnames
+        structured = {}
+        for (annotation, event) in changes:
+            if (event != 'AnnotationDelete'
+                and annotation.content.mimetype.endswith('/x-advene-structured')):
+                structured.setdefault(annotation.type, []).append(annotation)
+        for (at, annotations) in structured.items():
+            at._fieldnames.update(helper.common_fieldnames(annotations))
+
+        # Refresh the edit popups for the associated relations
+        relations = set(r
+                        for (annotation, event) in changes
+                        if event != 'AnnotationDelete'
+                        for r in annotation.relations)
+        for e in [ el for el in self.edit_popups if el.element in relations ]:
+            e.refresh()
+        return True
+
     def relation_lifecycle(self, context, parameters):
         """Method used to update the active views.
 
@@ -1061,17 +1108,18 @@ class AdveneGUI:
                 if not isinstance(a, (Annotation, Relation, View)):
                     continue
                 if search == "" or search in a.content.data:
-                    self.controller.notify('EditSessionStart', element=a, immediate=True)
-                    if search:
-                        a.content.data = a.content.data.replace(search, replace)
-                    else:
-                        a.content.data = replace
-                    if isinstance(a, Annotation):
-                        self.controller.notify('AnnotationEditEnd', annotation=a, batch=batch_id)
-                    elif isinstance(a, Relation):
-                        self.controller.notify('RelationEditEnd', relation=a, batch=batch_id)
-                    elif isinstance(a, View):
-                        self.controller.notify('ViewEditEnd', view=a, batch=batch_id)
+                    with self.controller.package_lock.write():
+                        self.controller.notify('EditSessionStart', element=a, immediate=True)
+                        if search:
+                            a.content.data = a.content.data.replace(search, replace)
+                        else:
+                            a.content.data = replace
+                        if isinstance(a, Annotation):
+                            self.controller.notify('AnnotationEditEnd', annotation=a, batch=batch_id)
+                        elif isinstance(a, Relation):
+                            self.controller.notify('RelationEditEnd', relation=a, batch=batch_id)
+                        elif isinstance(a, View):
+                            self.controller.notify('ViewEditEnd', view=a, batch=batch_id)
                     self.controller.notify('EditSessionEnd', element=a)
                     count += 1
             self.log(_('%(search)s has been replaced by %(replace)s in %(count)d element(s).') % locals())
@@ -1085,6 +1133,18 @@ class AdveneGUI:
         if MontageRenderer is None:
             dialog.message_dialog(_("The video extracting feature is not available."))
             return True
+        m = MontageRenderer(self.controller, elements)
+        try:
+            # Do not block the GUI while the source media is
+            # discovered: the source format is only proposed once known.
+            ext = m.stream_copy_extension(wait=False)
+        except Exception:
+            logger.warning("Cannot check the source media format", exc_info=True)
+            ext = None
+        if ext and basename:
+            # Propose the source format, so that the video stream
+            # is copied instead of being re-encoded.
+            basename = os.path.splitext(basename)[0] + ext
         duration = helper.format_time(sum(a.fragment.duration for a in elements))
         filename = dialog.get_filename(title=_("Destination filename (duration: %s)") % duration,
                                        action=Gtk.FileChooserAction.SAVE,
@@ -1099,8 +1159,6 @@ class AdveneGUI:
             label = _("Exporting %(duration)s video to\n%(filename)s") % { 'filename': filename,
                                                                            'duration': duration }
 
-        m = MontageRenderer(self.controller, elements)
-
         w = Gtk.Window()
         w.set_title(title)
         v = Gtk.VBox()
@@ -1183,6 +1241,7 @@ class AdveneGUI:
                    'AnnotationDelete', 'AnnotationActivate',
                    'AnnotationDeactivate'),
                   self.annotation_lifecycle ),
+                ("AnnotationBatch", self.annotation_batch_lifecycle),
                 ( ('RelationCreate', 'RelationEditEnd',
                    'RelationDelete'),
                   self.relation_lifecycle ),
@@ -3083,10 +3142,8 @@ class AdveneGUI:
             return True
 
         if self.slider_move:
-            # FIXME: we could have a cache of key images (i.e. 50 equidistant
-            # snapshots, and display them to make the navigation in the
-            # stream easier
-            pass
+            # Display the closest keyframe instead of seeking the player
+            self.display_scrub_preview(self.gui.slider.get_value())
         elif p.status in self.active_player_status:
             if pos != self.time_label.value:
                 self.time_label.set_time(pos)
@@ -3176,8 +3233,7 @@ class AdveneGUI:
                     and ic.refetch_count < ic.MAX_IMAGECACHE_REFETCH_COUNT):
                     # There are some missing snapshots, try to get
                     # them again.
-                    for t in sorted(ic.missing_snapshots()):
-                        c.update_snapshot(t)
+                    c.prefetch_snapshots(sorted(ic.missing_snapshots()))
                     ic.refetch_count += 1
             else:
                 self.snapshotter_monitor_icon.set_state('running')
@@ -3544,9 +3600,10 @@ class AdveneGUI:
         new = fs.get_value(_("Update %(bound)s of %(annotation)s") % { 'bound': translation[bound],
                                                                        'annotation': self.controller.get_title(annotation) })
         if new != t:
-            self.controller.notify('EditSessionStart', element=annotation, immediate=True)
-            setattr(annotation.fragment, bound, new)
-            self.controller.notify('AnnotationEditEnd', annotation=annotation)
+            with self.controller.package_lock.write():
+                self.controller.notify('EditSessionStart', element=annotation, immediate=True)
+                setattr(annotation.fragment, bound, new)
+                self.controller.notify('AnnotationEditEnd', annotation=annotation)
             self.controller.notify('EditSessionEnd', element=annotation)
         return True
 
@@ -4260,7 +4317,7 @@ Image cache information: %(imagecache)s
                         'save-default-workspace', 'restore-default-workspace',
                         'slave-player-sync-delay',
                         'tts-language', 'tts-encoding', 'tts-engine',
-                        'record-actions', 'popup-destination',
+                        'record-actions', 'event-history-size', 'event-history-log', 'popup-destination',
                         'timestamp-format', 'default-fps',
                         'abbreviation-mode', 'text-abbreviations',
                         'completion-mode', 'completion-predefined-only', 'completion-quick-fill',
@@ -4268,6 +4325,7 @@ Image cache information: %(imagecache)s
                         'player-shortcuts-in-edit-windows', 'player-shortcuts-modifier',
                         'apply-edited-elements-on-save', 'use-uuid',
                         'frameselector-count', 'frameselector-width',
+                        'keyframe-interval', 'montage-workers', 'montage-memory-budget', 'montage-stream-copy',
         )
         # Direct options needing a restart to be taken into account.
         restart_needed_options = ('tts-engine', 'language', 'timestamp-format', 'expert-mode')
@@ -4288,6 +4346,7 @@ Image cache information: %(imagecache)s
         for k in direct_options:
             cache[k] = config.data.preferences[k]
         cache['package-auto-save-interval']=cache['package-auto-save-interval']/1000
+        cache['keyframe-interval']=cache['keyframe-interval']/1000
         ew=advene.gui.edit.properties.EditNotebook(cache.__setitem__, cache.get)
         ew.set_name(_("Preferences"))
 
@@ -4306,6 +4365,8 @@ Image cache information: %(imagecache)s
             ("Francais", 'fr_FR'),
         )))
         ew.add_checkbox(_("Record activity trace"), "record-actions", _("Record activity trace"))
+        ew.add_spin(_("Event history size"), "event-history-size", _("Number of recorded events kept in memory"), 100, 1000000)
+        ew.add_entry(_("Event log file"), "event-history-log", _("File to which all recorded events are appended. Empty to disable."))
         ew.add_checkbox(_("Expert mode"), "expert-mode", _("Offer advanced possibilities"))
         ew.add_checkbox(_("Prefer WYSIWYG"), "prefer-wysiwyg", _("Use WYSIWYG editors when possible (HTML, SVG)"))
         ew.add_accelerator(_("Player control modifier"), 'player-shortcuts-modifier', _("Generic player control modifier: key used in combination with arrows/space/tab to control the player. Click the button and press key+space to choose the modifier."))
@@ -4329,6 +4390,14 @@ Image cache information: %(imagecache)s
         ew.add_spin(_("Frameselector snapshot width"), 'frameselector-width', _("Width of the snapshots in frameselector"), 50, 600)
         ew.add_spin(_("Frameselector count"), 'frameselector-count', _("Number of frames displayed in frameselector."), 3, 25)
 
+        ew.add_label(_("Keyframes"))
+        ew.add_spin(_("Keyframe interval (in s)"), 'keyframe-interval', _("Interval (in seconds) between the keyframes captured in the background and displayed while moving the slider. 0 to disable."), 0, 10 * 60)
+
+        ew.add_label(_("Video montage export"))
+        ew.add_spin(_("Encoding processes"), 'montage-workers', _("Number of processes encoding montage clips in parallel. 0 for the number of processors."), 0, 64)
+        ew.add_spin(_("Memory budget (in MB)"), 'montage-memory-budget', _("Maximum memory used by the montage encoding processes. 0 for no limit."), 0, 64 * 1024)
+        ew.add_checkbox(_("Copy the video stream"), 'montage-stream-copy', _("When the montage has the format of the source media, copy its video stream instead of re-encoding it."))
+
         ew.add_title(_("General"))
         ew.add_checkbox(_("Use UUIDs"), 'use-uuid', _("Use UUIDs for identifying elements instead of more readable shortnames"))
         ew.add_checkbox(_("Weekly update check"), 'update-check', _("Weekly check for updates on the Advene website"))
@@ -4465,6 +4534,8 @@ Image cache information: %(imagecache)s
             app_need_restart = False
 
             cache['package-auto-save-interval']=cache['package-auto-save-interval']*1000
+            cache['keyframe-interval']=int(cache['keyframe-interval']*1000)
+            keyframes_changed = cache['keyframe-interval'] != config.data.preferences['keyframe-interval']
             if cache['text-abbreviations'] != config.data.preferences['text-abbreviations']:
                 self.text_abbreviations.clear()
                 self.text_abbreviations.update( dict( l.split(" ", 1) for l in config.data.preferences['text-abbreviations'].splitlines() ) )
@@ -4473,6 +4544,11 @@ Image cache information: %(imagecache)s
                 if k in restart_needed_options and config.data.preferences[k] != cache[k]:
                     app_need_restart = True
                 config.data.preferences[k] = cache[k]
+            if keyframes_changed:
+                self.controller.build_keyframe_strip()
+            event_history = self.controller.event_handler.event_history
+            event_history.set_capacity(config.data.preferences['event-history-size'])
+            event_history.set_log(config.data.preferences['event-history-log'] or None)
 
             for k in ('font-size', 'button-height', 'interline-height'):
                 config.data.preferences['timeline'][k] = cache[k]
@@ -4535,8 +4611,45 @@ Image cache information: %(imagecache)s
     def on_slider_button_release_event (self, button=None, event=None):
         self.controller.update_status('seek', int(self.gui.slider.get_value ()))
         self.slider_move = False
+        if self.scrub_preview is not None:
+            self.scrub_preview.hide()
         return
 
+    def display_scrub_preview(self, position):
+        """Display the keyframe closest to position above the slider.
+
+        Keyframes come from the imagecache (see
+        controller.build_keyframe_strip), so that no seek is done
+        while scrubbing.
+        """
+        ic = self.controller.package.imagecache
+        png = ic.nearest(position, max_distance=ic.keyframe_interval or None)
+        if png.is_default:
+            if self.scrub_preview is not None:
+                self.scrub_preview.hide()
+            return
+        w = self.scrub_preview
+        if w is None:
+            w = Gtk.Window(Gtk.WindowType.POPUP)
+            w.set_decorated(False)
+            w.image = Gtk.Image()
+            w.add(w.image)
+            w.image.show()
+            w.snapshot = None
+            self.scrub_preview = w
+        if png is not w.snapshot:
+            w.snapshot = png
+            w.image.set_from_pixbuf(png_to_pixbuf(png, width=config.data.player['snapshot-width']))
+        # Place the preview above the pointer
+        slider = self.gui.slider
+        alloc = slider.get_allocation()
+        origin = slider.get_window().get_origin()
+        x, y = slider.get_pointer()
+        width, height = w.get_size()
+        w.move(origin.x + alloc.x + x - width // 2,
+               origin.y + alloc.y - height - 4)
+        w.show()
+
     def on_slider_scroll_event (self, widget=None, event=None):
         incr = 0
         if event.direction == Gdk.ScrollDirection.DOWN or event.direction == Gdk.ScrollDirection.RIGHT:
@@ -108,9 +108,10 @@ class ShotValidation(AdhocView):
         previous = self.annotations[i - 1]
         batch=object()
 
-        self.controller.notify('EditSessionStart', element=previous, immediate=True)
-        previous.fragment.end = annotation.fragment.end
-        self.controller.notify('AnnotationEditEnd', annotation=previous, batch=batch)
+        with self.controller.package_lock.write():
+            self.controller.notify('EditSessionStart', element=previous, immediate=True)
+            previous.fragment.end = annotation.fragment.end
+            self.controller.notify('AnnotationEditEnd', annotation=previous, batch=batch)
         self.controller.notify('EditSessionEnd', element=previous)
         self.annotations.remove(annotation)
         self.controller.delete_element(annotation, immediate_notify=True, batch=batch)
@@ -174,9 +175,10 @@ class ShotValidation(AdhocView):
 
         if new != annotation.fragment.begin:
             logger.debug("Updating annotation begin from %s to %s", helper.format_time(annotation.fragment.begin), helper.format_time_reference(new))
-            self.controller.notify('EditSessionStart', element=annotation, immediate=True)
-            annotation.fragment.begin = new
-            self.controller.notify('AnnotationEditEnd', annotation=annotation, batch=batch)
+            with self.controller.package_lock.write():
+                self.controller.notify('EditSessionStart', element=annotation, immediate=True)
+                annotation.fragment.begin = new
+                self.controller.notify('AnnotationEditEnd', annotation=annotation, batch=batch)
             self.controller.notify('EditSessionEnd', element=annotation)
             self.undo_button.set_sensitive(True)
 
@@ -184,9 +186,10 @@ class ShotValidation(AdhocView):
         if i > 0:
             annotation = self.annotations[i - 1]
             if new != annotation.fragment.end:
-                self.controller.notify('EditSessionStart', element=annotation, immediate=True)
-                annotation.fragment.end = new
-                self.controller.notify('AnnotationEditEnd', annotation=annotation, batch=batch)
+                with self.controller.package_lock.write():
+                    self.controller.notify('EditSessionStart', element=annotation, immediate=True)
+                    annotation.fragment.end = new
+                    self.controller.notify('AnnotationEditEnd', annotation=annotation, batch=batch)
                 self.controller.notify('EditSessionEnd', element=annotation)
             self.message(_("Changed cut between #%(first)d and %(second)d") % { 'first': i + 1,
                                                                                 'second': i + 2 })
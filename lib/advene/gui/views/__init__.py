@@ -311,27 +311,28 @@ class AdhocView:
                 return True
 
             v=helper.get_id(self.controller.package.views, ident)
-            if v is None:
-                create=True
-                v=self.controller.package.createView(ident=ident, clazz='package')
-            else:
-                # Existing view. Check that it is already an adhoc-view
-                if v.content.mimetype != 'application/x-advene-adhoc-view':
-                    dialog.message_dialog(_("Error: the view %s is not an adhoc view.") % ident)
-                    return True
-                create=False
-                self.controller.notify('EditSessionStart', element=v, immediate=True)
-            v.title=title
-            v.author=config.data.userid
-            v.date=helper.get_timestamp()
-
-            self.save_parameters(v.content, options, arguments)
-            if create:
-                self.controller.package.views.append(v)
-                self.controller.notify("ViewCreate", view=v)
-            else:
-                self.controller.notify("ViewEditEnd", view=v)
-                self.controller.notify('EditSessionEnd', element=v)
+            # Existing view. Check that it is already an adhoc-view
+            if v is not None and v.content.mimetype != 'application/x-advene-adhoc-view':
+                dialog.message_dialog(_("Error: the view %s is not an adhoc view.") % ident)
+                return True
+            with self.controller.package_lock.write():
+                if v is None:
+                    create=True
+                    v=self.controller.package.createView(ident=ident, clazz='package')
+                else:
+                    create=False
+                    self.controller.notify('EditSessionStart', element=v, immediate=True)
+                v.title=title
+                v.author=config.data.userid
+                v.date=helper.get_timestamp()
+
+                self.save_parameters(v.content, options, arguments)
+                if create:
+                    self.controller.package.views.append(v)
+                    self.controller.notify("ViewCreate", view=v)
+                else:
+                    self.controller.notify("ViewEditEnd", view=v)
+                    self.controller.notify('EditSessionEnd', element=v)
         return True
 
     def export_as_static_view(self, ident=None):
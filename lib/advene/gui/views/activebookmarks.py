@@ -230,9 +230,10 @@ class ActiveBookmarks(AdhocView):
         for wid in self.bookmarks:
             if wid.annotation is not None and wid.content != wid.annotation.content.data:
                 # Mismatch in contents -> update the annotation
-                self.controller.notify('EditSessionStart', element=wid.annotation, immediate=True)
-                wid.annotation.content.data=wid.content
-                self.controller.notify('AnnotationEditEnd', annotation=wid.annotation)
+                with self.controller.package_lock.write():
+                    self.controller.notify('EditSessionStart', element=wid.annotation, immediate=True)
+                    wid.annotation.content.data=wid.content
+                    self.controller.notify('AnnotationEditEnd', annotation=wid.annotation)
                 self.controller.notify('EditSessionEnd', element=wid.annotation)
         return True
 
@@ -1037,10 +1038,11 @@ class ActiveBookmark:
                 self.set_frame_attributes()
             else:
                 # Update the annotation
-                self.controller.notify('EditSessionStart', element=self.annotation, immediate=True)
-                self.annotation.fragment.begin=self.begin
-                self.annotation.fragment.end=self.end
-                self.controller.notify('AnnotationEditEnd', annotation=self.annotation)
+                with self.controller.package_lock.write():
+                    self.controller.notify('EditSessionStart', element=self.annotation, immediate=True)
+                    self.annotation.fragment.begin=self.begin
+                    self.annotation.fragment.end=self.end
+                    self.controller.notify('AnnotationEditEnd', annotation=self.annotation)
                 self.controller.notify('EditSessionEnd', element=self.annotation)
         return True
 
@@ -245,9 +245,10 @@ class AnnotationDisplay(AdhocView):
         def handle_ok(b):
             b.hide()
             if isinstance(self.annotation, Annotation):
-                self.controller.notify('EditSessionStart', element=self.annotation, immediate=True)
-                self.annotation.content.data = self.label['contents'].get_text()
-                self.controller.notify("AnnotationEditEnd", annotation=self.annotation)
+                with self.controller.package_lock.write():
+                    self.controller.notify('EditSessionStart', element=self.annotation, immediate=True)
+                    self.annotation.content.data = self.label['contents'].get_text()
+                    self.controller.notify("AnnotationEditEnd", annotation=self.annotation)
                 self.controller.notify('EditSessionEnd', element=self.annotation)
             return True
 
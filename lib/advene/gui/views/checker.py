@@ -25,19 +25,18 @@ from gi.repository import Gtk
 
 from gettext import gettext as _
 
-import advene.core.config as config
 import advene.gui.util.dialog as dialog
 from advene.gui.views import AdhocView
 from advene.gui.views.table import AnnotationTable, GenericTable
 import advene.gui.views.table
-import advene.util.helper as helper
-
+from advene.util.checker import CheckerEngine
 
 CHECKERS = {}
 def register_checker(checker):
     """Register a checker
     """
     CHECKERS[checker.__name__] = checker
+    return checker
 
 def get_checker(name):
     """Return the checker corresponding to name.
@@ -46,22 +45,37 @@ def get_checker(name):
 
 class FeatureChecker:
     """API for feature checking.
+
+    The issues are computed by the corresponding checker from
+    advene.util.checker (same class name), the view only presents
+    them.
     """
     name = "Abstract FeatureChecker"
-    def __init__(self, controller=None):
+    def __init__(self, controller=None, checker=None):
         self.controller = controller
+        self.checker = checker
         self.widget = self.build_widget()
 
+    @property
+    def description(self):
+        return self.checker.description
+
     def build_widget(self):
         return Gtk.Label("Abstract checker")
 
+    def custom_data(self, el):
+        return None
+
     def update_model(self, package=None):
+        if self.custom_data(None) is None:
+            self.table.set_elements(self.checker.elements())
+        else:
+            self.table.set_elements(self.checker.elements(), self.custom_data)
         return True
 
 @register_checker
 class OverlappingChecker(FeatureChecker):
     name = "Overlapping"
-    description = _("This table presents for each type annotations that are overlapping.")
     def build_widget(self):
         self.table = AnnotationTable(controller=self.controller)
         # Set colors
@@ -73,134 +87,70 @@ class OverlappingChecker(FeatureChecker):
                                                 advene.gui.views.table.COLUMN_CUSTOM_FIRST + 1)
         return self.table.widget
 
-    def overlapping_annotations(self):
-        """Return a list of overlapping annotations for each annotation type.
-
-        It returns 2 sets of elements: the ones which have a potentialy
-        bogus begin time, and the ones with a potentialy bogus end
-        time.
-        """
-        begins = set()
-        ends = set()
-        for at in self.controller.package.annotationTypes:
-            for a, b in zip(at.annotations, at.annotations[1:]):
-                if a.fragment.end > b.fragment.begin:
-                    ends.add(a)
-                    begins.add(b)
-        return begins, ends
+    def custom_data(self, a):
+        if a is None:
+            return (str, str)
+        begin, end = self.checker.detail(a)
+        return ("#ff6666" if begin else None,
+                "#ff6666" if end else None)
 
     def update_model(self, package=None):
-        begins, ends = self.overlapping_annotations()
-        overlap = list(begins.union(ends))
-
-        def custom_data(b):
-            if b is None:
-                return (str, str)
-            begin, end = None, None
-            if b in begins:
-                begin = "#ff6666"
-            if b in ends:
-                end = "#ff6666"
-            return (begin, end)
-        self.table.set_elements(overlap, custom_data)
+        super().update_model(package)
         self.table.model.set_sort_column_id(advene.gui.views.table.COLUMN_TYPE, Gtk.SortType.ASCENDING)
 
 @register_checker
 class CompletionChecker(FeatureChecker):
     name = "Completions"
-    description = _("For every annotation type that has predefined keywords, this table displays the annotations that contain unspecified keywords.")
     def build_widget(self):
         self.table = AnnotationTable(controller=self.controller, custom_data=lambda a: (str, ))
         column = self.table.columns['custom0']
         column.props.title = _("Undef. keywords")
         return self.table.widget
 
+    def custom_data(self, a):
+        if a is None:
+            return (str, )
+        return self.checker.detail(a)
+
     def update_model(self, package=None):
-        # Dictionary indexed by annotation, where values are the
-        # keyword diff
-        diff_dict = {}
-        def custom_data(a):
-            if a is None:
-                return (str, )
-            else:
-                return (diff_dict.get(a, ""), )
-
-        for at in self.controller.package.annotationTypes:
-            completions = set(helper.get_type_predefined_completions(at))
-            if completions:
-                # There are completions. Check for every annotation if
-                # they use a keyword not predefined.
-                for a in at.annotations:
-                    kws = set(a.content.parsed())
-                    diff = kws - completions
-                    if diff:
-                        # There are used keywords that are not completions
-                        diff_dict[a] = ",".join(diff)
-        self.table.set_elements(list(diff_dict.keys()), custom_data)
+        super().update_model(package)
         self.table.model.set_sort_column_id(advene.gui.views.table.COLUMN_TYPE, Gtk.SortType.ASCENDING)
 
 @register_checker
 class OntologyURIChecker(FeatureChecker):
     name = "Ontology URI"
-    description = _("This table presents elements (package, schemas, annotation types) that do not have the ontology_uri reference metadata.")
     def build_widget(self):
         self.table = GenericTable(controller=self.controller)
         return self.table.widget
 
-    def update_model(self, package=None):
-        def check_element(el):
-            return el.getMetaData(config.data.namespace, "ontology_uri")
-
-        invalid = []
-        if not check_element(self.controller.package):
-            invalid.append(self.controller.package)
-        invalid.extend(el for el in self.controller.package.schemas if not check_element(el))
-        invalid.extend(el for el in self.controller.package.annotationTypes if not check_element(el))
-        self.table.set_elements(invalid)
-
 @register_checker
 class DurationChecker(FeatureChecker):
     name = "Duration"
-    description = _("This table presents the annotations that have a null duration.")
     def build_widget(self):
         self.table = AnnotationTable(controller=self.controller)
         return self.table.widget
 
-    def update_model(self, package=None):
-        self.table.set_elements([ a for a in self.controller.package.annotations
-                                  if not a.fragment.duration ])
-
 @register_checker
 class TypeChecker(FeatureChecker):
     name = "Type"
-    description = _("This table presents annotation whose content types does not match their type's content-type")
     def build_widget(self):
         self.table = AnnotationTable(controller=self.controller, custom_data=lambda a: (str, str))
         self.table.columns['custom0'].props.title = 'content mimetype'
         self.table.columns['custom1'].props.title = 'type mimetype'
         return self.table.widget
 
-    def update_model(self, package=None):
-        def custom_data(a):
-            if a is None:
-                return (str, str)
-            else:
-                return (a.content.mimetype, a.type.mimetype)
-        self.table.set_elements([ a for a in self.controller.package.annotations
-                                  if a.content.mimetype != a.type.mimetype ], custom_data)
+    def custom_data(self, a):
+        if a is None:
+            return (str, str)
+        return self.checker.detail(a)
 
 @register_checker
 class EmptyContentChecker(FeatureChecker):
     name = "EmptyContent"
-    description = _("This table presents the annotations that have an empty content.")
     def build_widget(self):
         self.table = AnnotationTable(controller=self.controller)
         return self.table.widget
 
-    def update_model(self, package=None):
-        self.table.set_elements([ a for a in self.controller.package.annotations
-                                  if not a.content.data ])
-
 class CheckerView(AdhocView):
     view_name = _("Checker")
     view_id = 'checker'
@@ -223,10 +173,6 @@ class CheckerView(AdhocView):
         opt, arg = self.load_parameters(parameters)
         self.options.update(opt)
         self.widget = self.build_widget()
-        self.update_annotation = self.update_model
-        self.update_relation = self.update_model
-        self.update_annotationtype = self.update_model
-        self.update_relationtype = self.update_model
         self.update_model()
 
     def select_active_checkers(self):
@@ -264,9 +210,40 @@ class CheckerView(AdhocView):
         return True
 
     def update_model(self, *p, **kw):
+        """Check the whole package again.
+        """
+        self.engine.reset(self.controller.package)
         for checker in self.checkers:
             checker.update_model()
 
+    def update_element(self, element, event):
+        """Update the issues after an element event.
+
+        Only the tables whose issues changed are rebuilt.
+        """
+        changed = self.engine.update_element(element, event)
+        for checker in self.checkers:
+            if checker.__class__.__name__ in changed:
+                checker.update_model()
+        return True
+
+    def update_annotation(self, annotation=None, event=None):
+        return self.update_element(annotation, event)
+
+    def update_annotationtype(self, annotationtype=None, event=None):
+        return self.update_element(annotationtype, event)
+
+    def update_annotation_batch(self, changes):
+        """Update the issues after a batch of annotation events.
+        """
+        changed = set()
+        for (annotation, event) in changes:
+            changed.update(self.engine.update_element(annotation, event))
+        for checker in self.checkers:
+            if checker.__class__.__name__ in changed:
+                checker.update_model()
+        return True
+
     def active_checkers(self):
         active = self.options.get('active_checkers')
         if active:
@@ -282,8 +259,12 @@ class CheckerView(AdhocView):
             self.notebook.remove_page(i - 1)
         self.checkers = []
 
-        for checkerclass in self.active_checkers():
-            checker = checkerclass(self.controller)
+        checkerclasses = list(self.active_checkers())
+        # The issues are computed by update_model
+        self.engine = CheckerEngine(None, [ c.__name__ for c in checkerclasses ])
+        for checkerclass in checkerclasses:
+            checker = checkerclass(self.controller,
+                                   self.engine.checkers.get(checkerclass.__name__))
             self.checkers.append(checker)
             vbox = Gtk.VBox()
             description = Gtk.Label.new(checker.description)
@@ -305,7 +286,3 @@ class CheckerView(AdhocView):
 
         self.build_checkers()
         return mainbox
-
-    def update_annotation (self, annotation=None, event=None):
-        self.update_model()
-        return True
@@ -141,29 +141,30 @@ class InteractiveQuery(AdhocView):
         if i is None:
             return True
 
-        q=helper.get_id(self.controller.package.queries, i)
-        # Overwriting an existing query
-        if q:
-            create=False
-            self.controller.notify('EditSessionStart', element=q, immediate=True)
-        else:
-            create=True
-            # Create the query
-            q=self.controller.package.createQuery(ident=i)
-            q.author=config.data.userid
-            q.date=helper.get_timestamp()
-            self.controller.package.queries.append(q)
-
-        q.title=t
-        q.content.mimetype='application/x-advene-simplequery'
+        with self.controller.package_lock.write():
+            q=helper.get_id(self.controller.package.queries, i)
+            # Overwriting an existing query
+            if q:
+                create=False
+                self.controller.notify('EditSessionStart', element=q, immediate=True)
+            else:
+                create=True
+                # Create the query
+                q=self.controller.package.createQuery(ident=i)
+                q.author=config.data.userid
+                q.date=helper.get_timestamp()
+                self.controller.package.queries.append(q)
+
+            q.title=t
+            q.content.mimetype='application/x-advene-simplequery'
 
-        # Store the query itself in the _interactive query
-        q.content.data = self.eq.model.xml_repr()
-        if create:
-            self.controller.notify('QueryCreate', query=q)
-        else:
-            self.controller.notify('QueryEditEnd', query=q)
-            self.controller.notify('EditSessionEnd', element=q)
+            # Store the query itself in the _interactive query
+            q.content.data = self.eq.model.xml_repr()
+            if create:
+                self.controller.notify('QueryCreate', query=q)
+            else:
+                self.controller.notify('QueryEditEnd', query=q)
+                self.controller.notify('EditSessionEnd', element=q)
         return q
 
     def validate(self, button=None):
@@ -301,28 +302,29 @@ class InteractiveResult(AdhocView):
         if i is None:
             return True
 
-        q=helper.get_id(self.controller.package.queries, i)
-        # Overwriting an existing query
-        if q:
-            create=False
-        else:
-            create=True
-            # Create the query
-            q=self.controller.package.createQuery(ident=i)
-            q.author=config.data.userid
-            q.date=helper.get_timestamp()
-            self.controller.package.queries.append(q)
-
-        q.title=t
-        if isinstance(self.query, SimpleQuery):
-            q.content.mimetype='application/x-advene-simplequery'
-        elif isinstance(self.query, Quicksearch):
-            q.content.mimetype='application/x-advene-quicksearch'
-        q.content.data = self.query.xml_repr()
-        if create:
-            self.controller.notify('QueryCreate', query=q)
-        else:
-            self.controller.notify('QueryEditEnd', query=q)
+        with self.controller.package_lock.write():
+            q=helper.get_id(self.controller.package.queries, i)
+            # Overwriting an existing query
+            if q:
+                create=False
+            else:
+                create=True
+                # Create the query
+                q=self.controller.package.createQuery(ident=i)
+                q.author=config.data.userid
+                q.date=helper.get_timestamp()
+                self.controller.package.queries.append(q)
+
+            q.title=t
+            if isinstance(self.query, SimpleQuery):
+                q.content.mimetype='application/x-advene-simplequery'
+            elif isinstance(self.query, Quicksearch):
+                q.content.mimetype='application/x-advene-quicksearch'
+            q.content.data = self.query.xml_repr()
+            if create:
+                self.controller.notify('QueryCreate', query=q)
+            else:
+                self.controller.notify('QueryEditEnd', query=q)
         return q
 
     def create_comment(self, *p):
@@ -280,9 +280,10 @@ class AnnotationTable(AdhocView):
                 self.log(_("Cannot update the annotation, its representation is too complex"))
             elif a.content.data != new_content:
                 self.last_edited_path = Gtk.TreePath.new_from_string(path_string)
-                self.controller.notify('EditSessionStart', element=a)
-                a.content.data = new_content
-                self.controller.notify('AnnotationEditEnd', annotation=a)
+                with self.controller.package_lock.write():
+                    self.controller.notify('EditSessionStart', element=a)
+                    a.content.data = new_content
+                    self.controller.notify('AnnotationEditEnd', annotation=a)
                 self.controller.notify('EditSessionEnd', element=a)
             return True
 
@@ -505,9 +506,10 @@ class AnnotationTable(AdhocView):
                 }, icon=Gtk.MessageType.QUESTION)
         if confirm:
             self.last_edited_path = an_path
-            self.controller.notify('EditSessionStart', element=an, immediate=True)
-            setattr(an.fragment, attr, current_time)
-            self.controller.notify("AnnotationEditEnd", annotation=an)
+            with self.controller.package_lock.write():
+                self.controller.notify('EditSessionStart', element=an, immediate=True)
+                setattr(an.fragment, attr, current_time)
+                self.controller.notify("AnnotationEditEnd", annotation=an)
             self.controller.notify('EditSessionEnd', element=an)
 
 
@@ -413,9 +413,18 @@ class TimeLine(AdhocView):
         self.should_display_type_selection_popup = False
         if self.edit_type_selection_popup  is not None:
             self.edit_type_selection_popup.destroy()
+        self.controller.scheduler.set_visible_range(None, None)
         super().close()
         return True
 
+    def update_visible_range(self, adj=None):
+        """Run first the background jobs related to the displayed area.
+        """
+        a = self.adjustment
+        self.controller.scheduler.set_visible_range(self.pixel2unit(a.get_value(), absolute=True),
+                                                    self.pixel2unit(a.get_value() + a.get_page_size(), absolute=True))
+        return False
+
     def get_inspector_size(self):
         return self.inspector_pane.get_clip().width - self.inspector_pane.get_position()
 
@@ -1083,6 +1092,25 @@ class TimeLine(AdhocView):
             logger.warning("Unknown event %s", event)
         return True
 
+    def update_annotation_batch(self, changes):
+        """Update the representation of a batch of annotations.
+
+        changes is a list of (annotation, event) pairs.
+        """
+        displayed = set(self.get_annotations())
+        for (annotation, event) in changes:
+            if event == 'AnnotationCreate':
+                if (annotation in displayed
+                    and self.get_widget_for_annotation(annotation) is None):
+                    self.create_annotation_widget(annotation)
+            elif event == 'AnnotationEditEnd':
+                b = self.get_widget_for_annotation(annotation)
+                if b is not None:
+                    self.update_button (b)
+            elif event == 'AnnotationDelete':
+                self.delete_annotation_widget(annotation)
+        return True
+
     def update_annotationtype(self, annotationtype=None, event=None):
         """Update an annotationtype's representation.
         """
@@ -1092,7 +1120,7 @@ class TimeLine(AdhocView):
             self.update_layer_position(new_at=annotationtype)
             self.update_legend_widget()
             # Populate with new annotations
-            self.populate(annotations=annotationtype.annotations)
+            self.populate(annotations=self.controller.get_type_annotations(annotationtype))
         elif event == 'AnnotationTypeEditEnd':
             self.update_legend_widget()
             self.legend.show_all()
@@ -1173,10 +1201,11 @@ class TimeLine(AdhocView):
 
 
         if new['begin'] < new['end']:
-            self.controller.notify('EditSessionStart', element=source, immediate=True)
-            for k in ('begin', 'end'):
-                setattr(source.fragment, k, new[k])
-            self.controller.notify("AnnotationEditEnd", annotation=source)
+            with self.controller.package_lock.write():
+                self.controller.notify('EditSessionStart', element=source, immediate=True)
+                for k in ('begin', 'end'):
+                    setattr(source.fragment, k, new[k])
+                self.controller.notify("AnnotationEditEnd", annotation=source)
             self.controller.notify('EditSessionEnd', element=source)
         return True
 
@@ -1320,9 +1349,10 @@ class TimeLine(AdhocView):
             tags=str(selection.get_data(), 'utf8').split(',')
             a=widget.annotation
             l=[t for t in tags if not t in a.tags ]
-            self.controller.notify('EditSessionStart', element=a, immediate=True)
-            a.tags = a.tags + l
-            self.controller.notify('AnnotationEditEnd', annotation=a)
+            with self.controller.package_lock.write():
+                self.controller.notify('EditSessionStart', element=a, immediate=True)
+                a.tags = a.tags + l
+                self.controller.notify('AnnotationEditEnd', annotation=a)
             self.controller.notify('EditSessionEnd', element=a)
         else:
             logger.warning("Unknown target type for drop: %d", targetType)
@@ -1604,13 +1634,14 @@ class TimeLine(AdhocView):
             batch_id=object()
             for (i,j) in enumerate(bestpath[len(sa)-1]):
                 annotation=da[i]
-                self.controller.notify('EditSessionStart', element=annotation, immediate=True)
-                if mode == 'time':
-                    annotation.fragment.begin = sa[j].fragment.begin
-                    annotation.fragment.end = sa[j].fragment.end
-                elif mode == 'content':
-                    annotation.content.data = sa[j].content.data
-                self.controller.notify('AnnotationEditEnd', annotation=annotation, batch=batch_id)
+                with self.controller.package_lock.write():
+                    self.controller.notify('EditSessionStart', element=annotation, immediate=True)
+                    if mode == 'time':
+                        annotation.fragment.begin = sa[j].fragment.begin
+                        annotation.fragment.end = sa[j].fragment.end
+                    elif mode == 'content':
+                        annotation.content.data = sa[j].content.data
+                    self.controller.notify('AnnotationEditEnd', annotation=annotation, batch=batch_id)
                 self.controller.notify('EditSessionEnd', element=annotation)
             return True
 
@@ -1694,9 +1725,10 @@ class TimeLine(AdhocView):
         attr = widget.is_resizing()
         if attr and widget.resize_time is not None:
             ann = widget.annotation
-            self.controller.notify('EditSessionStart', element=ann, immediate=True)
-            setattr(ann.fragment, attr, widget.resize_time)
-            self.controller.notify('AnnotationEditEnd', annotation=ann)
+            with self.controller.package_lock.write():
+                self.controller.notify('EditSessionStart', element=ann, immediate=True)
+                setattr(ann.fragment, attr, widget.resize_time)
+                self.controller.notify('AnnotationEditEnd', annotation=ann)
             self.controller.notify('EditSessionEnd', element=ann)
         return False
 
@@ -1786,11 +1818,12 @@ class TimeLine(AdhocView):
             else:
                 return False
             f=annotation.fragment
-            self.controller.notify('EditSessionStart', element=annotation, immediate=True)
-            setattr(f, at, int(self.controller.player.current_position_value))
-            if f.begin > f.end:
-                f.begin, f.end = f.end, f.begin
-            self.controller.notify('AnnotationEditEnd', annotation=annotation)
+            with self.controller.package_lock.write():
+                self.controller.notify('EditSessionStart', element=annotation, immediate=True)
+                setattr(f, at, int(self.controller.player.current_position_value))
+                if f.begin > f.end:
+                    f.begin, f.end = f.end, f.begin
+                self.controller.notify('AnnotationEditEnd', annotation=annotation)
             self.controller.notify('EditSessionEnd', element=annotation)
             return True
         elif (event.button == 1
@@ -1846,9 +1879,10 @@ class TimeLine(AdhocView):
                     if cb:
                         cb('validate', ann)
                     if r != ann.content.data:
-                        self.controller.notify('EditSessionStart', element=ann, immediate=True)
-                        ann.content.data = r
-                        controller.notify('AnnotationEditEnd', annotation=ann)
+                        with self.controller.package_lock.write():
+                            self.controller.notify('EditSessionStart', element=ann, immediate=True)
+                            ann.content.data = r
+                            controller.notify('AnnotationEditEnd', annotation=ann)
                         self.controller.notify('EditSessionEnd', element=ann)
                 close_eb(widget)
                 return True
@@ -1869,24 +1903,22 @@ class TimeLine(AdhocView):
                     if cb:
                         cb('validate', ann)
                     if r != ann.content.data:
-                        self.controller.notify('EditSessionStart', element=ann, immediate=True)
-                        ann.content.data = r
-                        controller.notify('AnnotationEditEnd', annotation=ann)
+                        with self.controller.package_lock.write():
+                            self.controller.notify('EditSessionStart', element=ann, immediate=True)
+                            ann.content.data = r
+                            controller.notify('AnnotationEditEnd', annotation=ann)
                         self.controller.notify('EditSessionEnd', element=ann)
                 # Navigate
                 b=ann.fragment.begin
                 if event.get_state() & Gdk.ModifierType.SHIFT_MASK:
                     # Previous.
                     l=[a
-                       for a in ann.type.annotations
+                       for a in reversed(self.controller.get_type_annotations(ann.type))
                        if a.fragment.end < b ]
-                    # Sort in reverse order
-                    l.sort(key=lambda a: a.fragment.begin, reverse=True)
                 else:
                     l=[a
-                       for a in ann.type.annotations
+                       for a in self.controller.get_type_annotations(ann.type)
                        if a.fragment.begin > b ]
-                    l.sort(key=lambda a: a.fragment.begin)
                 if l:
                     # Edit the previous/next one
                     self.quick_edit(l[0], callback=cb)
@@ -2107,19 +2139,20 @@ class TimeLine(AdhocView):
             fr=button.annotation_fraction()
             f=button.annotation.fragment
 
-            self.controller.notify('EditSessionStart', element=button.annotation, immediate=True)
+            with self.controller.package_lock.write():
+                self.controller.notify('EditSessionStart', element=button.annotation, immediate=True)
 
-            newpos = None
-            if event.get_state() & Gdk.ModifierType.SHIFT_MASK:
-                f.begin += incr
-                f.end += incr
-                newpos = f.begin
-            elif fr < .5:
-                f.begin += incr
-                newpos = f.begin
-            elif fr >= .5:
-                f.end += incr
-                newpos = f.end
+                newpos = None
+                if event.get_state() & Gdk.ModifierType.SHIFT_MASK:
+                    f.begin += incr
+                    f.end += incr
+                    newpos = f.begin
+                elif fr < .5:
+                    f.begin += incr
+                    newpos = f.begin
+                elif fr >= .5:
+                    f.end += incr
+                    newpos = f.end
 
             self.controller.player_delayed_scrub(newpos)
 
@@ -2262,9 +2295,13 @@ class TimeLine(AdhocView):
             """Lazy-loading of images
             """
             png = self.controller.get_snapshot(position=widget.mark, precision=step/2)
+            widget.valid_screenshot = not png.is_default
+            if png.is_default:
+                # Display the closest keyframe until the snapshot is captured
+                ic = self.controller.package.imagecache
+                png = ic.nearest(widget.mark, max_distance=ic.keyframe_interval or step)
             widget.timestamp=png.timestamp
             widget.set_from_pixbuf(png_to_pixbuf (png, height=max(20, h)))
-            widget.valid_screenshot = not png.is_default
             if widget.expose_signal is not None:
                 widget.disconnect(widget.expose_signal)
                 widget.expose_signal = None
@@ -2503,9 +2540,10 @@ class TimeLine(AdhocView):
                 an.fragment.end = v
             elif action == 'cancel':
                 # Delete the annotation
-                self.controller.notify('EditSessionStart', element=an, immediate=True)
-                self.controller.package.annotations.remove(an)
-                self.controller.notify('AnnotationDelete', annotation=an)
+                with self.controller.package_lock.write():
+                    self.controller.notify('EditSessionStart', element=an, immediate=True)
+                    self.controller.package.annotations.remove(an)
+                    self.controller.notify('AnnotationDelete', annotation=an)
             return True
 
         # Note: event.(x|y) may be relative to a child widget, so
@@ -3030,9 +3068,10 @@ class TimeLine(AdhocView):
                         an.fragment.end = v
                     elif action == 'cancel':
                         # Delete the annotation
-                        self.controller.notify('EditSessionStart', element=an, immediate=True)
-                        self.controller.package.annotations.remove(an)
-                        self.controller.notify('AnnotationDelete', annotation=an)
+                        with self.controller.package_lock.write():
+                            self.controller.notify('EditSessionStart', element=an, immediate=True)
+                            self.controller.package.annotations.remove(an)
+                            self.controller.notify('AnnotationDelete', annotation=an)
                     return True
 
                 if self.controller.player.is_playing():
@@ -3402,6 +3441,8 @@ class TimeLine(AdhocView):
         sw_layout.set_name('sw_layout')
         sw_layout.set_policy (Gtk.PolicyType.ALWAYS, Gtk.PolicyType.AUTOMATIC)
         sw_layout.set_hadjustment (self.adjustment)
+        self.adjustment.connect('value-changed', self.update_visible_range)
+        self.adjustment.connect('changed', self.update_visible_range)
         self.vadjustment = sw_legend.get_vadjustment()
         sw_layout.set_vadjustment (self.vadjustment)
         sw_layout.add (self.layout)
@@ -3945,9 +3986,10 @@ class TimeLine(AdhocView):
                 l.sort(key=lambda a: a.fragment.begin)
                 end=max( a.fragment.end for a in l )
                 # Resize the first annotation
-                self.controller.notify('EditSessionStart', element=l[0], immediate=True)
-                l[0].fragment.end=end
-                self.controller.notify('AnnotationEditEnd', annotation=l[0], batch=batch_id)
+                with self.controller.package_lock.write():
+                    self.controller.notify('EditSessionStart', element=l[0], immediate=True)
+                    l[0].fragment.end=end
+                    self.controller.notify('AnnotationEditEnd', annotation=l[0], batch=batch_id)
                 self.controller.notify('EditSessionEnd', element=l[0])
                 # Remove all others
                 for a in l[1:]:
@@ -3967,8 +4009,9 @@ class TimeLine(AdhocView):
             return True
         batch_id=object()
         for w in selection:
-            self.controller.notify('EditSessionStart', element=w.annotation, immediate=True)
-            w.annotation.addTag(tag)
-            self.controller.notify('AnnotationEditEnd', annotation=w.annotation, batch=batch_id)
+            with self.controller.package_lock.write():
+                self.controller.notify('EditSessionStart', element=w.annotation, immediate=True)
+                w.annotation.addTag(tag)
+                self.controller.notify('AnnotationEditEnd', annotation=w.annotation, batch=batch_id)
             self.controller.notify('EditSessionEnd', element=w.annotation)
         return True
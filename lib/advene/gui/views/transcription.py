@@ -21,6 +21,7 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from bisect import bisect_left
 import re
 
 from gi.repository import Gdk
@@ -48,6 +49,87 @@ ZERO_WIDTH_NOBREAK_SPACE = "\uFEFF"
 def register(controller):
     controller.register_viewclass(TranscriptionView)
 
+class AnnotationIndex:
+    """Annotations of a transcription, in the order of the buffer.
+
+    Annotations are sorted by (begin, id). The key of each annotation
+    is kept, so that modified annotations can still be located.
+    """
+    def __init__(self, annotations=()):
+        self.key_of = dict( (a, self.sort_key(a)) for a in annotations )
+        self.annotations = sorted(self.key_of, key=self.key_of.get)
+        self.keys = [ self.key_of[a] for a in self.annotations ]
+
+    @staticmethod
+    def sort_key(a):
+        return (a.fragment.begin, a.id)
+
+    def __len__(self):
+        return len(self.annotations)
+
+    def __iter__(self):
+        return iter(self.annotations)
+
+    def __contains__(self, a):
+        return a in self.key_of
+
+    def __getitem__(self, i):
+        return self.annotations[i]
+
+    def index(self, a):
+        """Return the rank of the annotation.
+        """
+        i = bisect_left(self.keys, self.key_of[a])
+        # Annotations from different packages may have the same key
+        while self.annotations[i] is not a:
+            i += 1
+        return i
+
+    def add(self, a):
+        """Insert the annotation and return its rank.
+        """
+        key = self.sort_key(a)
+        i = bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.annotations.insert(i, a)
+        self.key_of[a] = key
+        return i
+
+    def remove(self, a):
+        """Remove the annotation and return its former rank.
+        """
+        i = self.index(a)
+        del self.keys[i]
+        del self.annotations[i]
+        del self.key_of[a]
+        return i
+
+    def find(self, offset, begin_offset, end_offset):
+        """Return the annotation whose text contains offset.
+
+        begin_offset and end_offset are functions returning the
+        offsets of the bounds of the text of an annotation. They are
+        called O(log n) times.
+
+        None is returned if offset is on a bound, or between
+        annotations.
+        """
+        lo, hi = 0, len(self.annotations)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if begin_offset(self.annotations[mid]) < offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.annotations) and begin_offset(self.annotations[lo]) == offset:
+            return None
+        if lo == 0:
+            return None
+        a = self.annotations[lo - 1]
+        if offset < end_offset(a):
+            return a
+        return None
+
 class TranscriptionView(AdhocView):
     view_name = _("Transcription")
     view_id = 'transcription'
@@ -95,6 +177,8 @@ class TranscriptionView(AdhocView):
         self.elements = elements
 
         self.model=[]
+        # Annotations in buffer order
+        self.index=AnnotationIndex()
         self.regenerate_model()
 
         # Annotation where the cursor is set
@@ -141,9 +225,32 @@ class TranscriptionView(AdhocView):
 
     def regenerate_model(self):
         if not self.source:
-            self.model=self.elements[:]
+            model=self.elements[:]
         else:
-            self.model = self.get_elements_from_source(self.source)
+            model=self.get_elements_from_source(self.source)
+        self.index=AnnotationIndex(model)
+        # The model is kept in sync with the index
+        self.model=self.index.annotations
+
+    def source_filter(self):
+        """Return a function checking if an annotation belongs to the source.
+
+        It is used to handle new annotations without evaluating the
+        source again. None is returned if the source expression is
+        not a known one.
+        """
+        if not self.source:
+            # Fixed list of elements
+            return lambda a: False
+        if self.source == 'global_annotations':
+            return lambda a: True
+        if re.match(r'^here/annotations(/sorted)?$', self.source):
+            return lambda a: a.ownerPackage == self.controller.package
+        m = re.match(r'^here/annotationTypes/([^/]+)/annotations(/sorted)?$', self.source)
+        if m:
+            typeid = m.group(1)
+            return lambda a: a.ownerPackage == self.controller.package and a.type.id == typeid
+        return None
 
     def edit_options(self, button):
         user_defined=object()
@@ -192,9 +299,7 @@ class TranscriptionView(AdhocView):
     def check_modified(self):
         b=self.textview.get_buffer()
         modified = []
-        # Update the model to be sure.
-        self.regenerate_model()
-        for a in self.model:
+        for a in self.index:
             try:
                 beginiter=b.get_iter_at_mark(b.get_mark("b_%s" % a.id))
                 enditer  =b.get_iter_at_mark(b.get_mark("e_%s" % a.id))
@@ -224,9 +329,10 @@ class TranscriptionView(AdhocView):
             if new_content is None:
                 impossible.append(a)
             elif a.content.data != new_content:
-                self.controller.notify('EditSessionStart', element=a, immediate=True)
-                a.content.data = new_content
-                self.controller.notify("AnnotationEditEnd", annotation=a, batch=batch_id)
+                with self.controller.package_lock.write():
+                    self.controller.notify('EditSessionStart', element=a, immediate=True)
+                    a.content.data = new_content
+                    self.controller.notify("AnnotationEditEnd", annotation=a, batch=batch_id)
                 self.controller.notify('EditSessionEnd', element=a)
         if impossible:
             dialog.message_dialog(label=_("Cannot convert the following annotations,\nthe representation pattern is too complex.\n%s") % ",".join( [ a.id for a in impossible ] ))
@@ -374,41 +480,105 @@ class TranscriptionView(AdhocView):
             rep=a.content.data
         return rep
 
-    def generate_buffer_content(self):
+    def insert_entry(self, offset, a):
+        """Insert the text of the annotation at the given offset.
+
+        Its begin and end are tracked by the s_ (start of the entry,
+        including timestamps), b_ and e_ (bounds of the annotation
+        text) marks.
+
+        @return: the offset of the end of the entry
+        """
         b=self.textview.get_buffer()
-        # Clear the buffer
-        begin, end = b.get_bounds()
-        b.delete(begin, end)
+        it=b.get_iter_at_offset(offset)
+        if self.options['display-time']:
+            b.insert_with_tags_by_name(it, "[%s]" % helper.format_time(a.fragment.begin), "bound")
+        begin=it.get_offset()
+        # Put a 0-width char to make it easier to edit annotations
+        b.insert_with_tags_by_name(it, ZERO_WIDTH_NOBREAK_SPACE, "bound")
+        b.insert(it, str(self.representation(a)))
+        b.insert_with_tags_by_name(it, ZERO_WIDTH_NOBREAK_SPACE, "bound")
+        end=it.get_offset()
+        if self.options['display-time']:
+            b.insert_with_tags_by_name(it, "[%s]" % helper.format_time(a.fragment.end), "bound")
+        b.insert_with_tags_by_name(it, self.options['separator'], "bound")
+        entry_end=it.get_offset()
+
+        for (prefix, o) in ( ('s', offset), ('b', begin), ('e', end) ):
+            mark = b.create_mark("%s_%s" % (prefix, a.id),
+                                 b.get_iter_at_offset(o),
+                                 left_gravity=True)
+            mark.set_visible(prefix != 's' and self.options['display-bounds'])
+        return entry_end
 
-        def insert_at_cursor_with_tags_by_name(text, *tags):
-            b.insert_with_tags_by_name(b.get_iter_at_mark(b.get_insert()),
-                                       text, *tags)
+    def delete_entry(self, a):
+        """Delete the text and marks of the annotation entry.
 
-        l=list(self.model)
-        l.sort(key=lambda a: a.fragment.begin)
-        for a in l:
-            if self.options['display-time']:
-                insert_at_cursor_with_tags_by_name("[%s]" % helper.format_time(a.fragment.begin),
-                                                   "bound")
+        @return: the offset where the entry was
+        """
+        b=self.textview.get_buffer()
+        start=b.get_mark("s_%s" % a.id)
+        if start is None:
+            return None
+        i=self.index.index(a)
+        if i + 1 < len(self.index):
+            end=b.get_iter_at_mark(b.get_mark("s_%s" % self.index[i + 1].id))
+        else:
+            end=b.get_end_iter()
+        offset=b.get_iter_at_mark(start).get_offset()
+        b.delete(b.get_iter_at_mark(start), end)
+        self.delete_marks(a)
+        return offset
 
-            mark = b.create_mark("b_%s" % a.id,
-                                 b.get_iter_at_mark(b.get_insert()),
-                                 left_gravity=True)
-            mark.set_visible(self.options['display-bounds'])
-
-            # Put a 0-width char to make it easier to edit annotations
-            insert_at_cursor_with_tags_by_name(ZERO_WIDTH_NOBREAK_SPACE, "bound")
-            b.insert_at_cursor(str(self.representation(a)))
-            insert_at_cursor_with_tags_by_name(ZERO_WIDTH_NOBREAK_SPACE, "bound")
-            mark = b.create_mark("e_%s" % a.id,
-                                 b.get_iter_at_mark(b.get_insert()),
-                                 left_gravity=True)
-            mark.set_visible(self.options['display-bounds'])
+    def delete_marks(self, a):
+        b=self.textview.get_buffer()
+        for prefix in ('s', 'b', 'e'):
+            m=b.get_mark("%s_%s" % (prefix, a.id))
+            if m is not None:
+                b.delete_mark(m)
+
+    def insert_annotation(self, a):
+        """Insert a new annotation in the index and in the buffer.
+        """
+        b=self.textview.get_buffer()
+        i=self.index.add(a)
+        if i + 1 < len(self.index):
+            following=self.index[i + 1]
+            offset=b.get_iter_at_mark(b.get_mark("s_%s" % following.id)).get_offset()
+        else:
+            following=None
+            offset=b.get_end_iter().get_offset()
+        end=self.insert_entry(offset, a)
+        if following is not None:
+            # The marks of the following entry that were at the
+            # insertion point did not move, since they have a left
+            # gravity.
+            for prefix in ('s', 'b'):
+                m=b.get_mark("%s_%s" % (prefix, following.id))
+                if b.get_iter_at_mark(m).get_offset() == offset:
+                    b.move_mark(m, b.get_iter_at_offset(end))
+        if a == self.currentannotation:
+            self.tag_annotation(a, "current")
+        if a in self.controller.active_annotations:
+            self.tag_annotation(a, "activated")
+
+    def remove_annotation(self, a):
+        """Remove an annotation from the buffer and the index.
+        """
+        self.delete_entry(a)
+        self.index.remove(a)
 
-            if self.options['display-time']:
-                insert_at_cursor_with_tags_by_name("[%s]" % helper.format_time(a.fragment.end), "bound")
+    def generate_buffer_content(self):
+        b=self.textview.get_buffer()
+        # Clear the buffer
+        begin, end = b.get_bounds()
+        b.delete(begin, end)
+        for a in self.index:
+            self.delete_marks(a)
 
-            insert_at_cursor_with_tags_by_name(self.options['separator'], "bound")
+        offset=0
+        for a in self.index:
+            offset=self.insert_entry(offset, a)
         return
 
     def highlight_search_forward(self, searched):
@@ -502,51 +672,26 @@ class TranscriptionView(AdhocView):
         return False
 
     def update_model(self, package=None):
+        # Remove the marks of the previous model
+        for a in self.index:
+            self.delete_marks(a)
         self.regenerate_model()
         self.generate_buffer_content()
         return True
 
     def update_current_annotation(self, *p, **kw):
         b=self.textview.get_buffer()
-        i=b.get_iter_at_mark(b.get_insert())
-
-        annotationid=None
-
-        # Are we on an annotation bound ?
-        marknames = [ m.get_name()
-                      for m in i.get_marks() ]
-        beginmarks= [ n
-                      for n in marknames
-                      if n and n.startswith('b_') ]
-        endmarks= [ n
-                    for n in marknames
-                    if n and n.startswith('e_') ]
-        if beginmarks or endmarks:
-            # Do not activate on annotation boundary
-            # (it causes problems when editing)
-            annotationid=None
-        else:
-            # Look backwards for the first mark that we find
-            while i.backward_char():
-                marknames = [ m.get_name()
-                              for m in i.get_marks() ]
-                beginmarks= [ n
-                              for n in marknames
-                              if n and n.startswith('b_') ]
-                endmarks= [ n
-                            for n in marknames
-                            if n and n.startswith('e_') ]
-                if beginmarks:
-                    break
-                if endmarks:
-                    break
-
-            if beginmarks:
-                annotationid=beginmarks[0].replace('b_', '')
-
-        if annotationid is not None:
-            a=self.package.annotations['#'.join( (self.package.uri,
-                                                  annotationid) )]
+        offset=b.get_iter_at_mark(b.get_insert()).get_offset()
+
+        def mark_offset(prefix, a):
+            return b.get_iter_at_mark(b.get_mark("%s_%s" % (prefix, a.id))).get_offset()
+
+        # Annotations are not activated on their bounds (it causes
+        # problems when editing)
+        a=self.index.find(offset,
+                          lambda a: mark_offset('b', a),
+                          lambda a: mark_offset('e', a))
+        if a is not None:
             if a != self.currentannotation:
                 if self.currentannotation is not None:
                     self.untag_annotation(self.currentannotation, "current")
@@ -564,14 +709,27 @@ class TranscriptionView(AdhocView):
         b.remove_tag_by_name('activated', *b.get_bounds())
         return True
 
+    def update_annotation_batch(self, changes):
+        """Update the representation of a batch of annotations.
+
+        The buffer is regenerated once if the batch is large, or if
+        the source has to be evaluated again.
+        """
+        if self.ignore_updates:
+            return True
+        if (self.source_filter() is None
+            or len(changes) > len(self.index)):
+            self.update_model()
+        else:
+            for (annotation, event) in changes:
+                self.update_annotation(annotation=annotation, event=event)
+        return True
+
     def update_annotation (self, annotation=None, event=None):
         """Update an annotation's representation."""
         if self.ignore_updates:
             return True
 
-        # Update the model value
-        self.regenerate_model()
-
         if event == 'AnnotationActivate':
             self.activate_annotation(annotation)
             return True
@@ -579,40 +737,25 @@ class TranscriptionView(AdhocView):
             self.desactivate_annotation(annotation)
             return True
         if event == 'AnnotationCreate':
-            # If it does not exist yet, we should create it if it is now in self.model
-            if annotation in self.model:
-                # Update the whole model.
-                self.update_model()
-            return True
-
-        if event == 'AnnotationEditEnd':
-            if not annotation in self.model:
+            if annotation in self.index:
                 return True
-            b=self.textview.get_buffer()
-            beginmark=b.get_mark("b_%s" % annotation.id)
-            endmark=b.get_mark("e_%s" % annotation.id)
-
-            beginiter=b.get_iter_at_mark(beginmark)
-            enditer  =b.get_iter_at_mark(endmark)
-
-            b.delete(beginiter, enditer)
-            b.insert_with_tags_by_name(beginiter, ZERO_WIDTH_NOBREAK_SPACE, "bound")
-            b.insert(beginiter, str(self.representation(annotation)))
-            b.insert_with_tags_by_name(beginiter, ZERO_WIDTH_NOBREAK_SPACE, "bound")
-            # After insert, beginiter is updated to point to the end
-            # of the invalidated text.
-            b.move_mark(endmark, beginiter)
+            source_filter = self.source_filter()
+            if source_filter is not None:
+                present = source_filter(annotation)
+            else:
+                present = annotation in self.get_elements_from_source(self.source)
+            if present:
+                self.insert_annotation(annotation)
+        elif event == 'AnnotationEditEnd':
+            if annotation in self.index:
+                # Replace the entry, which may have moved
+                self.remove_annotation(annotation)
+                self.insert_annotation(annotation)
         elif event == 'AnnotationDelete':
-            b=self.textview.get_buffer()
-            beginmark=b.get_mark("b_%s" % annotation.id)
-            endmark=b.get_mark("e_%s" % annotation.id)
-            if beginmark is None or endmark is None:
-                return True
-            beginiter=b.get_iter_at_mark(beginmark)
-            enditer  =b.get_iter_at_mark(endmark)
-            b.delete(beginiter, enditer)
-            b.delete_mark(beginmark)
-            b.delete_mark(endmark)
+            if annotation in self.index:
+                self.remove_annotation(annotation)
+                if annotation == self.currentannotation:
+                    self.currentannotation=None
         else:
             logger.error("Unknown event %s", event)
         return True
@@ -664,13 +807,13 @@ class TranscriptionView(AdhocView):
 
     def activate_annotation_handler (self, context, parameters):
         annotation=context.evaluateValue('annotation')
-        if annotation is not None and annotation in self.model:
+        if annotation is not None and annotation in self.index:
             self.activate_annotation (annotation)
         return True
 
     def desactivate_annotation_handler (self, context, parameters):
         annotation=context.evaluateValue('annotation')
-        if annotation is not None and annotation in self.model:
+        if annotation is not None and annotation in self.index:
             self.desactivate_annotation (annotation)
         return True
 
@@ -40,6 +40,8 @@ class Metaed:
        Note that the meta elements is always supposed to be the first element
        child.
     """
+    __slots__ = ()
+
     def _getMeta(self, create=False):
         """Return the meta element, creating it if required.
            If not present and 'create' is False, return None.
@@ -81,11 +83,17 @@ class Metaed:
         advene.model.util.dom.printElementText(dom_element, r)
         return r.getvalue()
 
+    # Metadata values, indexed by {namespace}name. The dictionary is
+    # created on first access.
+    meta_cache = None
+
     def getMetaData(self, namespace_uri, name):
         """Return the text content of metadata with given NS and name
         """
         n='{%s}%s' % (namespace_uri, name)
-        if n in self.meta_cache:
+        if self.meta_cache is None:
+            self.meta_cache = {}
+        elif n in self.meta_cache:
             return self.meta_cache[n]
         e = self._getMetaElement(namespace_uri, name)
         if e is None:
@@ -103,7 +111,7 @@ class Metaed:
 
         if value is None:
             if e is not None:
-                if n in self.meta_cache:
+                if self.meta_cache is not None and n in self.meta_cache:
                     del self.meta_cache[n]
                 self._getMeta ().removeChild (e)
             return
@@ -114,6 +122,8 @@ class Metaed:
         if value is not None:
             new = e.ownerDocument.createTextNode(value)
             e.appendChild(new)
+            if self.meta_cache is None:
+                self.meta_cache = {}
             self.meta_cache[n]=value
 
     def listMetaData(self):
@@ -133,6 +143,8 @@ class Authored(Metaed):
        (inheriting the modeled.Modeled class looks like a good idea).
        Note that this implementation consider author to be optional.
     """
+    __slots__ = ()
+
   #
   # private methods
   #
@@ -265,6 +277,8 @@ class Tagged(Metaed):
     Warning: the tags property returns a *copy* of the list of
     tags. To add or remove elements, use addTag and removeTag methods.
     """
+    __slots__ = ()
+
     def _getTagsMeta(self, ns=None):
         """Returns a set of tags
         """
@@ -288,6 +302,7 @@ class Tagged(Metaed):
         else:
             if self.getMetaData (ns, "tags"):
                 self.setMetaData (ns, "tags", None)
+        self._dataModified()
 
     def addTag(self, tag, ns=None):
         """Add a new tag.
@@ -335,6 +350,8 @@ class Dated(Metaed):
        Inheriting classes must have a _getModel method returning a DOM element
        (inheriting the modeled.Modeled class looks like a good idea).
     """
+    __slots__ = ()
+
     def getDate(self):
         """Return the date.
            You would probably rather use the date property.
@@ -366,6 +383,8 @@ class Titled(Metaed):
        Inheriting classes must have a _getModel method returning a DOM element
        (inheriting the modeled.Modeled class looks like a good idea).
     """
+    __slots__ = ()
+
     def getTitle(self):
         """Return the title.
            You would probably rather use the title property.
@@ -405,6 +424,8 @@ class Ided:
        The 'id' attribute is not mutable, since many references in the model
        rely on it.
     """
+    __slots__ = ()
+
     def getId(self):
         """Return the id.
            You would probably rather use the id property.
@@ -438,13 +459,14 @@ class __dummy:
 class Uried(Ided):
     """An implementation for the id property interpreted as a URI fragment.
     """
+    __slots__ = ()
+
 
     def __init__(self, base_uri="", parent=None):
         """The constructor of URIed takes either a base_uri parameter
            or a parent object providing the base URI with a getURI method.
            If both are given, base_uri is ignored.
         """
-        self.meta_cache={}
         if parent is not None:
             self.__base = parent
         else:
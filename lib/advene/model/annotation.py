@@ -39,6 +39,18 @@ class Annotation(modeled.Importable, content.WithContent,
                  viewable.Viewable.withClass('annotation','_get_type_uri'),
                  _impl.Authored, _impl.Dated, _impl.Uried, _impl.Tagged, metaclass=auto_properties):
 
+    # Annotations are the most numerous elements, so their attributes
+    # (including the ones of the base classes, which cannot define
+    # non-empty slots along with Modeled) are stored in slots. Since
+    # the slots hide the class-level default values, they are all
+    # initialized in the constructor.
+    # _relations is the backrefs cache for relations, populated by
+    # the relations. The list is created when the first relation is
+    # added.
+    __slots__ = ('__fragment', '_cached_type', '_relations',
+                 '_Uried__base', '_WithContent__content', 'meta_cache',
+                 '__weakref__')
+
     @staticmethod
     def getNamespaceUri():
         return adveneNS
@@ -69,8 +81,9 @@ class Annotation(modeled.Importable, content.WithContent,
 
         _impl.Uried.__init__(self, parent=parent)
         self.__fragment = None
-
-        self._relations = [] # backrefs cache for relations
+        self._relations = ()
+        self._WithContent__content = None
+        self.meta_cache = None
 
         self._cached_type = type
 
@@ -220,6 +233,11 @@ class Annotation(modeled.Importable, content.WithContent,
     def delContext(self):
         self.setContext(None)
 
+    def _addRelation (self, relation):
+        if not self._relations:
+            self._relations = []
+        self._relations.append (relation)
+
     def getRelations (self, rank=None, order=None):
         """
         Return all the relations involving this annotation.
@@ -234,7 +252,7 @@ class Annotation(modeled.Importable, content.WithContent,
 
         if rank is None:
             if order is None:
-                return self._relations
+                return self._relations or []
             else:
                 return [
                     r for r in self._relations if len (r.getMembers ()) == order
@@ -395,7 +413,7 @@ class Relation(modeled.Importable, content.WithContent,
             modeled.Importable.__init__(self, element, parent)
             _impl.Uried.__init__(self, parent=self.getOwnerPackage())
             for a in self.getMembers ():
-                a._relations.append (self)
+                a._addRelation (self)
 
         else:
             # should be mode 2, checking parameter consistency
@@ -421,7 +439,7 @@ class Relation(modeled.Importable, content.WithContent,
             for m in members:
                 # TODO: check integrity when adding members
                 members_bundle.append (m)
-                m._relations.append (self)
+                m._addRelation (self)
 
             if ident is None:
                 ident = str(uuid.uuid1())
@@ -58,6 +58,8 @@ Permitted dict operations are
 Note also that iter(b) iterates over its values (as for lists).
 Iterating over keys required the _iterkeys_ method.
 """
+import weakref
+
 import advene.model.util.uri
 
 import advene.model.modeled as modeled
@@ -222,8 +224,9 @@ class SumBundle (AbstractBundle):
 
     def __iadd__ (self, bundle):
         assert isinstance (bundle, AbstractBundle)
-        self._list += bundle._list
-        self._dict.update (bundle._dict)
+        # Use the public API, since LazyXmlBundle does not store items
+        self._list += bundle
+        self._dict.update (bundle.iteritems ())
         return self
 
 
@@ -487,6 +490,147 @@ class StandardXmlBundle(AbstractXmlBundle):
 
 
 
+class LazyXmlBundle(StandardXmlBundle):
+    """
+    This extension of StandardXmlBundle creates its items on first access.
+
+    The bundle only holds the XML elements (in _list, and indexed by
+    URI in _dict). Items are created when they are accessed, and kept in
+    a weak-value cache indexed by element: an element is represented
+    by the same item as long as this item is referenced, and the items
+    which are no longer used are freed.
+
+    Items must therefore not hold state that cannot be rebuilt from
+    their element, unless they are referenced elsewhere (e.g. the
+    relation backrefs of annotations, whose relations hold a
+    reference on their members).
+    """
+
+    def __init__ (self, parent, element, cls):
+        self.__items = weakref.WeakValueDictionary ()
+        StandardXmlBundle.__init__ (self, parent, element, cls)
+
+    def _update (self):
+        del self._list[:]
+        self._dict.clear ()
+        self.__items.clear ()
+
+        ns = self._get_namespace_uri ()
+        ln = self._get_local_name ()
+        base_uri = self._getParent ().getUri (absolute=True)
+        push = advene.model.util.uri.push
+        for e in self._getModelChildren ():
+            if e.namespaceURI != ns \
+            or e.localName !=ln:
+                continue
+            self._list.append (e)
+            uri = push (base_uri, e.getAttributeNS (None, 'id'))
+            assert uri not in self._dict, "item %s already in bundle" % uri
+            self._dict[uri] = e
+
+    def _item (self, element):
+        """Return the item for the given element, creating it if needed.
+        """
+        item = self.__items.get (element)
+        if item is None:
+            item = self._make_item (self._getParent (), element=element)
+            self.__items[element] = item
+        return item
+
+    #
+    # read-only methods
+    #
+
+    def __contains__ (self, v):
+        return ((hasattr(v, 'getUri') and v.getUri(absolute=True) in self._dict)
+                or v in self._dict)
+
+    def __getitem__ (self, index):
+        if isinstance (index, int):
+            return self._item (self._list[index])
+        elif isinstance (index, slice):
+            return [ self._item (e) for e in self._list[index] ]
+        else:
+            return self._item (self._dict[index])
+
+    def index (self, element):
+        return self._list.index (self._get_element (element))
+
+    def __iter__ (self):
+        return map (self._item, self._list)
+
+    def get (self, id_, default=None):
+        e = self._dict.get (id_)
+        if e is None:
+            return default
+        return self._item (e)
+
+    def items (self):
+        return [ (uri, self._item (e)) for uri, e in self._dict.items () ]
+
+    def iteritems (self):
+        return ( (uri, self._item (e)) for uri, e in self._dict.items () )
+
+    def itervalues (self):
+        return map (self._item, self._dict.values ())
+
+    def ids (self):
+        return [ e.getAttributeNS (None, 'id') for e in self._dict.values () ]
+
+    def values (self):
+        return list (self.itervalues ())
+
+    def get_by_id(self, id_):
+        l = [ e for e in self._dict.values () if e.getAttributeNS (None, 'id') == id_ ]
+        if len(l) == 1:
+            return self._item (l[0])
+        else:
+            return None
+
+    #
+    # writable methods
+    #
+
+    def __delitem__ (self, index):
+        item = self[index]
+        e = self._get_element (item)
+        if isinstance (index, int):
+            self._list.pop (index)
+        else:
+            self._list.remove (e)
+        del self._dict[item.getUri (absolute=True)]
+        self.__items.pop (e, None)
+        self._getModel ().removeChild (e)
+
+    def insert(self, index, item):
+        assert self._assert_add_item (item)
+
+        length = len (self)
+        if not -length <= index <= length:
+            raise IndexError(index, self._list)
+
+        elt = self._get_element (item)
+        elt_list = self._getModel ().childNodes
+        # See AbstractXmlBundle.insert
+        if length == 0:
+            elt_list.insert (0, elt)
+        elif index != length:
+            elt_list.insert (elt_list.index (self._list[index]), elt)
+        else:
+            elt_list.insert (elt_list.index (self._list[-1]) + 1, elt)
+
+        self._list.insert (index, elt)
+        self._dict[item.getUri (absolute=True)] = elt
+        self.__items[elt] = item
+
+    def remove (self, item):
+        uri = item.getUri (absolute=True)
+        if self._dict.get (uri) is self._get_element (item):
+            del self[uri]
+            return
+        raise ValueError(_('%s not in bundle') % item)
+
+
 class ImportBundle (StandardXmlBundle):
     """
     This extension of StandardXmlBundle is able to manage imported item as well
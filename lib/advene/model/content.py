@@ -233,6 +233,7 @@ class Content(modeled.Modeled,
 
     TODO: handle content types more complex than TEXT_NODE
     """
+    __slots__ = ()
 
     def __init__(self, parent, element):
         modeled.Modeled.__init__(self, element, parent)
@@ -288,6 +289,7 @@ class Content(modeled.Modeled,
             self._getModel().setAttributeNS(None, 'encoding', encoding)
             new = self._getDocument().createTextNode(data)
             self._getModel().appendChild(new)
+        self._getParent()._dataModified()
 
     def delData(self):
         """Delete the content's data"""
@@ -471,6 +473,7 @@ class WithContent(metaclass=auto_properties):
        Inheriting classes must have a _getModel method returning a DOM element
        (inheriting the modeled.Modeled class looks like a good idea).
     """
+    __slots__ = ()
 
     __content = None
 
@@ -492,7 +495,7 @@ class WithContent(metaclass=auto_properties):
         elt = self._getChild((adveneNS, 'content'))
         if elt is not None:
             self._getModel ().removeChild (elt)
-        del self.__content
+        self.__content = None
 
     def getContentData(self):
         # TODO deprecate this
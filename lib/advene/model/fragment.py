@@ -27,6 +27,7 @@ from advene.model.util.auto_properties import auto_properties
 class AbstractFragment(viewable.Viewable.withClass('fragment')):
     """Common superclass for every fragment class.
     """
+    __slots__ = ()
 
     #
     # Static methods
@@ -80,6 +81,7 @@ class AbstractNbeFragment (AbstractFragment, modeled.Modeled, metaclass=auto_pro
        Implements operators '==' and 'in' (for other ByteCountFragments and
        numbers).
     """
+    __slots__ = ()
 
     #
     # Instance methods
@@ -195,6 +197,7 @@ class AbstractNbeFragment (AbstractFragment, modeled.Modeled, metaclass=auto_pro
 class ByteCountFragment(AbstractNbeFragment):
     """ByteCount fragment class.
     """
+    __slots__ = ()
 
     #
     # Static methods
@@ -220,6 +223,7 @@ class MillisecondFragment(AbstractNbeFragment):
     """
     Millisecond fragment class.
     """
+    __slots__ = ()
 
     #
     # Static methods
@@ -36,7 +36,11 @@ class Modeled(metaclass=auto_properties):
        This DOM element is called the _model_ of the object.
        Every Modeled instance can also have a _parent_, which is, when not None,
        a Modeled instance whose model is the parent element of 'element'.
+
+       Modeled objects are created for every element of a package, so
+       their attributes are stored in slots.
     """
+    __slots__ = ('__model', '__parent')
 
     def __init__(self, element, parent):
         """The parameter element is the DOM model of this object.
@@ -128,6 +132,23 @@ class Modeled(metaclass=auto_properties):
         """
         return self._getParent().getOwnerPackage()
 
+    def _dataModified(self):
+        """Update the full-text index after a content or tags modification.
+
+        The index (advene.core.textindex.TextIndex) and the
+        evaluation cache (advene.core.evaluationcache.EvaluationCache)
+        are attached to the owner package by the controller. Updating
+        them here keeps them consistent even if the modification is not
+        notified.
+        """
+        package = self.getOwnerPackage()
+        index = getattr(package, '_textindex', None)
+        if index is not None:
+            index.update(self)
+        cache = getattr(package, '_evaluation_cache', None)
+        if cache is not None:
+            cache.clear()
+
     def getRootPackage(self):
         """
         Modeled which are not Importable rely on their parent for the access path.
@@ -145,12 +166,14 @@ class Importable(Modeled, _impl.Ided, metaclass=auto_properties):
     """Common superclass of for every element which can be imported in a
        package.
     """
+    __slots__ = ('__access_path', '__importator', '__original')
 
     def __init__(self, element, parent, locator=None):
+        # Access paths are tuples, shared with the parent when possible
         if hasattr(parent, 'getAccessPath'):
-            self.__access_path = list(parent.getAccessPath())
+            self.__access_path = parent.getAccessPath()
         else:
-            self.__access_path = [parent.getOwnerPackage()]
+            self.__access_path = (parent.getOwnerPackage(),)
         self.__importator = None
 
         # this is for schemas, types, queries, views
@@ -170,7 +193,7 @@ class Importable(Modeled, _impl.Ided, metaclass=auto_properties):
                     "Tried to use element from non imported package: %s" %
                     pkg_uri)
             pkg = imports.get(pkg_uri).getPackage()
-            self.__access_path.append(pkg)
+            self.__access_path = self.__access_path + (pkg,)
 
             parent = pkg
             self.__original = locator(pkg)[uri]
@@ -178,11 +201,9 @@ class Importable(Modeled, _impl.Ided, metaclass=auto_properties):
 
         Modeled.__init__(self, element, parent)
 
-    __access_path = None
-
     def getAccessPath(self):
         """Return the access path for this element"""
-        return tuple(self.__access_path)
+        return self.__access_path
 
     def isImported(self):
         return self.__importator is not None
@@ -45,7 +45,7 @@ from advene.model.zippackage import ZipPackage
 from advene.util.expat import PyExpat
 from advene.util.tools import uri2path, is_uri
 
-from advene.model.bundle import StandardXmlBundle, ImportBundle, InverseDictBundle, SumBundle
+from advene.model.bundle import StandardXmlBundle, LazyXmlBundle, ImportBundle, InverseDictBundle, SumBundle
 from advene.model.constants import adveneNS, xmlNS, xmlnsNS, xlinkNS, dcNS
 from advene.model.exception import AdveneException
 
@@ -166,13 +166,16 @@ class Package(modeled.Modeled, viewable.Viewable.withClass('package'),
         """Return this package. Used for breaking recursivity in the parenthood tree."""
         return self
 
+    __access_path = None
+
     def getAccessPath(self):
-        if self.__importer:
-            r = list(self.__importer.getAccessPath())
-            r.append(self)
-            return tuple(r)
-        else:
-            return (self,)
+        # The access path is shared by all the package elements
+        if self.__access_path is None:
+            if self.__importer:
+                self.__access_path = self.__importer.getAccessPath() + (self,)
+            else:
+                self.__access_path = (self,)
+        return self.__access_path
 
     def getRootPackage(self):
         if self.__importer:
@@ -239,7 +242,7 @@ class Package(modeled.Modeled, viewable.Viewable.withClass('package'),
         """Return a collection of this package's annotations"""
         if self.__annotations is None:
             e = self._getChild((adveneNS, "annotations"))
-            self.__annotations = StandardXmlBundle(self, e, annotation.Annotation)
+            self.__annotations = LazyXmlBundle(self, e, annotation.Annotation)
         return self.__annotations
 
     def getRelations(self):
@@ -20,6 +20,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 import copy
+import threading
 
 from io import StringIO
 
@@ -56,6 +57,46 @@ class DebugLogger:
 
 debuglogger_singleton = DebugLogger()
 
+# Path elements giving access to data depending on the application
+# state (player, options with the controller and the imagecache,
+# snapshots) rather than on the package contents.
+VOLATILE_PATHS = ('player', 'options', 'imagecache')
+
+_volatile = threading.local()
+
+def track_volatile_access():
+    """Start recording volatile data access in the current thread.
+
+    Evaluations done afterwards in the thread set the flag returned
+    by volatile_access when they use VOLATILE_PATHS or python
+    expressions.
+    """
+    _volatile.accessed = False
+
+def volatile_access():
+    """Return True if volatile data was accessed since track_volatile_access.
+    """
+    return getattr(_volatile, 'accessed', False)
+
+_dependencies = threading.local()
+
+def track_dependencies():
+    """Start recording the path traversals in the current thread.
+
+    The (object, path element, value) traversals done afterwards in
+    the thread are returned by stop_tracking_dependencies.
+    """
+    _dependencies.accessed = {}
+
+def stop_tracking_dependencies():
+    """Stop recording the path traversals and return them.
+
+    @return: a list of (object, path element, value) tuples
+    """
+    accessed = getattr(_dependencies, 'accessed', None)
+    _dependencies.accessed = None
+    return list((accessed or {}).values())
+
 class NoCallVariable(simpleTALES.ContextVariable):
     """Not callable variable.
 
@@ -93,6 +134,11 @@ class _advene_context (simpleTALES.Context):
         for name, value in localVarList:
             self.setLocal(name, value)
 
+    def evaluatePython (self, expr):
+        # Python expressions can access anything
+        _volatile.accessed = True
+        return super().evaluatePython(expr)
+
     def traversePathPreHook(self, obj, path):
         """Called before any TALES standard evaluation"""
 
@@ -138,6 +184,8 @@ class _advene_context (simpleTALES.Context):
         elif (expr.endswith ('"') or expr.endswith ("'")):
             expr = expr [0:-1]
         pathList = expr.split ('/')
+        if any(p in VOLATILE_PATHS for p in pathList):
+            _volatile.accessed = True
 
         path = pathList[0]
         if path.startswith ('?'):
@@ -216,6 +264,9 @@ class _advene_context (simpleTALES.Context):
                         raise simpleTALES.PathNotFoundException() from None
             # Advene hook: stack resolution
             resolved_stack.insert(0, (path, val) )
+            deps = getattr(_dependencies, 'accessed', None)
+            if deps is not None:
+                deps[(id(temp), path)] = (temp, path, val)
 
             index = index + 1
         #self.log.debug ("Found value %s" % str (val))
@@ -245,6 +296,9 @@ class _advene_context (simpleTALES.Context):
 
 class AdveneContext(_advene_context):
 
+    # Default methods, indexed by name. Initialized on first use.
+    _default_methods = None
+
     @staticmethod
     def defaultMethods():
         return [ n
@@ -280,21 +334,48 @@ class AdveneContext(_advene_context):
         if options is None:
             options={}
         _advene_context.__init__(self, dict(options)) # *copy* dict 'options'
-        self.methods = {}
+        if AdveneContext._default_methods is None:
+            AdveneContext._default_methods = dict( (name, global_methods.__dict__[name])
+                                                   for name in self.defaultMethods() )
+        self.methods = dict(AdveneContext._default_methods)
+        # True if self.methods is shared with a prototype context
+        self._shared_methods = False
         self.addGlobal('here', here)
-        for dm_name in self.defaultMethods():
-            self.addMethod(dm_name, global_methods.__dict__[dm_name])
         # FIXME: debug
         self.log = debuglogger_singleton
 
+    def derive(self, here):
+        """Return a new context for here, derived from this context.
+
+        This context is used as a prototype: the derived context gets
+        a copy of its globals and empty locals. The methods and
+        options are shared with the prototype, the methods being
+        copied on the first addMethod call on the derived context.
+        The cost of derivation thus does not depend on the number of
+        methods.
+        """
+        c = self.__class__.__new__(self.__class__)
+        c.__dict__.update(self.__dict__)
+        c.globals = dict(self.globals)
+        c.locals = {}
+        c.localStack = []
+        c.repeatStack = []
+        c.repeatMap = {}
+        c.globals['repeat'] = c.repeatMap
+        c.globals['here'] = here
+        c.pythonPathFuncs = simpleTALES.PythonPathFunctions(c)
+        c._shared_methods = True
+        return c
+
     def addMethod (self, name, function):
         """Add a new method to this context."""
         # TODO: test that function is indeed a function, and that it has the
         #       correct signature
-        if True:
-            self.methods[name] = function
-        else:
-            raise AdveneTalesException("%s is not a valid method" % function)
+        if self._shared_methods:
+            # Copy on write
+            self.methods = dict(self.methods)
+            self._shared_methods = False
+        self.methods[name] = function
 
     def interpret (self, view_source, mimetype, stream=None):
         """
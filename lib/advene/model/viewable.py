@@ -58,6 +58,8 @@ class Viewable(metaclass=auto_properties):
     Subclassing Viewable directly may have unpredictable results.
     """
 
+    __slots__ = ()
+
     def __init__(self):
         object.__init__(self)
 
@@ -71,6 +73,8 @@ class Viewable(metaclass=auto_properties):
         """
         if viewable_class not in Viewable.__subclasses:
             class ViewableWithClass(Viewable):
+                __slots__ = ()
+
                 # getViewableClass is a static method,
                 # so a class inheriting Viewable knows its viewable class
                 @staticmethod
@@ -408,14 +408,14 @@ class Player:
         if self.snapshot_notify:
             self.snapshot_notify(s)
 
-    def async_snapshot(self, position, notify=None):
+    def async_snapshot(self, position, notify=None, background=False):
         t = int(position)
         if notify is not None and self.snapshot_notify is None:
             self.snapshot_notify = notify
         if self.snapshotter:
             if not self.snapshotter.thread_running:
                 self.snapshotter.start()
-            self.snapshotter.enqueue(t)
+            self.snapshotter.enqueue(t, background=background)
         else:
             logger.error("snapshotter not present")
 
@@ -33,6 +33,8 @@ def register(controller=None):
 
 class CutterImporter(GstImporter):
     name = _("Audio segmentation")
+    media_type = 'audio'
+    shardable = True
 
     def __init__(self, *p, **kw):
         super(CutterImporter, self).__init__(*p, **kw)
@@ -59,26 +61,38 @@ class CutterImporter(GstImporter):
                                      help=_("Length (in ms) of drop below threshold before silence is detected"))
 
         ## Internal data structures
-        self.buffer = []
-        self.last_above = None
+        # List of (timestamp, above) transitions
+        self.transitions = []
+
+    def segments(self):
+        """Return the (begin, end) sound segments from the transitions.
+        """
+        last_above = None
+        for t, above in self.transitions:
+            if above:
+                last_above = t
+            else:
+                if last_above is not None:
+                    yield (last_above, t)
+                else:
+                    logger.error("Error: not above without matching above")
+                last_above = t
 
     def do_finalize(self):
         self.convert( { 'begin': begin,
                         'end': end,
                         'content': 'sound' }
-                      for begin, end in self.buffer )
+                      for begin, end in self.segments() )
+
+    def shard_events(self):
+        return self.transitions
+
+    def restore_shard_events(self, events, duration):
+        self.transitions = events
 
     def do_process_message(self, message, bus=None):
         if message.get_name() == 'cutter':
-            t = message['timestamp'] / Gst.MSECOND
-            if message['above']:
-                self.last_above = t
-            else:
-                if self.last_above is not None:
-                    self.buffer.append( (self.last_above, t) )
-                else:
-                    logger.error("Error: not above without matching above")
-                self.last_above = t
+            self.transitions.append( (message['timestamp'] / Gst.MSECOND, message['above']) )
         return True
 
     def setup_importer(self, filename):
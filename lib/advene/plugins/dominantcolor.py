@@ -23,7 +23,10 @@ logger = logging.getLogger(__name__)
 
 from gettext import gettext as _
 
-from math import sqrt
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import advene.core.config as config
 from advene.util.gstimporter import GstImporter
@@ -34,6 +37,9 @@ def register(controller=None):
 
 class DominantColorImporter(GstImporter):
     name = _("Dominant color importer")
+    media_type = 'video'
+    frame_format = 'array'
+    frame_batch_size = 25
 
     def __init__(self, *p, **kw):
         super(DominantColorImporter, self).__init__(*p, **kw)
@@ -47,47 +53,61 @@ class DominantColorImporter(GstImporter):
         # Process end, convert buffered data into annotations
         self.convert(f for f in self.buffer)
 
-    def process_frame(self, frame):
-        """Frame process method
-            It will be called for each output frame, with a dict containing
-            data: bytes, date: dts, pts: pts
+    def process_frames(self, frames):
+        """Frame batch process method
+            It will be called for each batch of frames, with a dict containing
+            data: numpy array (frames, height, width, ARGB), date: list of dts
         """
-        # Pick the first pixel (ARGB format)
-        c = frame['data'][1:4]
+        # Pick the first pixel of each frame
+        colors = frames['data'][:, 0, 0, 1:4]
+        values = colors.astype(numpy.int64)
+        dates = frames['date']
+        i = 0
         if self.last_seen_color is None:
-            self.last_seen_color = c
-            self.first_seen_time = frame['date']
-            return True
-        lc = self.last_seen_color
-        # From https://stackoverflow.com/a/9085524/2870028
-        # who got it from https://www.compuphase.com/cmetric.htm:
-        # typedef struct {
-        #     unsigned char r, g, b;
-        # } RGB;
-        #
-        # double ColourDistance(RGB e1, RGB e2)
-        # {
-        #     long rmean = ( (long)e1.r + (long)e2.r ) / 2;
-        #     long r = (long)e1.r - (long)e2.r;
-        #     long g = (long)e1.g - (long)e2.g;
-        #     long b = (long)e1.b - (long)e2.b;
-        #     return sqrt((((512+rmean)*r*r)>>8) + 4*g*g + (((767-rmean)*b*b)>>8));
-        # }
-        rmean = int((c[0] + lc[0]) / 2)
-        r = c[0] - lc[0]
-        g = c[1] - lc[1]
-        b = c[2] - lc[2]
-        d = sqrt((((512+rmean)*r*r)>>8) + 4*g*g + (((767-rmean)*b*b)>>8))
-        if d > 20:
+            # The first frame does not update last_seen_time
+            self.last_seen_color = colors[0].copy()
+            self.first_seen_time = dates[0]
+            i = 1
+        start = i
+        while i < len(dates):
+            lc = self.last_seen_color.astype(numpy.int64)
+            c = values[i:]
+            # From https://stackoverflow.com/a/9085524/2870028
+            # who got it from https://www.compuphase.com/cmetric.htm:
+            # typedef struct {
+            #     unsigned char r, g, b;
+            # } RGB;
+            #
+            # double ColourDistance(RGB e1, RGB e2)
+            # {
+            #     long rmean = ( (long)e1.r + (long)e2.r ) / 2;
+            #     long r = (long)e1.r - (long)e2.r;
+            #     long g = (long)e1.g - (long)e2.g;
+            #     long b = (long)e1.b - (long)e2.b;
+            #     return sqrt((((512+rmean)*r*r)>>8) + 4*g*g + (((767-rmean)*b*b)>>8));
+            # }
+            rmean = (c[:, 0] + lc[0]) // 2
+            r = c[:, 0] - lc[0]
+            g = c[:, 1] - lc[1]
+            b = c[:, 2] - lc[2]
+            d = numpy.sqrt((((512+rmean)*r*r) >> 8) + 4*g*g + (((767-rmean)*b*b) >> 8))
+            changes = numpy.flatnonzero(d > 20)
+            if not len(changes):
+                break
             # Color change. Buffer a new annotation
+            j = i + changes[0]
+            if j > start:
+                self.last_seen_time = dates[j - 1]
             self.buffer.append({
                 'begin': self.first_seen_time,
                 'end': self.last_seen_time,
-                'content': "#" + self.last_seen_color.hex(),
+                'content': "#" + self.last_seen_color.tobytes().hex(),
             })
-            self.last_seen_color = c
-            self.first_seen_time = frame['date']
-        self.last_seen_time = frame['date']
+            self.last_seen_color = colors[j].copy()
+            self.first_seen_time = dates[j]
+            i = j + 1
+        if len(dates) > start:
+            self.last_seen_time = dates[-1]
         return True
 
     def setup_importer(self, filename):
@@ -23,7 +23,10 @@ logger = logging.getLogger(__name__)
 
 from gettext import gettext as _
 
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import os
+import time
 
 try:
     import cv2
@@ -31,7 +34,7 @@ except ImportError:
     cv2 = None
 
 import advene.core.config as config
-from advene.util.importer import GenericImporter
+from advene.util.importer import GenericImporter, importer_source_file, run_importer_method
 import advene.util.helper as helper
 
 def register(controller=None):
@@ -53,6 +56,18 @@ class FeatureDetectImporter(GenericImporter):
         # Detect that a shape has moved
         self.motion_threshold = 10
 
+        # Run the full detector every detection_interval frames, and
+        # track the detected objects in between.
+        self.detection_interval = 1
+        # Histogram distance (0..1) above which a shot change is
+        # assumed, triggering a full detection.
+        self.shot_threshold = 0.5
+        # Minimum template matching score for a tracked object
+        self.tracking_threshold = 0.6
+        self.processes = 1
+        # Number of processed frames
+        self.frames = 0
+
         self.optionparser.add_option("-n", "--min-neighbors",
                                      action="store", type="int", dest="neighbors", default=self.neighbors,
                                      help=_("Min neighbors."))
@@ -65,6 +80,18 @@ class FeatureDetectImporter(GenericImporter):
         self.optionparser.add_option("-c", "--classifier",
                                      action="store", type="choice", dest="classifier", choices=classifiers, default=self.classifier,
                                      help=_("Classifier"))
+        self.optionparser.add_option("-i", "--detection-interval",
+                                     action="store", type="int", dest="detection_interval", default=self.detection_interval,
+                                     help=_("Detection interval (in frames). Detected features are tracked between detections, or until a shot change."))
+        self.optionparser.add_option("--shot-threshold",
+                                     action="store", type="float", dest="shot_threshold", default=self.shot_threshold,
+                                     help=_("Histogram difference (between 0 and 1) above which a shot change triggers a new detection."))
+        self.optionparser.add_option("--tracking-threshold",
+                                     action="store", type="float", dest="tracking_threshold", default=self.tracking_threshold,
+                                     help=_("Minimum matching score (between 0 and 1) for tracked features. Lost features trigger a new detection."))
+        self.optionparser.add_option("-p", "--processes",
+                                     action="store", type="int", dest="processes", default=self.processes,
+                                     help=_("Number of processes used to analyse the video in parallel time ranges."))
 
     @staticmethod
     def can_handle(fname):
@@ -85,50 +112,194 @@ class FeatureDetectImporter(GenericImporter):
         self.progress(0, _("Detection started"))
         video = cv2.VideoCapture(str(filename))
 
-        if not video:
-            raise "Cannot read video file:"
-        self.convert(self.iterator(video))
+        if not video.isOpened():
+            raise Exception("Cannot read video file: %s" % filename)
+
+        framecount = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frames = 0
+        t = time.time()
+        if self.processes > 1 and framecount > self.processes:
+            ret, frame = video.read()
+            if ret:
+                self.set_scaled_size(frame)
+            video.release()
+            detections = self.parallel_detections(filename, framecount)
+            mode = _("%d processes") % self.processes
+        else:
+            detections = self.detections(video, 0, framecount)
+            mode = _("1 process")
+        self.convert(self.iterator(detections))
+        duration = time.time() - t
+        if self.detection_interval > 1:
+            mode = _("detection every %(interval)d frames, %(mode)s") % { 'interval': self.detection_interval,
+                                                                        'mode': mode }
+        else:
+            mode = _("detection on every frame, %s") % mode
+        self.output_message = _("Processed %(frames)d frames in %(duration).1fs (%(fps).1f frames/s - %(mode)s)") % {
+            'frames': self.frames,
+            'duration': duration,
+            'fps': self.frames / max(duration, 1e-6),
+            'mode': mode }
+        logger.info(self.output_message)
         return self.package
 
-    def iterator(self, video):
-        def svg_rect(x, y , w, h):
-            return
+    def parallel_detections(self, filename, framecount):
+        """Detect objects in parallel time ranges.
+
+        Yield (position, objects) tuples, as the detections method.
+        """
+        size = framecount // self.processes
+        ranges = [ (i * size, (i + 1) * size) for i in range(self.processes) ]
+        ranges[-1] = (ranges[-1][0], framecount)
+        options = dict( (o.dest, getattr(self, o.dest))
+                        for o in self.optionparser.option_list
+                        if o.dest is not None and hasattr(self, o.dest) )
+        # The spawn method is used, since forking a process with
+        # running GLib threads is not safe.
+        with ProcessPoolExecutor(max_workers=self.processes,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [ executor.submit(run_importer_method,
+                                        importer_source_file(self.__class__),
+                                        self.__class__.__name__,
+                                        options,
+                                        'range_detections',
+                                        filename, begin, end)
+                        for begin, end in ranges ]
+            for i, future in enumerate(futures):
+                detections = future.result()
+                self.frames += len(detections)
+                yield from detections
+                if not self.progress((i + 1) / len(futures),
+                                     _("Processed %(count)d/%(total)d time ranges") % { 'count': i + 1,
+                                                                                        'total': len(futures) }):
+                    for f in futures:
+                        f.cancel()
+                    break
+
+    def range_detections(self, filename, begin, end):
+        """Return the list of (position, objects) detections for the given frame range.
+        """
+        video = cv2.VideoCapture(str(filename))
+        if begin:
+            video.set(cv2.CAP_PROP_POS_FRAMES, begin)
+        res = list(self.detections(video, begin, end))
+        video.release()
+        return res
+
+    def set_scaled_size(self, frame):
+        """Set the scaled frame size from a video frame.
+        """
+        width, height, depth = frame.shape
+        self.scaled_size = (int(width / self.scale), int(height / self.scale))
+        logger.debug("Video dimensions %dx%d - scaled to %dx%d", width, height, *self.scaled_size)
+        return self.scaled_size
 
+    def track(self, previous, gray, objects):
+        """Track objects from the previous frame into gray.
+
+        Return the new objects positions, or None if an object was lost.
+        """
+        tracked = []
+        height, width = gray.shape
+        for (x, y, w, h) in objects:
+            template = previous[y:y+h, x:x+w]
+            margin = max(w, h) // 2
+            x0, y0 = max(0, x - margin), max(0, y - margin)
+            window = gray[y0:min(height, y + h + margin), x0:min(width, x + w + margin)]
+            if (template.shape[0] != h or template.shape[1] != w
+                or window.shape[0] < h or window.shape[1] < w):
+                return None
+            res = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            minval, score, minloc, (dx, dy) = cv2.minMaxLoc(res)
+            if score < self.tracking_threshold:
+                return None
+            tracked.append( (x0 + dx, y0 + dy, w, h) )
+        return tracked
+
+    def detections(self, video, begin=0, end=None):
+        """Detect objects in video frames, from frame number begin to end.
+
+        Yield (position, objects) tuples, with objects a list of (x,
+        y, w, h) tuples.
+        """
         if not video.isOpened():
             return
 
         framecount = video.get(cv2.CAP_PROP_FRAME_COUNT)
-        pos = 0
+        pos = video.get(cv2.CAP_PROP_POS_MSEC) if begin else 0
         # Take the first frame to get width/height
         ret, frame = video.read()
-        width, height, depth = frame.shape
-        scaled_width, scaled_height = int(width / self.scale), int(height / self.scale)
-        logger.warning("Video dimensions %dx%d - scaled to %dx%d", width, height, scaled_width, scaled_height)
+        if not ret:
+            return
+        scaled_width, scaled_height = self.set_scaled_size(frame)
 
         cascade = cv2.CascadeClassifier(config.data.advenefile( ('haars', self.classifier + '.xml') ))
-        count = 0
+        index = begin
+        objects = None
+        previous = None
+        previous_histogram = None
+        since_detection = 0
+
+        while ret and (end is None or index < end):
+            gray = cv2.cvtColor(cv2.resize(frame, (scaled_width, scaled_height)), cv2.COLOR_RGB2GRAY)
+
+            if self.detection_interval > 1:
+                histogram = cv2.calcHist([ gray ], [ 0 ], None, [ 64 ], [ 0, 256 ])
+                cv2.normalize(histogram, histogram)
+                shot_change = (previous_histogram is not None
+                               and cv2.compareHist(previous_histogram, histogram, cv2.HISTCMP_BHATTACHARYYA) > self.shot_threshold)
+                previous_histogram = histogram
+                if shot_change:
+                    objects = None
+                elif objects is not None and since_detection < self.detection_interval:
+                    objects = self.track(previous, gray, objects)
+            else:
+                objects = None
 
-        svg_template = """<svg xmlns='http://www.w3.org/2000/svg' version='1' viewBox="0 0 %(scaled_width)d %(scaled_height)d" x='0' y='0' width='%(scaled_width)d' height='%(scaled_height)d'>%%s</svg>""" % locals()
+            if objects is None or since_detection >= self.detection_interval:
+                objects = [ tuple(int(v) for v in o)
+                            for o in cascade.detectMultiScale(gray, 1.2, self.neighbors) ] # scale_factor=1.2, min_neighbors=2
+                since_detection = 0
+            since_detection += 1
+            previous = gray
+
+            self.frames += 1
+            yield (pos, objects)
+
+            if not self.progress(video.get(cv2.CAP_PROP_POS_FRAMES) / framecount,
+                                 _("Processed %(frames)d frame(s) until %(time)s") % { 'frames': index - begin,
+                                                                                       'time': helper.format_time(pos) }):
+                break
+
+            index += 1
+            pos = video.get(cv2.CAP_PROP_POS_MSEC)
+            ret, frame = video.read()
+
+    def iterator(self, detections):
+        """Generate annotations from (position, objects) detections.
+        """
+        count = 0
+        svg_template = None
         def objects2svg(objs, threshold=-1):
             """Convert a object-list into SVG.
             """
             return svg_template % "\n".join("""<rect style="fill:none;stroke:green;stroke-width:4;" width="%(w)d" height="%(h)s" x="%(x)s" y="%(y)s"></rect>""" % locals()
                                             for (x, y, w, h) in objs)
 
-        start_pos = None
-
-        while ret:
-
-            gray = cv2.cvtColor(cv2.resize(frame, (scaled_width, scaled_height)), cv2.COLOR_RGB2GRAY)
+        def distance(objects, stored_objects):
+            d = max( abs(a - b)
+                     for obj, sto in zip(objects, stored_objects)
+                     for a, b in zip(obj, sto) )
+            logger.debug("distance %d", d)
+            return d
 
-            objects = cascade.detectMultiScale(gray, 1.2, self.neighbors) # scale_factor=1.2, min_neighbors=2
+        start_pos = None
+        pos = 0
 
-            def distance(v1, v2):
-                d = max( abs(a - b)
-                         for obj, sto in zip(objects, stored_objects)
-                         for a, b in zip(obj, sto) )
-                logger.debug("distance %d", d)
-                return d
+        for pos, objects in detections:
+            if svg_template is None:
+                scaled_width, scaled_height = self.scaled_size
+                svg_template = """<svg xmlns='http://www.w3.org/2000/svg' version='1' viewBox="0 0 %(scaled_width)d %(scaled_height)d" x='0' y='0' width='%(scaled_width)d' height='%(scaled_height)d'>%%s</svg>""" % locals()
 
             if len(objects):
                 logger.debug("Detected object %s", objects)
@@ -161,14 +332,6 @@ class FeatureDetectImporter(GenericImporter):
                     }
                 start_pos = None
 
-            if not self.progress(video.get(cv2.CAP_PROP_POS_FRAMES) / framecount,
-                                 _("Detected %(count)d feature(s) until %(time)s") % { 'count': count,
-                                                                                       'time': helper.format_time(pos) }):
-                break
-
-            pos = video.get(cv2.CAP_PROP_POS_MSEC)
-            ret, frame = video.read()
-
         # Last frame
         if start_pos is not None:
             yield {
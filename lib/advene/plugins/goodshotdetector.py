@@ -23,22 +23,27 @@ name="Shot detection importer"
 from gettext import gettext as _
 
 import os
-import sys
 
 try:
     # Needed for pimpy component
     import numpy
-    import opencv.cv as cv
-    import opencv.highgui as hg
+    from numpy.lib.stride_tricks import sliding_window_view
 except ImportError:
-    numpy = cv = hg = None
+    numpy = None
+
+try:
+    # Needed for histogram extraction
+    import cv2
+except ImportError:
+    cv2 = None
 
 import advene.core.config as config
+from advene.util.analysiscache import get_cache
 import advene.util.helper as helper
 from advene.util.importer import GenericImporter
 
 def register(controller=None):
-    if numpy and cv and hg:
+    if numpy and cv2:
         controller.register_importer(DelakisShotDetectImporter)
     return True
 
@@ -80,14 +85,27 @@ class DelakisShotDetectImporter(GenericImporter):
 
         #Compute or load histogram
         histofile = filename + '-histogram.npy'
+        cache = get_cache()
+        try:
+            key = cache.key(filename, 'histogram')
+        except OSError:
+            key = None
+        histos = None
         if os.path.exists(histofile):
             self.progress(0, _("Loading histogram"))
             histos = numpy.load(histofile)
             # FIXME: how to cache FPS ?
             fps = float(config.data.preferences['default-fps'])
-        else :
+        elif key is not None:
+            histos, metadata = cache.get(key)
+            if histos is not None:
+                self.progress(0, _("Using cached histogram"))
+                fps = metadata.get('fps') or float(config.data.preferences['default-fps'])
+        if histos is None:
             he = HistogramExtractor()
             histos, fps = he.process(filename, self.progress)
+            if key is not None and he.complete:
+                cache.put(key, histos, filename=filename, analyzer='histogram', metadata={ 'fps': fps })
             if self.cache_histogram:
                 try:
                     numpy.save(histofile, histos)
@@ -151,21 +169,16 @@ class ShotDetector:
 
         self.progress(.2, _("Detecting cuts"))
         #detect hard cut
-        cuts = numpy.flatnonzero( histo_dist >= self.HIGH_CUT_THRESHOLD )
+        hard_cuts = numpy.flatnonzero( histo_dist >= self.HIGH_CUT_THRESHOLD )
 
         #detect low cut
-        for f in numpy.flatnonzero(
-                (histo_dist < self.HIGH_CUT_THRESHOLD) &
-                (histo_dist >= self.SHOT_THRESHOLD)
-        ):
-            if self.__cut_detection(f, histo_dist):
-                cuts = numpy.append(cuts, f)
-
-        cuts.sort()
+        low_cuts = self.__cut_detection(histo_dist)
+        cuts = numpy.sort(numpy.concatenate((hard_cuts, low_cuts)))
+
         n = 1
         yield {
             'begin': 0,
-            'end': cuts[0] * mspf,
+            'end': (cuts[0] if len(cuts) else len(histos) - 1) * mspf,
             'content': str(n),
             }
         for b, e in zip(cuts[:-1], cuts[1:]):
@@ -191,63 +204,79 @@ class ShotDetector:
                 }
 
     def __detect_dissolve(self, hcumul, hpixelwise):
-        motion_frames = hpixelwise > self.MOTION_THRESHOLD
+        """Detect dissolves.
+
+        A dissolve is grown around each frame above DISS_THRESHOLD,
+        downwards while above DISS_START_THRESHOLD, upwards while
+        above DISS_END_THRESHOLD. The bounds are precomputed for all
+        frames, so that we only iterate over dissolves.
+        """
+        n = len(hcumul)
+        indexes = numpy.arange(n)
+        # Cumulated count of motion frames
+        motion = numpy.concatenate(([ 0 ], numpy.cumsum(hpixelwise > self.MOTION_THRESHOLD)))
+        # Last frame <= i below DISS_START_THRESHOLD (or 0)
+        lower = numpy.maximum.accumulate(numpy.where(hcumul <= self.DISS_START_THRESHOLD, indexes, 0))
+        # First frame >= i below DISS_END_THRESHOLD (or n)
+        upper = numpy.minimum.accumulate(numpy.where(hcumul <= self.DISS_END_THRESHOLD, indexes, n)[::-1])[::-1]
+        upper = numpy.append(upper, n)
+
+        frames = numpy.flatnonzero(hcumul > self.DISS_THRESHOLD)
         start = end = -1
-        for f in numpy.flatnonzero(hcumul > self.DISS_THRESHOLD):
+        i = 0
+        while i < len(frames):
+            f = frames[i]
             #new frame not in current dissolve, record dissolve
             if start > 0 and f > end:
-                motion = numpy.sum(motion_frames[list(range(start,end))])
-                if not motion and end - start > self.DISS_MIN_FRAMES:
+                if motion[end] == motion[start] and end - start > self.DISS_MIN_FRAMES:
                     yield (start,end)
                 start = end = -1
 
-            if start < 0 :
-                start = end = f
-                #find lower bound
-                while start > 0 and hcumul[start] > self.DISS_START_THRESHOLD:
-                    start -= 1
-                #find upper bound
-                while end+1 < len(hcumul) and hcumul[end+1] > self.DISS_END_THRESHOLD :
-                    end += 1
+            if start < 0:
+                start = lower[f]
+                end = upper[f + 1] - 1
+            if start == 0:
+                # A dissolve starting at the first frame is never recorded
+                break
+            # Skip frames inside the current dissolve
+            i = numpy.searchsorted(frames, end, side='right')
 
         #add the last dissolve
         if start > 0 and end > 0 :
-            motion = numpy.sum(motion_frames[list(range(start,end))])
-            if not motion and end - start > self.DISS_MIN_FRAMES:
+            if motion[end] == motion[start] and end - start > self.DISS_MIN_FRAMES:
                 yield (start,end)
 
     def __histo_pixelwise(self,hdiff):
-        r = []
-        for h in hdiff:
-            s = 0
-            for i in range(T, NB_BINS):
-                s += (h[i] * (i-T-1))
-            r.append(s)
-        return numpy.array(r)
-
-    def __histo_cumul(self, histos):
+        return hdiff[:, T:NB_BINS] @ numpy.arange(-1, NB_BINS - T - 1, dtype=hdiff.dtype)
+
+    def __histo_cumul(self, histos, chunk_size=4096):
         nbpix = numpy.sum(histos[0])
-        r = []
-        for i in range(1, len(histos)):
-            h = (histos[i] + histos[i-1]) / 2
-            c = 0
+        histos = histos.astype(numpy.float64)
+        r = numpy.zeros(len(histos) - 1)
+        # Process by chunks of frames, to bound memory usage
+        for begin in range(1, len(histos), chunk_size):
+            end = min(begin + chunk_size, len(histos))
+            h = (histos[begin:end] + histos[begin-1:end-1]) / 2
+            c = numpy.zeros(end - begin)
             for k in range(1, K):
-                if i - k < 0 :
+                # Only frames i >= k have a (i - k) predecessor
+                first = max(begin, k)
+                if first >= end:
                     break
-                c += numpy.sum(numpy.abs(h - histos[i - k])) / nbpix
-            r.append(c / K)
-        return numpy.array(r)
+                c[first-begin:] += numpy.sum(numpy.abs(h[first-begin:] - histos[first-k:end-k]), axis=1) / nbpix
+            r[begin-1:end-1] = c / K
+        return r
 
     def __filter_by_cut(self, cuts, histo_cumul):
-        for c in cuts:
-            for i in range(K):
-                try :
-                    histo_cumul[c + i] = histo_cumul[c + i]/(K - i)
-                except IndexError:
-                    break
+        # Frames following cuts by less than K frames are divided
+        # (possibly several times) in the same order as a loop on
+        # increasing cuts.
+        for i in reversed(range(K)):
+            indexes = cuts + i
+            numpy.divide.at(histo_cumul, indexes[indexes < len(histo_cumul)], K - i)
         return histo_cumul
 
-    def __cut_detection(self, f, histo_dist):
+    def __local_cut_detection(self, f, histo_dist):
         d = histo_dist[f]
         left_diff  = histo_dist[f - 1 - MEAN_WINDOW : f - 1] + self.BETA
         right_diff = histo_dist[f + 1 : f + 1 + MEAN_WINDOW] + self.BETA
@@ -259,29 +288,48 @@ class ShotDetector:
         adapt_threshold =  self.ALPHA * mean_local  - self.BETA
         return d >= adapt_threshold
 
+    def __cut_detection(self, histo_dist):
+        """Return the low cuts, detected with an adaptive threshold.
+        """
+        candidates = numpy.flatnonzero(
+            (histo_dist < self.HIGH_CUT_THRESHOLD) &
+            (histo_dist >= self.SHOT_THRESHOLD)
+        )
+        n = len(histo_dist)
+        # Frames with complete windows on both sides
+        regular = (candidates >= 1 + MEAN_WINDOW) & (candidates + 1 + MEAN_WINDOW <= n)
+        means = numpy.mean(sliding_window_view(histo_dist + self.BETA, MEAN_WINDOW), axis=1)
+        f = candidates[regular]
+        mean_local = (means[f - 1 - MEAN_WINDOW] + means[f + 1]) / 2
+        cuts = f[histo_dist[f] >= self.ALPHA * mean_local - self.BETA]
+        # Frames at the boundaries are checked individually
+        boundary = [ f for f in candidates[~regular] if self.__local_cut_detection(f, histo_dist) ]
+        return numpy.concatenate((cuts, numpy.array(boundary, dtype=cuts.dtype)))
+
 class HistogramExtractor:
+    def __init__(self):
+        # Set to True if the whole video has been processed
+        self.complete = False
+
     def process(self, videofile, progress):
         progress(0, _("Extracting histogram"))
-        video = hg.cvCreateFileCapture(str(videofile).encode(sys.getfilesystemencoding()))
-        if not video:
+        video = cv2.VideoCapture(str(videofile))
+        if not video.isOpened():
             raise Exception("Could not open video file")
-        histo = cv.cvCreateHist([256],cv.CV_HIST_ARRAY,[[0,256]], 1)
-        frame = hg.cvQueryFrame(video)
-        frame_gray  = cv.cvCreateImage(cv.cvGetSize(frame), frame.depth, 1)
-        hists    = []
-        nbframes = 0
-
-        fps = hg.cvGetCaptureProperty(video, hg.CV_CAP_PROP_FPS)
-        while frame :
-            if not progress(hg.cvGetCaptureProperty(video, hg.CV_CAP_PROP_POS_AVI_RATIO)):
+        fps = video.get(cv2.CAP_PROP_FPS)
+        framecount = video.get(cv2.CAP_PROP_FRAME_COUNT) or 1
+        hists = []
+        while True:
+            ret, frame = video.read()
+            if not ret:
+                # End of video
+                self.complete = True
+                break
+            if not progress(video.get(cv2.CAP_PROP_POS_FRAMES) / framecount):
                 break
-            hg.cvConvertImage(frame,frame_gray)
-            cv.cvCalcHist(frame_gray,histo,0,None)
-            h = [cv.cvGetReal1D(histo.bins,i) for i in range(255) ]
-            h = numpy.array(h,dtype='int32')
-            hists.append(h)
-            frame = hg.cvQueryFrame(video)
-            nbframes += 1
-
-        hists = numpy.array(hists)
-        return hists.reshape(nbframes, -1), fps
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            h = cv2.calcHist([ gray ], [ 0 ], None, [ 256 ], [ 0, 256 ])
+            hists.append(h[:NB_BINS, 0].astype('int32'))
+        video.release()
+
+        return numpy.array(hists, dtype='int32').reshape(len(hists), -1), fps
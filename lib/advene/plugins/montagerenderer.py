@@ -18,7 +18,17 @@
 #
 """Montage export module.
 
-This filter exports a list of annotations as a video montage
+This filter exports a list of annotations as a video montage.
+
+When the destination has the same format as the source media (and
+GES supports smart rendering), the video stream is copied instead of
+being re-encoded: only the partial GOPs at cut points which are not
+keyframes are re-encoded. Cut points can also be snapped to the
+closest keyframes, so that clips are entirely copied.
+
+When re-encoding, groups of clips can be encoded in parallel worker
+processes into intermediate WebM segments, which are then
+concatenated without re-encoding.
 """
 
 name="Video montage renderer"
@@ -28,6 +38,12 @@ import logging
 logger = logging.getLogger(__name__)
 
 from gettext import gettext as _
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
 
 import gi
 gi.require_version('Gst', '1.0')
@@ -43,65 +59,337 @@ try:
 except ValueError:
     GES = None
 
+import advene.core.config as config
+from advene.core.plugin import run_plugin_function
 import advene.util.helper as helper
 
+# Video formats that GES can copy in smart rendering mode
+SMART_RENDER_FORMATS = ('video/x-h264', 'video/x-h265', 'video/x-vp8', 'video/x-vp9')
+
+# Results of stream_copy_extension, indexed by media URI
+stream_copy_extensions = {}
+
 def register(controller=None):
     if GES is not None:
         controller.register_generic_feature(shortname, MontageRenderer)
     return True
 
+def smart_render_available():
+    """Check that GES supports smart rendering.
+
+    The SMART_RENDER mode is only effective since GES 1.20.
+    """
+    return GES is not None and tuple(GES.version()[:2]) >= (1, 20)
+
+def group_segments(segments, count):
+    """Split segments into at most count groups of similar durations.
+
+    Groups are contiguous, so that the concatenation of the groups
+    renderings gives the montage.
+
+    @param segments: a list of (begin, duration) tuples
+    @param count: the maximum number of groups
+    @return: a list of lists of segments
+    """
+    total = sum(duration for begin, duration in segments)
+    if not total or count <= 1:
+        return [ segments ] if segments else []
+    groups = [ [] for i in range(count) ]
+    start = 0
+    for segment in segments:
+        # Assign the segment according to the position of its middle
+        middle = start + segment[1] / 2
+        groups[min(count - 1, int(middle * count / total))].append(segment)
+        start += segment[1]
+    return [ g for g in groups if g ]
+
+def render_group(media_uri, segments, filename):
+    """Render segments of media_uri into filename.
+
+    This function is run in worker processes. It returns filename.
+    """
+    r = MontageRenderer(None, media_uri=media_uri)
+    loop = GLib.MainLoop()
+    def progress(value):
+        if value is None:
+            loop.quit()
+        return True
+    r.render(filename, progress, stream_copy=False, workers=1, segments=segments)
+    loop.run()
+    r.finalize()
+    if r.error is not None:
+        raise RuntimeError(r.error)
+    return filename
+
+class KeyframeLocator:
+    """Locate the keyframes of a media, without decoding it.
+
+    The media is only demuxed and parsed in a paused pipeline:
+    key-unit seeks make the demuxer start at the keyframe closest to
+    the requested position, and the position of the prerolled video
+    buffer is the keyframe position.
+    """
+    # Maximum time to wait for a state change, in ns
+    TIMEOUT = 10 * Gst.SECOND
+
+    def __init__(self, uri):
+        self.sink = None
+        self.pipeline = Gst.Pipeline()
+        source = Gst.ElementFactory.make('urisourcebin')
+        source.set_property('uri', uri)
+        parser = Gst.ElementFactory.make('parsebin')
+        self.pipeline.add(source)
+        self.pipeline.add(parser)
+        source.connect('pad-added', lambda element, pad: pad.link(parser.get_static_pad('sink')))
+        parser.connect('pad-added', self.parser_pad_added)
+        self.pipeline.set_state(Gst.State.PAUSED)
+        self.pipeline.get_state(self.TIMEOUT)
+
+    def parser_pad_added(self, parser, pad):
+        sink = Gst.ElementFactory.make('fakesink')
+        sink.set_property('sync', False)
+        self.pipeline.add(sink)
+        sink.sync_state_with_parent()
+        pad.link(sink.get_static_pad('sink'))
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        if self.sink is None and caps.get_structure(0).get_name().startswith('video/'):
+            self.sink = sink
+
+    def locate(self, position):
+        """Return the position of the keyframe closest to position.
+
+        @param position: the position (in ms)
+        @return: the keyframe position (in ms)
+        """
+        if self.sink is None:
+            return position
+        self.pipeline.seek_simple(Gst.Format.TIME,
+                                  Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SNAP_NEAREST,
+                                  position * Gst.MSECOND)
+        self.pipeline.get_state(self.TIMEOUT)
+        sample = self.sink.get_property('last-sample')
+        if sample is None:
+            return position
+        t = sample.get_segment().to_stream_time(Gst.Format.TIME, sample.get_buffer().pts)
+        if t == Gst.CLOCK_TIME_NONE:
+            return position
+        return int(t / Gst.MSECOND)
+
+    def close(self):
+        self.pipeline.set_state(Gst.State.NULL)
+        self.pipeline = None
+
 class MontageRenderer:
     """Video montage exporter.
+
+    @ivar stream_copy: whether the last render copies the video stream
+    @ivar workers: the number of worker processes used by the last render
+    @ivar error: the error message, if the last render failed
     """
     name = _("Video montage exporter")
+    # Estimated number of raw frames held in memory by a rendering pipeline
+    BUFFERED_FRAMES = 32
+    # Estimated base memory usage of a worker process, in bytes
+    WORKER_MEMORY = 64 * 1024 * 1024
 
-    def __init__(self, controller, elements=None):
+    def __init__(self, controller, elements=None, media_uri=None):
         self.controller = controller
         self.elements = elements
+        self.media_uri = media_uri
+        self.asset = None
         self.progress_cb = None
         self.pipeline = None
         self.total_duration = 1
+        self.stream_copy = False
+        self.workers = 1
+        self.error = None
+        self.executor = None
+        self.futures = []
+        self.tmpdir = None
 
     def finalize(self):
         if self.pipeline is not None:
             self.pipeline.set_state(Gst.State.NULL)
             self.pipeline = None
+        if self.executor is not None:
+            for f in self.futures:
+                f.cancel()
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
 
     def bus_message_cb(self, unused_bus, message):
         if message.type == Gst.MessageType.EOS:
             logger.warning("End of encoding")
             self.progress_cb(None)
+        elif message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            logger.error("Error while encoding: %s (%s)", err, debug)
+            self.error = str(err)
+            self.finalize()
+            self.progress_cb(None)
 
     def duration_querier(self):
         if self.pipeline is None:
             self.progress_cb(None)
-            return True
+            return False
         pos = self.pipeline.query_position(Gst.Format.TIME)[1] / self.total_duration
         if self.progress_cb:
             self.progress_cb(pos)
         return True
 
-    def render(self, filename, progress_callback=None):
+    def get_media_uri(self):
+        """Return the URI of the source media.
+        """
+        if self.media_uri is None:
+            # FIXME: considering single-video for the moment
+            self.media_uri = helper.path2uri(self.controller.get_default_media())
+        return self.media_uri
+
+    def get_asset(self):
+        """Return the GES asset for the source media.
+        """
+        if self.asset is None:
+            logger.warning("Extracting clips from %s", self.get_media_uri())
+            self.asset = GES.UriClipAsset.request_sync(self.media_uri)
+        return self.asset
+
+    def stream_copy_extension(self, wait=True):
+        """Return the filename extension allowing to copy the video stream.
+
+        It is the extension of the source media, if its video codec
+        is supported by smart rendering and the montage-stream-copy
+        preference is set. Else return None.
+
+        The source media must be discovered to check its codec. If
+        wait is False and the media was not discovered yet, the
+        discovery is done in a background thread and None is returned.
+        """
+        if not smart_render_available() or not config.data.preferences['montage-stream-copy']:
+            return None
+        uri = self.get_media_uri()
+        if uri in stream_copy_extensions:
+            return stream_copy_extensions[uri]
+        if not wait:
+            def discover():
+                try:
+                    self.stream_copy_extension()
+                except Exception:
+                    logger.warning("Cannot discover %s", uri, exc_info=True)
+                    stream_copy_extensions[uri] = None
+            threading.Thread(target=discover, daemon=True).start()
+            return None
+        streams = self.get_asset().get_info().get_video_streams()
+        if not streams or streams[0].get_caps().get_structure(0).get_name() not in SMART_RENDER_FORMATS:
+            ext = None
+        else:
+            ext = os.path.splitext(uri)[1].lower() or None
+        stream_copy_extensions[uri] = ext
+        return ext
+
+    def can_stream_copy(self, filename):
+        """Check whether the video stream can be copied into filename.
+
+        The destination must have the same format (extension) as the
+        source media.
+        """
+        ext = self.stream_copy_extension()
+        return ext is not None and os.path.splitext(filename)[1].lower() == ext
+
+    def get_segments(self, snap_to_keyframes=False):
+        """Return the list of (begin, duration) segments to render, in ms.
+
+        If snap_to_keyframes is True, the segment beginnings are moved
+        to the closest keyframe of the source media.
+        """
+        segments = [ (a.fragment.begin, a.fragment.duration) for a in self.elements ]
+        if snap_to_keyframes:
+            locator = KeyframeLocator(self.media_uri)
+            try:
+                snapped = []
+                for begin, duration in segments:
+                    end = begin + duration
+                    keyframe = locator.locate(begin)
+                    if keyframe < end:
+                        begin = keyframe
+                    snapped.append( (begin, end - begin) )
+                segments = snapped
+            finally:
+                locator.close()
+        return segments
+
+    def worker_count(self, workers=None):
+        """Return the number of worker processes to use for re-encoding.
+
+        It is bounded by workers (by default, the montage-workers
+        preference, 0 meaning the number of processors) and by the
+        montage-memory-budget preference (in MB), given an estimation
+        of the memory used by each worker.
+        """
+        if workers is None:
+            workers = config.data.preferences['montage-workers']
+        if not workers:
+            workers = os.cpu_count() or 1
+        budget = config.data.preferences['montage-memory-budget'] * 1024 * 1024
+        if budget:
+            streams = self.get_asset().get_info().get_video_streams()
+            if streams:
+                frame_size = streams[0].get_width() * streams[0].get_height() * 4
+            else:
+                frame_size = 0
+            per_worker = self.WORKER_MEMORY + self.BUFFERED_FRAMES * frame_size
+            workers = min(workers, budget // per_worker)
+        return max(1, int(workers))
+
+    def render(self, filename, progress_callback=None, stream_copy=None, snap_to_keyframes=False,
+               workers=None, segments=None):
+        """Render the montage into filename.
+
+        If stream_copy is True (by default, if can_stream_copy allows
+        it), the video stream is copied from the source media through
+        smart rendering instead of being re-encoded to WebM. If
+        snap_to_keyframes is True, clips begin at the keyframe
+        closest to the annotation begin, so that they are entirely
+        copied.
+
+        When re-encoding, clips are encoded by groups in parallel
+        worker processes (see worker_count for the workers
+        parameter), then concatenated.
+
+        segments, a list of (begin, duration) tuples in ms, can be
+        given instead of the elements of the renderer.
+        """
         # Works if source is a type
         self.progress_cb = progress_callback
-
-        # FIXME: considering single-video for the moment
-        media_uri = self.controller.get_default_media()
-        media_uri = helper.path2uri(media_uri)
-
-        logger.warning("Extracting clips from %s", media_uri)
-        asset = GES.UriClipAsset.request_sync(media_uri)
+        self.error = None
+
+        asset = self.get_asset()
+        if stream_copy is None:
+            stream_copy = self.can_stream_copy(filename)
+        self.stream_copy = stream_copy
+
+        if segments is None:
+            segments = self.get_segments(snap_to_keyframes and stream_copy)
+        self.total_duration = max(1, sum(duration * Gst.MSECOND for begin, duration in segments))
+
+        self.workers = 1
+        if not stream_copy and len(segments) > 1:
+            self.workers = min(len(segments), self.worker_count(workers))
+        if self.workers > 1:
+            self.render_parallel(filename, segments)
+            return
 
         timeline = GES.Timeline.new_audio_video()
         layer = timeline.append_layer()
 
         start_on_timeline = 0
 
-        self.total_duration = sum(a.fragment.duration * Gst.MSECOND for a in self.elements)
         clips = []
-        for a in self.elements:
-            start_position_asset = a.fragment.begin * Gst.MSECOND
-            duration = a.fragment.duration * Gst.MSECOND
+        for begin, duration in segments:
+            start_position_asset = begin * Gst.MSECOND
+            duration = duration * Gst.MSECOND
             # GES.TrackType.UNKNOWN => add every kind of stream to the timeline
             clips.append(layer.add_asset(asset, start_on_timeline, start_position_asset,
                                          duration, GES.TrackType.UNKNOWN))
@@ -113,6 +401,138 @@ class MontageRenderer:
         pipeline = GES.Pipeline()
         pipeline.set_timeline(timeline)
 
+        if stream_copy:
+            # Encode to the source formats, so that GES can copy
+            # the streams instead of re-encoding them.
+            container_profile = GstPbutils.EncodingProfile.from_discoverer(asset.get_info())
+        else:
+            container_profile = self.webm_profile()
+
+        pipeline.set_render_settings(helper.path2uri(filename), container_profile)
+        if stream_copy:
+            pipeline.set_mode(GES.PipelineFlags.SMART_RENDER)
+        else:
+            pipeline.set_mode(GES.PipelineFlags.RENDER)
+
+        self.pipeline = pipeline
+        logger.warning("Starting %s", "smart rendering" if stream_copy else "encoding")
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.bus_message_cb)
+        GLib.timeout_add(300, self.duration_querier)
+
+    def render_parallel(self, filename, segments):
+        """Render segments into filename with worker processes.
+
+        Groups of segments are encoded into intermediate WebM files
+        by self.workers processes, then concatenated.
+        """
+        # Use more groups than workers, so that the load is balanced
+        groups = group_segments(segments, 2 * self.workers)
+        self.tmpdir = tempfile.mkdtemp(prefix='advene-montage')
+        # Do not fork a process running GStreamer threads
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        logger.warning("Encoding %d segment groups with %d workers", len(groups), self.workers)
+        futures = self.futures = []
+        for i, group in enumerate(groups):
+            # The plugin module cannot be imported by name in the
+            # workers (see run_plugin_function)
+            f = self.executor.submit(run_plugin_function, render_group.__code__.co_filename,
+                                     'render_group', self.media_uri, group,
+                                     os.path.join(self.tmpdir, "segment%04d.webm" % i))
+            f.duration = sum(duration for begin, duration in group) * Gst.MSECOND
+            futures.append(f)
+
+        def check_workers():
+            if self.executor is None:
+                # Rendering was cancelled
+                return False
+            done = [ f for f in futures if f.done() ]
+            failed = [ f for f in done if f.exception() is not None ]
+            if failed:
+                self.error = str(failed[0].exception())
+                logger.error("Error while encoding: %s", self.error)
+                self.finalize()
+                self.progress_cb(None)
+                return False
+            if len(done) < len(futures):
+                if self.progress_cb:
+                    # Keep the last 10% for the concatenation
+                    self.progress_cb(.9 * sum(f.duration for f in done) / self.total_duration)
+                return True
+            self.executor.shutdown()
+            self.executor = None
+            self.concatenate([ f.result() for f in futures ], filename)
+            return False
+        GLib.timeout_add(300, check_workers)
+
+    def concatenate(self, segment_files, filename):
+        """Concatenate the WebM segment_files into filename, without re-encoding.
+        """
+        info = GstPbutils.Discoverer.new(10 * Gst.SECOND).discover_uri(helper.path2uri(segment_files[0]))
+        kinds = [ 'video' ]
+        if info.get_audio_streams():
+            kinds.append('audio')
+
+        pipeline = Gst.Pipeline()
+        mux = Gst.ElementFactory.make('webmmux')
+        sink = Gst.ElementFactory.make('filesink')
+        sink.set_property('location', filename)
+        pipeline.add(mux)
+        pipeline.add(sink)
+        mux.link(sink)
+        # One concat element per stream kind. Its sink pads are
+        # requested beforehand, so that segments are concatenated in
+        # order whatever the order of the demuxers pads creation.
+        concat_pads = {}
+        for kind in kinds:
+            concat = Gst.ElementFactory.make('concat')
+            pipeline.add(concat)
+            concat.get_static_pad('src').link(mux.get_request_pad('%s_%%u' % kind))
+            concat_pads[kind] = [ concat.get_request_pad('sink_%u') for f in segment_files ]
+
+        def demux_pad_added(demux, pad, index):
+            kind = pad.get_current_caps().get_structure(0).get_name().split('/')[0]
+            if kind in concat_pads:
+                pad.link(concat_pads[kind][index])
+
+        for i, f in enumerate(segment_files):
+            src = Gst.ElementFactory.make('filesrc')
+            src.set_property('location', f)
+            demux = Gst.ElementFactory.make('matroskademux')
+            pipeline.add(src)
+            pipeline.add(demux)
+            src.link(demux)
+            demux.connect('pad-added', demux_pad_added, i)
+
+        self.pipeline = pipeline
+        logger.warning("Concatenating %d segments", len(segment_files))
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.concatenate_message_cb)
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+        def concatenate_progress():
+            if self.pipeline is None:
+                return False
+            pos = self.pipeline.query_position(Gst.Format.TIME)[1]
+            if self.progress_cb:
+                self.progress_cb(.9 + .1 * pos / self.total_duration)
+            return True
+        GLib.timeout_add(300, concatenate_progress)
+
+    def concatenate_message_cb(self, bus, message):
+        if message.type in (Gst.MessageType.EOS, Gst.MessageType.ERROR):
+            # Remove the intermediate segments
+            self.bus_message_cb(bus, message)
+            self.finalize()
+
+    def webm_profile(self):
+        """Return the VP8/Vorbis WebM encoding profile.
+        """
         container_profile = \
             GstPbutils.EncodingContainerProfile.new("montage-profile",
                                                     "Pitivi encoding profile",
@@ -131,44 +551,60 @@ class MontageRenderer:
                                                             0)
 
         container_profile.add_profile(audio_profile)
-
-        pipeline.set_render_settings(helper.path2uri(filename), container_profile)
-        pipeline.set_mode(GES.PipelineFlags.RENDER)
-
-        self.pipeline = pipeline
-        logger.warning("Starting encoding")
-        self.pipeline.set_state(Gst.State.PLAYING)
-
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self.bus_message_cb)
-        GLib.timeout_add(300, self.duration_querier)
+        return container_profile
 
 if __name__ == '__main__':
+    import argparse
     import sys
-    logging.basicConfig(level=logging.DEBUG)
-    USAGE = "%prog package_file type_name"
-    if sys.argv[2:]:
-        packagename = sys.argv[1]
-        atype = sys.argv[2]
-    else:
-        logger.warning(USAGE)
-        sys.exit(1)
+    import time
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Render the annotations of a type as a video montage")
+    parser.add_argument('package', help="Package file")
+    parser.add_argument('type', help="Annotation type id")
+    parser.add_argument('--output', action="store", default='/tmp/montage.webm',
+                        help="Output file")
+    parser.add_argument('--workers', action="store", type=int, default=None,
+                        help="Number of encoding processes (0 for the number of processors)")
+    parser.add_argument('--memory', action="store", type=int, default=None,
+                        help="Memory budget of the encoding processes, in MB (0 for no limit)")
+    parser.add_argument('--copy', action="store_true", default=False,
+                        help="Copy the video stream when the output has the source format")
+    parser.add_argument('--no-copy', dest='stream_copy', action="store_false", default=None,
+                        help="Always re-encode the video stream")
+    parser.add_argument('--snap', action="store_true", default=False,
+                        help="Snap cut points to keyframes when copying the video stream")
+    args = parser.parse_args()
+    if args.memory is not None:
+        config.data.preferences['montage-memory-budget'] = args.memory
+    if args.copy:
+        config.data.preferences['montage-stream-copy'] = True
 
     from advene.model.package import Package
 
-    logger.warning("Extracting from %s - type %s", packagename, atype)
-    p = Package(packagename)
-    at = p.get_element_by_id(atype)
+    logger.info("Extracting from %s - type %s", args.package, args.type)
+    p = Package(args.package)
+    at = p.get_element_by_id(args.type)
+    if at is None:
+        logger.error("No %s annotation type in %s", args.type, args.package)
+        sys.exit(1)
 
-    r = MontageRenderer(None, sorted(at.annotations))
+    r = MontageRenderer(None, sorted(at.annotations), media_uri=helper.path2uri(p.getMedia()))
 
     mainloop = GLib.MainLoop()
     def pg(value):
         if value is None:
             mainloop.quit()
             return
-        logging.warning("Progress %d", value)
+        logger.info("Progress %d%%", int(100 * value))
 
-    r.render('/tmp/montage.webm', pg)
+    t = time.time()
+    r.render(args.output, pg, stream_copy=args.stream_copy, snap_to_keyframes=args.snap, workers=args.workers)
     mainloop.run()
+    elapsed = time.time() - t
+    r.finalize()
+    if r.error is not None:
+        sys.exit(1)
+    duration = r.total_duration / Gst.SECOND
+    logger.info("Rendered %.1fs of video in %.1fs (%s, %d workers): x%.2f realtime, x%.2f per worker",
+                duration, elapsed, "stream copy" if r.stream_copy else "re-encoded", r.workers,
+                duration / elapsed, duration / elapsed / r.workers)
@@ -38,6 +38,7 @@ def register(controller=None):
 
 class MotionCellImporter(GstImporter):
     name = _("Motion cell detection")
+    media_type = 'video'
 
     def __init__(self, *p, **kw):
         super(MotionCellImporter, self).__init__(*p, **kw)
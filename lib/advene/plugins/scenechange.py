@@ -35,20 +35,35 @@ def register(controller=None):
 
 class SceneChangeImporter(GstImporter):
     name = _("Scene change detection")
+    media_type = 'video'
+    shardable = True
 
     def __init__(self, *p, **kw):
         super(SceneChangeImporter, self).__init__(*p, **kw)
 
         ## Internal data structures
-        self.buffer = [ 0 ]
+        # Scene change timestamps (in ns)
+        self.cuts = []
         self.duration = None
+        # Last timecode, set at the end of the stream
+        self.end_timecode = None
 
     def do_finalize(self):
+        buffer = [ 0 ] + self.cuts
+        if self.end_timecode is not None:
+            buffer.append(self.end_timecode)
         self.convert({ 'begin': int(begin / Gst.MSECOND),
                        'end': int(end / Gst.MSECOND),
                        'content': i + 1 }
-                     for i, (begin, end) in enumerate(zip(self.buffer[:-1], self.buffer[1:])))
-        self.buffer = []
+                     for i, (begin, end) in enumerate(zip(buffer[:-1], buffer[1:])))
+        self.cuts = []
+
+    def shard_events(self):
+        return [ (t / Gst.MSECOND, t) for t in self.cuts ]
+
+    def restore_shard_events(self, events, duration):
+        self.cuts = [ t for (ms, t) in events ]
+        self.end_timecode = int(duration * Gst.MSECOND)
 
     def pipeline_postprocess(self, pipeline):
         def event_handler(pad, parent, event):
@@ -59,8 +74,7 @@ class SceneChangeImporter(GstImporter):
                     self.duration = s.get_value('segment').stop
                 elif event.type == Gst.EventType.STREAM_GROUP_DONE:
                     # Push last timecode
-                    if self.duration is not None:
-                        self.buffer.append(self.duration)
+                    self.end_timecode = self.duration
                     # End of stream.
                     self.finalize()
                     return None
@@ -68,7 +82,7 @@ class SceneChangeImporter(GstImporter):
                     s = event.get_structure()
                     if s.get_name() == 'GstForceKeyUnit':
                         # Get stream time
-                        self.buffer.append(s.get_value('timestamp'))
+                        self.cuts.append(s.get_value('timestamp'))
             return event
         pad = self.sink.get_static_pad('sink')
         pad.set_event_function_full(event_handler)
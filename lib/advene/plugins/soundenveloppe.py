@@ -36,6 +36,7 @@ def register(controller=None):
 
 class SoundEnveloppeImporter(GstImporter):
     name = _("Sound enveloppe")
+    media_type = 'audio'
 
     def __init__(self, *p, **kw):
         super(SoundEnveloppeImporter, self).__init__(*p, **kw)
@@ -29,6 +29,8 @@ from advene.model.view import View
 from advene.model.query import Query
 from pickle import dumps, loads
 
+from advene.util.rwlock import write_locked
+
 name="Undo Manager"
 
 def register(controller):
@@ -55,6 +57,12 @@ class UndoHistory:
         self._rules=[]
         self._edits={}
 
+    @property
+    def package_lock(self):
+        """Lock used by write_locked methods.
+        """
+        return self.controller.package_lock
+
     def register(self):
         """Register to the appropriate events.
         """
@@ -66,6 +74,7 @@ class UndoHistory:
                 ('AnnotationCreate', self.element_create),
                 ('AnnotationEditEnd', self.element_edit_end),
                 ('AnnotationDelete', self.element_delete),
+                ('AnnotationBatch', self.annotation_batch),
 
                 ('ViewCreate', self.element_create),
                 ('ViewEditEnd', self.element_edit_end),
@@ -214,9 +223,45 @@ class UndoHistory:
             del self._edits[element]
             logger.debug("Saving content for %s", el)
 
+    def annotation_batch(self, context, parameters):
+        """Record the changes of a batch of annotations.
+
+        They are stored as a single batch of operations.
+        """
+        if context.globals.get('undone'):
+            # The change is done in the context of an Undo.
+            # Do not record it.
+            logger.debug("AnnotationBatch in Undo context")
+            return
+        operations=[]
+        for (element, event) in context.globals.get('changes', ()):
+            if event == 'AnnotationCreate':
+                operations.append( ('created', element, element.id) )
+            elif event == 'AnnotationEditEnd':
+                if element in self._edits:
+                    cached=self._edits[element]
+                    new=self.get_cached_representation(element)
+                    changed=[ (k, v) for (k, v) in cached.items() if new[k] != v ]
+                    operations.append( ('changed', element, changed) )
+                    self._edits[element]=new
+            elif event == 'AnnotationDelete':
+                if element in self._edits:
+                    operations.append( ('deleted', 'annotation', self._edits[element]) )
+                    del self._edits[element]
+        if not operations:
+            return
+        batch=context.globals.get('batch', None)
+        if batch is not None and batch == self.batch_id:
+            self.batch_history.extend(operations)
+        else:
+            self.batch_id=batch
+            self.batch_history=operations
+            self.history.append( ('batch', batch, operations) )
+
     def log(self, *p):
         self.controller.log("UndoManager: " + str(p))
 
+    @write_locked
     def undo(self, operation=None):
         """Undo the last operation.
         """
@@ -298,8 +343,9 @@ class UndoHistory:
             else:
                 self.log("Unknown element %s for undoing delete" % element)
         elif action == 'batch':
-            for op in data:
-                self.undo(operation=op)
+            with self.controller.batch_notifications():
+                for op in data:
+                    self.undo(operation=op)
             del data[:]
         else:
             self.log("Unknown operation %s for undo" % action)
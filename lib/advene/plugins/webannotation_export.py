@@ -44,6 +44,8 @@ class WebAnnotationExporter(FlatJsonExporter):
 
     def __init__(self, controller=None, source=None, callback=None):
         super().__init__(controller, source, callback)
+        # The output is a structured JSON-LD document, not a list of records
+        self.optionparser.remove_option("--format")
         self.split = False
         self.optionparser.add_option("-s", "--split",
                                      action="store_true", dest="split", default=self.split,
@@ -26,10 +26,12 @@ logger = logging.getLogger(__name__)
 
 import advene.core.config as config
 
+import collections
 import time
 import sched
 import threading
 import copy
+import json
 
 import advene.rules.elements
 
@@ -47,6 +49,132 @@ class MyThread(threading.Thread):
         if self._target:
             self._target()
 
+class EventRecord(collections.namedtuple('EventRecord', ('timestamp', 'position', 'event_name', 'elements'))):
+    """Compact event history record.
+
+    @ivar timestamp: the event time (in ms since the epoch)
+    @type timestamp: int
+    @ivar position: the media position (in ms) at the event time, or None
+    @type position: int
+    @ivar event_name: the event name
+    @type event_name: string
+    @ivar elements: the (parameter name, element id) pairs of the event parameters
+    @type elements: tuple
+    """
+    __slots__ = ()
+
+    def as_dict(self):
+        d = self._asdict()
+        d['elements'] = dict(self.elements)
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['timestamp'], d.get('position'), d['event_name'],
+                   tuple(d.get('elements', {}).items()))
+
+class EventHistory:
+    """Event history.
+
+    The last events are kept in a fixed-capacity ring buffer. If a log
+    filename is given, all events are also appended to the log file,
+    as JSON records (one per line), so that the whole history of the
+    session can be read back.
+
+    @ivar capacity: the maximum number of records kept in memory
+    @type capacity: int
+    @ivar log_filename: the log filename, or None
+    @type log_filename: string
+    """
+    def __init__(self, capacity=10000, log_filename=None):
+        self.records = collections.deque(maxlen=capacity)
+        self.log_filename = None
+        self._log = None
+        # Offset of the first record of the session in the log file
+        self._log_offset = 0
+        self.set_log(log_filename)
+
+    @property
+    def capacity(self):
+        return self.records.maxlen
+
+    def set_capacity(self, capacity):
+        """Set the number of records kept in memory.
+        """
+        if capacity != self.records.maxlen:
+            self.records = collections.deque(self.records, maxlen=capacity)
+
+    def set_log(self, log_filename):
+        """Set the log file. None disables logging.
+        """
+        if log_filename == self.log_filename:
+            return
+        self.close()
+        self.log_filename = log_filename
+        if log_filename:
+            try:
+                self._log = open(log_filename, 'a', encoding='utf-8')
+            except OSError:
+                logger.error("Cannot open event log %s", log_filename, exc_info=True)
+                self.log_filename = None
+                return
+            self._log_offset = self._log.tell()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def append(self, record):
+        self.records.append(record)
+        if self._log is not None:
+            try:
+                self._log.write(json.dumps(record.as_dict()) + '\n')
+            except (OSError, TypeError, ValueError):
+                logger.error("Cannot log event %s", record.event_name, exc_info=True)
+
+    def clear(self):
+        """Clear the in-memory records.
+
+        The log file is append-only: cleared records are still read
+        back by L{read}.
+        """
+        self.records.clear()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @staticmethod
+    def read_log(filename, offset=0):
+        """Read the records stored in a log file.
+
+        @param filename: the log filename
+        @param offset: the offset of the first record to read
+        @return: an iterator on the records
+        """
+        with open(filename, encoding='utf-8') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    yield EventRecord.from_dict(json.loads(line))
+                except (ValueError, KeyError, AttributeError):
+                    logger.warning("Invalid event log record: %s", line.strip())
+
+    def read(self):
+        """Return an iterator on the records of the session.
+
+        If the history is logged, all the records of the session are
+        read back from the log file. Else only the records still in
+        the ring buffer are returned.
+        """
+        if self._log is not None:
+            self._log.flush()
+            return self.read_log(self.log_filename, self._log_offset)
+        return iter(list(self.records))
+
 class ECAEngine:
     """ECAEngine class.
 
@@ -83,9 +211,10 @@ class ECAEngine:
         """
         self.clear_state()
         self.ruledict = {}
-        # History of events
-        self.event_history = []
         self.controller=controller
+        # History of events
+        self.event_history = EventHistory(config.data.preferences['event-history-size'],
+                                          config.data.preferences['event-history-log'] or None)
         self.catalog=advene.rules.elements.ECACatalog()
         self.scheduler=sched.scheduler(time.time, time.sleep)
         self.schedulerthread=MyThread(target=self.scheduler.run)
@@ -263,6 +392,41 @@ class ECAEngine:
         """
         self.catalog.register_action(registered_action)
 
+    def record_event(self, event_name, **kw):
+        """Record an event in the event history.
+
+        Only the ids of the element parameters are stored.
+
+        @return: the new record
+        @rtype: EventRecord
+        """
+        try:
+            position = self.controller.player.current_position_value
+        except AttributeError:
+            position = None
+        elements = tuple( (k, v.id)
+                          for k, v in kw.items()
+                          if isinstance(getattr(v, 'id', None), str) )
+        record = EventRecord(int(time.time() * 1000), position, event_name, elements)
+        self.event_history.append(record)
+        return record
+
+    def trace_event(self, event_name, *param, **kw):
+        """Record an event and send it to the trace building views.
+
+        The views get a dictionary holding the named parameters (with
+        the elements themselves), the event_name and the anonymous
+        parameters (in 'parameters').
+        """
+        self.record_event(event_name, **kw)
+        if self.views_to_notify:
+            d = dict(kw)
+            d['event_name'] = event_name
+            d['parameters'] = param
+            for v in self.views_to_notify:
+                # should only be TraceBuilder plugin or other trace building system
+                v.equeue.put(d)
+
     def register_view(self, view):
         self.views_to_notify.append(view)
 
@@ -354,15 +518,7 @@ class ECAEngine:
         It contains the delay to apply to the rule execution.
         """
         if config.data.preferences['record-actions']:
-            # FIXME: we should not store the whole element, it is too costly
-            d=dict(kw)
-            d['event_name'] = event_name
-            d['parameters'] = param
-            self.event_history.append(d)
-            for v in self.views_to_notify:
-                # should only be TraceBuilder plugin or other trace building system
-                #v.receive(d)
-                v.equeue.put(d)
+            self.trace_event(event_name, *param, **kw)
         immediate=False
         if 'immediate' in kw:
             immediate=True
@@ -375,13 +531,60 @@ class ECAEngine:
             logger.debug("Delay specified: %f", delay)
 
         context=self.build_context(event_name, **kw)
-        try:
-            a=self.ruledict[event_name]
-        except KeyError:
-            return
+        self.fire_rules(self.ruledict.get(event_name, ()), context, delay=delay, immediate=immediate)
+        if event_name == 'AnnotationBatch':
+            self.expand_annotation_batch(kw, delay=delay, immediate=immediate)
+
+    @staticmethod
+    def rule_owners(rule):
+        """Return the ids of the objects implementing the rule actions.
 
+        Only actions bound to an object method (internal rules) have
+        an owner.
+        """
+        return set(id(a.method.__self__)
+                   for a in rule.action
+                   if hasattr(getattr(a, 'method', None), '__self__'))
+
+    def expand_annotation_batch(self, kw, delay=0, immediate=False):
+        """Dispatch an AnnotationBatch as per-annotation events.
+
+        The rules for AnnotationCreate, AnnotationEditEnd and
+        AnnotationDelete (user rulesets, plugins...) are triggered
+        once for each change of the batch, with an annotation
+        parameter, and the changes are recorded in the event
+        history as individual events. Internal rules whose owner also handles the
+        AnnotationBatch event are not triggered, since the owner
+        already processed the whole batch.
+        """
+        batch_aware = set()
+        for rule in self.ruledict.get('AnnotationBatch', ()):
+            batch_aware.update(self.rule_owners(rule))
+        params = dict( (k, v)
+                       for (k, v) in kw.items()
+                       if k not in ('changes', 'annotations') )
+        changes = kw.get('changes', ())
+        # Rules to trigger, indexed by event name
+        event_rules = dict( (event_name, [ rule
+                                           for rule in self.ruledict.get(event_name, ())
+                                           if not (self.rule_owners(rule) & batch_aware) ])
+                            for event_name in set(e for (a, e) in changes) )
+        record = config.data.preferences['record-actions']
+        for (annotation, event_name) in changes:
+            params['annotation'] = annotation
+            if record:
+                self.trace_event(event_name, **params)
+            rules = event_rules[event_name]
+            if not rules:
+                continue
+            context = self.build_context(event_name, **params)
+            self.fire_rules(rules, context, delay=delay, immediate=immediate)
+
+    def fire_rules(self, rules, context, delay=0, immediate=False):
+        """Schedule the actions of the rules matching the context.
+        """
         rules=sorted( (rule
-                       for rule in a
+                       for rule in rules
                        if rule.condition.match(context) ),
                       key=lambda e: e.priority,
                       reverse=True)
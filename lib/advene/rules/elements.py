@@ -993,6 +993,7 @@ class ECACatalog:
         'AnnotationDeactivate':   _("Deactivation of an annotation"),
         'AnnotationMerge':        _("Merging of two annotations"),
         'AnnotationMove':         _("Moving an annotation"),
+        'AnnotationBatch':        _("Modification of a batch of annotations"),
         'RelationActivate':       _("Activation of a relation"),
         'RelationDeactivate':     _("Deactivation of a relation"),
         'RelationCreate':         _("Creation of a new relation"),
@@ -17,14 +17,21 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 #
 
+import datetime
+
 from advene.util.importer import GenericImporter, register
 import advene.core.config as config
+from advene.rules.ecaengine import EventHistory, EventRecord
 import advene.util.helper as helper
 
 from gettext import gettext as _
 
 class EventHistoryImporter(GenericImporter):
     """Event History importer.
+
+    The source is either 'event_history' (the event history of the
+    controller), an EventHistory instance, an event log filename or a
+    list of EventRecords.
     """
     name=_("Event history importer")
 
@@ -35,14 +42,32 @@ class EventHistoryImporter(GenericImporter):
     def can_handle(fname):
         return fname == 'event_history'
 
-    def iterator(self, f):
-        start=f[0]['timestamp']
-        end=start
-        id_="Traces"
-        schema=self.package.get_element_by_id(id_)
-        for e in f:
-            typename = e['event_name']
-            type_ = self.package.get_element_by_id(typename)
+    def records(self, source):
+        """Return an iterator on the event records of source.
+        """
+        if isinstance(source, str):
+            if source == 'event_history':
+                return self.controller.event_handler.event_history.read()
+            return EventHistory.read_log(source)
+        elif isinstance(source, EventHistory):
+            return source.read()
+        return iter(source)
+
+    def iterator(self, records):
+        start=None
+        end=None
+        schema=self.package.get_element_by_id("Traces")
+        types={}
+        for e in records:
+            if isinstance(e, dict):
+                e = EventRecord.from_dict(e)
+            if start is None:
+                start=e.timestamp
+                end=start
+            typename = e.event_name
+            type_ = types.get(typename)
+            if type_ is None:
+                type_ = self.package.get_element_by_id(typename)
             if type_ is None:
                 #Annotation type creation
                 self.package._idgenerator.add(typename)
@@ -54,23 +79,22 @@ class EventHistoryImporter(GenericImporter):
                 type_.setMetaData(config.data.namespace, 'color', next(self.package._color_palette))
                 type_.setMetaData(config.data.namespace, 'item_color', 'here/tag_color')
                 schema.annotationTypes.append(type_)
+            types[typename] = type_
 
-            d={
+            content = [ 'position=%s' % e.position ]
+            content.extend('%s=%s' % (k, v) for k, v in e.elements)
+            yield {
                 'type': type_,
-                'begin': e['timestamp'] - start,
+                'begin': e.timestamp - start,
                 'duration': 50,
-                'timestamp': e['timestamp'],
-                'content': '',
+                'timestamp': datetime.datetime.fromtimestamp(e.timestamp / 1000).replace(microsecond=0).isoformat(),
+                'content': "\n".join(content) + "\n",
             }
-            if 'content' in e:
-                d['content']=e['content']+'\nposition='+str(e['movietime'])+'\n'
-            else:
-                d['content']='position='+str(e['movietime'])+'\n'
-            if end<e['timestamp']+50:
-                end=e['timestamp']+50
-            yield d
-        #fix package duration
-        self.package.cached_duration=end-start
+            if end<e.timestamp+50:
+                end=e.timestamp+50
+        if start is not None:
+            #fix package duration
+            self.package.cached_duration=end-start
 
     def process_file(self, filename):
         if self.package is None:
@@ -85,6 +109,6 @@ class EventHistoryImporter(GenericImporter):
             schema.date=helper.get_timestamp()
             schema.title=title_
             self.package.schemas.append(schema)
-        self.convert(self.iterator(filename))
+        self.convert(self.iterator(self.records(filename)))
         return self.package
 register(EventHistoryImporter)
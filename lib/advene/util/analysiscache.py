@@ -0,0 +1,315 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""
+Analysis cache
+==============
+
+This module stores the results of media analyses (annotation data
+emitted by importers, or raw feature arrays), so that running the same
+analysis with the same parameters on the same media can be served
+without processing the media again.
+
+Entries are keyed by the media content fingerprint (so that renamed
+or copied media files still match), the analyzer name and its
+options. The least recently used entries are evicted when the cache
+size exceeds the analysis-cache-size preference.
+
+Usage: python3 -m advene.util.analysiscache [--dir DIR] [list|purge|evict] [options]
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+try:
+    import advene.core.config as config
+except ModuleNotFoundError:
+    # Try to find if we are in a development tree.
+    maindir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    if os.path.exists(os.path.join(maindir, "setup.py")):
+        # Chances are that we are in a development tree...
+        libpath = os.path.join(maindir, "lib")
+        logger.warning("You seem to have a development tree at:\n%s." % libpath)
+        sys.path.insert(0, libpath)
+    import advene.core.config as config
+    config.data.fix_paths(maindir)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Size of the chunks of media data used for fingerprinting
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+
+# Media fingerprints, indexed by (path, size, mtime)
+_fingerprints = {}
+
+def media_fingerprint(path):
+    """Return a fingerprint of the media file content.
+
+    Only the size and the beginning, middle and end of the file are
+    hashed, so that it can be computed quickly on large files.
+    """
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    fp = _fingerprints.get(memo_key)
+    if fp is None:
+        h = hashlib.sha1(str(st.st_size).encode())
+        with open(path, 'rb') as f:
+            for offset in (0, st.st_size // 2, st.st_size - FINGERPRINT_CHUNK_SIZE):
+                f.seek(max(0, offset))
+                h.update(f.read(FINGERPRINT_CHUNK_SIZE))
+        fp = _fingerprints[memo_key] = h.hexdigest()
+    return fp
+
+class AnalysisCache:
+    """Analysis results cache.
+
+    Each entry is stored as a data file (<key>.json for rows,
+    <key>.npy for arrays) with a <key>.meta JSON metadata file. The
+    access time of entries is tracked through the modification time
+    of the metadata file.
+
+    @ivar directory: the cache directory
+    @ivar max_size: the maximum cache size in bytes (0 for no limit)
+    """
+    def __init__(self, directory=None, max_size=None):
+        if directory is None:
+            directory = config.data.advenefile('analysis_cache', 'settings')
+        if max_size is None:
+            max_size = config.data.preferences.get('analysis-cache-size', 0)
+        self.directory = str(directory)
+        self.max_size = max_size
+
+    def key(self, filename, analyzer, options=None):
+        """Return the cache key for the given analysis.
+        """
+        data = json.dumps([ media_fingerprint(filename), analyzer, options or {} ],
+                          sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def get(self, key):
+        """Return the (data, metadata) tuple for key, or (None, None).
+        """
+        meta_path = self._path(key, '.meta')
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['kind'] == 'array':
+                if numpy is None:
+                    return None, None
+                data = numpy.load(self._path(key, '.npy'))
+            else:
+                with open(self._path(key, '.json'), encoding='utf-8') as f:
+                    data = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        except Exception:
+            logger.error("Invalid analysis cache entry %s", key, exc_info=True)
+            self.remove(key)
+            return None, None
+        # Record the access time for eviction
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        logger.debug("Analysis cache hit for %s", key)
+        return data, meta.get('metadata', {})
+
+    def put(self, key, data, filename=None, analyzer=None, options=None, metadata=None):
+        """Store data (a numpy array, or JSON-serializable rows) for key.
+
+        Return True if the data could be stored.
+        """
+        if numpy is not None and isinstance(data, numpy.ndarray):
+            kind, ext = 'array', '.npy'
+        else:
+            kind, ext = 'rows', '.json'
+        meta = {
+            'kind': kind,
+            'media': os.path.abspath(filename) if filename else None,
+            'analyzer': analyzer,
+            'options': options or {},
+            'metadata': metadata or {},
+            'created': time.time(),
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key, ext)
+        tmp = path + '.tmp'
+        try:
+            if kind == 'array':
+                with open(tmp, 'wb') as f:
+                    numpy.save(f, data)
+            else:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+            os.replace(tmp, path)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, default=str)
+            os.replace(tmp, self._path(key, '.meta'))
+        except (TypeError, ValueError, OSError):
+            logger.error("Cannot store analysis results in cache", exc_info=True)
+            for p in (tmp, path):
+                if os.path.exists(p):
+                    os.unlink(p)
+            return False
+        self.evict()
+        return True
+
+    def remove(self, key):
+        """Remove the entry for key.
+        """
+        for ext in ('.meta', '.json', '.npy'):
+            try:
+                os.unlink(self._path(key, ext))
+            except FileNotFoundError:
+                pass
+
+    def entries(self):
+        """Return the list of cache entries (as dicts), least recently used first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        res = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.meta'):
+                continue
+            key = name[:-5]
+            meta_path = os.path.join(self.directory, name)
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                size = os.path.getsize(meta_path)
+                data_path = self._path(key, '.npy' if meta.get('kind') == 'array' else '.json')
+                size += os.path.getsize(data_path)
+                accessed = os.path.getmtime(meta_path)
+            except (OSError, ValueError):
+                logger.warning("Invalid analysis cache entry %s", key)
+                continue
+            meta.update(key=key, size=size, accessed=accessed)
+            res.append(meta)
+        res.sort(key=lambda e: e['accessed'])
+        return res
+
+    def size(self):
+        """Return the total size of the cache in bytes.
+        """
+        return sum(e['size'] for e in self.entries())
+
+    def evict(self, max_size=None):
+        """Remove the least recently used entries until the cache size is below max_size.
+
+        Return the list of removed entries.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if not max_size:
+            return []
+        entries = self.entries()
+        total = sum(e['size'] for e in entries)
+        removed = []
+        for e in entries:
+            if total <= max_size:
+                break
+            self.remove(e['key'])
+            total -= e['size']
+            removed.append(e)
+        return removed
+
+    def purge(self, analyzer=None, media=None, older_than=None):
+        """Remove the matching entries (all entries if no criterion is given).
+
+        @param analyzer: analyzer name
+        @param media: media filename
+        @param older_than: minimum age (in seconds) since last access
+        @return: the list of removed entries
+        """
+        removed = []
+        now = time.time()
+        for e in self.entries():
+            if analyzer is not None and e.get('analyzer') != analyzer:
+                continue
+            if media is not None and e.get('media') != os.path.abspath(media):
+                continue
+            if older_than is not None and now - e['accessed'] < older_than:
+                continue
+            self.remove(e['key'])
+            removed.append(e)
+        return removed
+
+_cache = None
+
+def get_cache():
+    """Return the shared analysis cache.
+    """
+    global _cache
+    if _cache is None:
+        _cache = AnalysisCache()
+    return _cache
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser("Analysis cache")
+    parser.add_argument('--dir', action="store", default=None,
+                        help="Cache directory (default: analysis_cache in the settings directory)")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('list', help="List cache entries")
+    purge_parser = subparsers.add_parser('purge', help="Remove cache entries")
+    purge_parser.add_argument('--analyzer', action="store", default=None,
+                              help="Only remove entries for the given analyzer")
+    purge_parser.add_argument('--media', action="store", default=None,
+                              help="Only remove entries for the given media file")
+    purge_parser.add_argument('--older-than', action="store", type=float, default=None,
+                              help="Only remove entries not used for the given number of days")
+    evict_parser = subparsers.add_parser('evict', help="Remove least recently used entries")
+    evict_parser.add_argument('--max-size', action="store", type=int, default=None,
+                              help="Maximum cache size in MB (default: analysis-cache-size preference)")
+    args = parser.parse_args(saved_args)
+
+    cache = AnalysisCache(args.dir)
+    if args.command == 'purge':
+        removed = cache.purge(analyzer=args.analyzer, media=args.media,
+                              older_than=args.older_than * 86400 if args.older_than is not None else None)
+        logger.info("Removed %d entries", len(removed))
+    elif args.command == 'evict':
+        removed = cache.evict(args.max_size * 1024 * 1024 if args.max_size is not None else None)
+        logger.info("Removed %d entries", len(removed))
+    else:
+        entries = cache.entries()
+        for e in entries:
+            print("%s\t%s\t%s\t%d\t%s\t%s" % (e['key'],
+                                             time.strftime('%Y-%m-%d %H:%M', time.localtime(e['accessed'])),
+                                             e.get('analyzer'),
+                                             e['size'],
+                                             e.get('media'),
+                                             json.dumps(e.get('options'), sort_keys=True)))
+        print("%d entries, %.1f MB in %s" % (len(entries), sum(e['size'] for e in entries) / 1024 / 1024, cache.directory))
@@ -0,0 +1,451 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""
+Package consistency checkers
+============================
+
+Checkers detect possible issues in a package (overlapping
+annotations, null durations, undefined keywords...). They are
+independent from the GUI: the issues are computed once for the whole
+package, then updated incrementally from annotation and annotation
+type events, so that only the elements affected by a modification are
+checked again.
+
+The same checkers are used by the checker view, and by the command
+line: python3 -m advene.util.checker [-c checker] package_file
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+from bisect import bisect_left
+import itertools
+import os
+import sys
+
+from gettext import gettext as _
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+try:
+    import advene.core.config as config
+except ModuleNotFoundError:
+    # Try to find if we are in a development tree.
+    maindir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    if os.path.exists(os.path.join(maindir, "setup.py")):
+        # Chances are that we are in a development tree...
+        libpath = os.path.join(maindir, "lib")
+        logger.warning("You seem to have a development tree at:\n%s." % libpath)
+        sys.path.insert(0, libpath)
+    import advene.core.config as config
+    config.data.fix_paths(maindir)
+
+from advene.model.annotation import Annotation
+from advene.model.schema import AnnotationType
+import advene.util.helper as helper
+
+CHECKERS = {}
+def register_checker(checker):
+    """Register a checker
+    """
+    CHECKERS[checker.__name__] = checker
+    return checker
+
+def get_checker(name):
+    """Return the checker corresponding to name.
+    """
+    return CHECKERS.get(name)
+
+class FeatureChecker:
+    """API for feature checking.
+
+    Issues are stored per annotation type id, as dicts mapping
+    elements to an issue detail (a tuple of strings). Elements which
+    are not annotations (for package-level checks) are stored under
+    the None key.
+
+    Checkers of annotation properties only have to implement
+    annotation_issue. Checkers involving several annotations should
+    override the update methods.
+    """
+    name = "Abstract FeatureChecker"
+    description = ""
+    # Titles of the issue detail fields
+    detail_titles = ()
+
+    def __init__(self, package=None):
+        self.package = package
+        # Issues, indexed by annotation type id, then by element
+        self.issues = {}
+        # Issue key for each element with an issue
+        self.issue_keys = {}
+        if package is not None:
+            self.check_package()
+
+    def reset(self, package):
+        """Check a whole package.
+        """
+        self.package = package
+        self.check_package()
+
+    def set_issue(self, el, key, detail):
+        """Set (or clear if detail is None) the issue for el.
+
+        Return True if the issues changed.
+        """
+        old_key = self.issue_keys.get(el)
+        if detail is None:
+            if old_key is None and el not in self.issue_keys:
+                return False
+            self.clear_issue(el)
+            return True
+        if old_key != key or el not in self.issue_keys:
+            self.clear_issue(el)
+        elif self.issues[key].get(el) == detail:
+            return False
+        self.issues.setdefault(key, {})[el] = detail
+        self.issue_keys[el] = key
+        return True
+
+    def clear_issue(self, el):
+        """Clear the issue for el.
+        """
+        if el not in self.issue_keys:
+            return False
+        key = self.issue_keys.pop(el)
+        issues = self.issues.get(key, {})
+        issues.pop(el, None)
+        if not issues:
+            self.issues.pop(key, None)
+        return True
+
+    def check_package(self):
+        """(Re)compute the issues for the whole package.
+        """
+        self.issues = {}
+        self.issue_keys = {}
+        if self.package is None:
+            return
+        for a in self.package.annotations:
+            self.check_annotation(a)
+
+    def annotation_issue(self, annotation):
+        """Return the issue detail for annotation, or None.
+        """
+        return None
+
+    def check_annotation(self, annotation):
+        return self.set_issue(annotation, annotation.type.id, self.annotation_issue(annotation))
+
+    def update_annotation(self, annotation, event):
+        """Update the issues after an annotation event.
+
+        Return True if the issues changed.
+        """
+        if event == 'AnnotationDelete':
+            return self.clear_issue(annotation)
+        elif event in ('AnnotationCreate', 'AnnotationEditEnd'):
+            return self.check_annotation(annotation)
+        return False
+
+    def update_annotationtype(self, annotationtype, event):
+        """Update the issues after an annotation type event.
+
+        Return True if the issues changed.
+        """
+        if event == 'AnnotationTypeDelete':
+            changed = False
+            for el in list(self.issues.get(annotationtype.id, {})):
+                changed = self.clear_issue(el) or changed
+            return changed
+        elif event == 'AnnotationTypeEditEnd':
+            changed = False
+            for a in annotationtype.annotations:
+                changed = self.check_annotation(a) or changed
+            return changed
+        return False
+
+    def elements(self):
+        """Return the elements with issues.
+        """
+        return [ el for issues in self.issues.values() for el in issues ]
+
+    def detail(self, el):
+        """Return the issue detail for el, or None.
+        """
+        key = self.issue_keys.get(el)
+        if key is None and el not in self.issue_keys:
+            return None
+        return self.issues[key][el]
+
+    def issue_count(self):
+        return len(self.issue_keys)
+
+@register_checker
+class OverlappingChecker(FeatureChecker):
+    name = "Overlapping"
+    description = _("This table presents for each type annotations that are overlapping.")
+    detail_titles = (_("Begin overlap"), _("End overlap"))
+
+    def check_package(self):
+        # Annotations of each type, sorted by (begin, package order)
+        self.timelines = {}
+        self.keys = {}
+        # Sort key for each annotation: (type id, (begin, rank))
+        self.positions = {}
+        # Rank of the next created annotation (appended to the package)
+        self.rank = itertools.count()
+        self.issues = {}
+        self.issue_keys = {}
+        if self.package is None:
+            return
+        for a in self.package.annotations:
+            self.positions[a] = (a.type.id, (a.fragment.begin, next(self.rank)))
+            self.timelines.setdefault(a.type.id, []).append(a)
+        for typeid, annotations in self.timelines.items():
+            annotations.sort(key=lambda a: self.positions[a][1])
+            self.keys[typeid] = [ self.positions[a][1] for a in annotations ]
+            for i in range(len(annotations)):
+                self.check_index(typeid, i)
+
+    def check_index(self, typeid, i):
+        """Check the annotation at index i of the timeline for typeid.
+        """
+        annotations = self.timelines.get(typeid, [])
+        if i < 0 or i >= len(annotations):
+            return False
+        a = annotations[i]
+        begin_overlap = i > 0 and annotations[i - 1].fragment.end > a.fragment.begin
+        end_overlap = i < len(annotations) - 1 and a.fragment.end > annotations[i + 1].fragment.begin
+        if begin_overlap or end_overlap:
+            detail = (begin_overlap, end_overlap)
+        else:
+            detail = None
+        return self.set_issue(a, typeid, detail)
+
+    def remove(self, annotation):
+        """Remove annotation from its timeline, and recheck its neighbours.
+        """
+        position = self.positions.pop(annotation, None)
+        if position is None:
+            return self.clear_issue(annotation)
+        typeid, key = position
+        keys = self.keys[typeid]
+        i = bisect_left(keys, key)
+        del keys[i]
+        del self.timelines[typeid][i]
+        changed = self.clear_issue(annotation)
+        for j in (i - 1, i):
+            changed = self.check_index(typeid, j) or changed
+        return changed
+
+    def insert(self, annotation, rank):
+        """Insert annotation in its timeline, and recheck it and its neighbours.
+        """
+        typeid = annotation.type.id
+        key = (annotation.fragment.begin, rank)
+        self.positions[annotation] = (typeid, key)
+        keys = self.keys.setdefault(typeid, [])
+        i = bisect_left(keys, key)
+        keys.insert(i, key)
+        self.timelines.setdefault(typeid, []).insert(i, annotation)
+        changed = False
+        for j in (i - 1, i, i + 1):
+            changed = self.check_index(typeid, j) or changed
+        return changed
+
+    def update_annotation(self, annotation, event):
+        if event == 'AnnotationDelete':
+            return self.remove(annotation)
+        elif event == 'AnnotationCreate':
+            if annotation in self.positions:
+                return False
+            return self.insert(annotation, next(self.rank))
+        elif event == 'AnnotationEditEnd':
+            position = self.positions.get(annotation)
+            if position is None:
+                return self.insert(annotation, next(self.rank))
+            # Keep the package order rank
+            rank = position[1][1]
+            changed = self.remove(annotation)
+            return self.insert(annotation, rank) or changed
+        return False
+
+    def update_annotationtype(self, annotationtype, event):
+        if event == 'AnnotationTypeDelete':
+            changed = False
+            for a in list(self.timelines.get(annotationtype.id, [])):
+                changed = self.remove(a) or changed
+            return changed
+        return False
+
+@register_checker
+class CompletionChecker(FeatureChecker):
+    name = "Completions"
+    description = _("For every annotation type that has predefined keywords, this table displays the annotations that contain unspecified keywords.")
+    detail_titles = (_("Undef. keywords"), )
+
+    def check_package(self):
+        # Predefined completions, indexed by annotation type id
+        self.completions = {}
+        super().check_package()
+
+    def type_completions(self, at):
+        try:
+            return self.completions[at.id]
+        except KeyError:
+            c = self.completions[at.id] = set(helper.get_type_predefined_completions(at))
+            return c
+
+    def annotation_issue(self, annotation):
+        completions = self.type_completions(annotation.type)
+        if completions:
+            # There are completions. Check if the annotation uses a
+            # keyword not predefined.
+            diff = set(annotation.content.parsed()) - completions
+            if diff:
+                return (",".join(diff), )
+        return None
+
+    def update_annotationtype(self, annotationtype, event):
+        self.completions.pop(annotationtype.id, None)
+        return super().update_annotationtype(annotationtype, event)
+
+@register_checker
+class OntologyURIChecker(FeatureChecker):
+    name = "Ontology URI"
+    description = _("This table presents elements (package, schemas, annotation types) that do not have the ontology_uri reference metadata.")
+
+    def check_package(self):
+        self.issues = {}
+        self.issue_keys = {}
+        if self.package is None:
+            return
+        for el in itertools.chain([ self.package ], self.package.schemas, self.package.annotationTypes):
+            self.set_issue(el, None, self.element_issue(el))
+
+    def element_issue(self, el):
+        if el.getMetaData(config.data.namespace, "ontology_uri"):
+            return None
+        return ()
+
+    def update_annotation(self, annotation, event):
+        return False
+
+    def update_annotationtype(self, annotationtype, event):
+        if event == 'AnnotationTypeDelete':
+            return self.clear_issue(annotationtype)
+        return self.set_issue(annotationtype, None, self.element_issue(annotationtype))
+
+@register_checker
+class DurationChecker(FeatureChecker):
+    name = "Duration"
+    description = _("This table presents the annotations that have a null duration.")
+
+    def annotation_issue(self, annotation):
+        if not annotation.fragment.duration:
+            return ()
+        return None
+
+@register_checker
+class TypeChecker(FeatureChecker):
+    name = "Type"
+    description = _("This table presents annotation whose content types does not match their type's content-type")
+    detail_titles = ('content mimetype', 'type mimetype')
+
+    def annotation_issue(self, annotation):
+        if annotation.content.mimetype != annotation.type.mimetype:
+            return (annotation.content.mimetype, annotation.type.mimetype)
+        return None
+
+@register_checker
+class EmptyContentChecker(FeatureChecker):
+    name = "EmptyContent"
+    description = _("This table presents the annotations that have an empty content.")
+
+    def annotation_issue(self, annotation):
+        if not annotation.content.data:
+            return ()
+        return None
+
+class CheckerEngine:
+    """Run a set of checkers on a package, and keep their issues up-to-date.
+
+    @ivar checkers: the checker instances, indexed by checker class name
+    """
+    def __init__(self, package=None, names=None):
+        if names is None:
+            names = list(CHECKERS)
+        self.checkers = dict( (name, CHECKERS[name](package))
+                              for name in names
+                              if name in CHECKERS )
+
+    def reset(self, package):
+        for checker in self.checkers.values():
+            checker.reset(package)
+
+    def update_element(self, element, event):
+        """Update the checkers after an element event.
+
+        Return the list of names of the checkers whose issues changed.
+        """
+        if isinstance(element, Annotation):
+            method = 'update_annotation'
+        elif isinstance(element, AnnotationType):
+            method = 'update_annotationtype'
+        else:
+            return []
+        return [ name
+                 for name, checker in self.checkers.items()
+                 if getattr(checker, method)(element, event) ]
+
+    def report(self):
+        """Return the issues as a list of (checker name, element, detail) tuples.
+        """
+        return [ (name, el, checker.detail(el))
+                 for name, checker in self.checkers.items()
+                 for el in checker.elements() ]
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from advene.model.package import Package
+    from advene.util.tools import path2uri
+
+    parser = argparse.ArgumentParser("Package checker")
+    parser.add_argument('-c', '--checker', action="append", default=None,
+                        choices=sorted(CHECKERS),
+                        help="Checker to run (default: all). Can be specified multiple times.")
+    parser.add_argument('package', help="Package file")
+    args = parser.parse_args(saved_args)
+
+    engine = CheckerEngine(Package(path2uri(args.package)), args.checker)
+    count = 0
+    for name, checker in engine.checkers.items():
+        for typeid, issues in sorted(checker.issues.items(), key=lambda i: i[0] or ''):
+            for el, detail in sorted(issues.items(), key=lambda i: getattr(i[0], 'id', '')):
+                count += 1
+                if isinstance(el, Annotation):
+                    where = "%s\t%s" % (helper.format_time(el.fragment.begin), helper.format_time(el.fragment.end))
+                else:
+                    where = "\t"
+                print("\t".join((checker.name, typeid or '', getattr(el, 'id', el.uri), where,
+                                 ", ".join("%s: %s" % t for t in zip(checker.detail_titles, detail) if t[1]))))
+    logger.info("%d possible issue(s)", count)
@@ -28,11 +28,14 @@ logger = logging.getLogger(__name__)
 
 from gettext import gettext as _
 
+import contextlib
+import csv
 import io
 import json
 import optparse
 import os
 import sys
+from xml.sax.saxutils import escape, quoteattr
 
 import advene.core.config as config
 
@@ -56,6 +59,117 @@ def register_exporter(exp):
     else:
         return None
 
+class RecordWriter:
+    """Write a sequence of records (dicts) to a text stream.
+
+    Records are written as soon as they are provided, so that the
+    memory usage does not depend on the number of records.
+
+    @ivar name: the name of the record collection (e.g. "annotations")
+    """
+    def __init__(self, stream, name="annotations"):
+        self.stream = stream
+        self.name = name
+
+    def start(self):
+        """Write the collection header.
+        """
+        return
+
+    def write(self, record):
+        """Write a single record.
+        """
+        raise NotImplementedError
+
+    def end(self):
+        """Write the collection footer.
+        """
+        return
+
+    def encode(self, value):
+        """Convert a record value to a string.
+        """
+        if isinstance(value, str):
+            return value
+        elif value is None:
+            return ""
+        elif isinstance(value, (int, float)):
+            return str(value)
+        return json.dumps(value, ensure_ascii=False, sort_keys=True, cls=CustomJSONEncoder)
+
+class JSONRecordWriter(RecordWriter):
+    """JSON writer.
+
+    The output is identical to json.dump({ name: records }, indent=4, sort_keys=True).
+    """
+    def start(self):
+        self.count = 0
+        self.stream.write('{\n    %s: [' % json.dumps(self.name))
+
+    def write(self, record):
+        data = json.dumps(record, skipkeys=True, ensure_ascii=False, sort_keys=True, indent=4, cls=CustomJSONEncoder)
+        self.stream.write("%s\n        %s" % ("," if self.count else "",
+                                             data.replace('\n', '\n        ')))
+        self.count += 1
+
+    def end(self):
+        if self.count:
+            self.stream.write('\n    ]\n}')
+        else:
+            self.stream.write(']\n}')
+
+class NDJSONRecordWriter(RecordWriter):
+    """Newline-delimited JSON writer (one record per line).
+    """
+    def write(self, record):
+        self.stream.write(json.dumps(record, skipkeys=True, ensure_ascii=False, sort_keys=True, cls=CustomJSONEncoder))
+        self.stream.write('\n')
+
+class CSVRecordWriter(RecordWriter):
+    """CSV writer.
+
+    The columns are the keys of the first record. Non-string values
+    are JSON-encoded.
+    """
+    def start(self):
+        self.writer = None
+
+    def write(self, record):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.stream, fieldnames=sorted(record.keys()), extrasaction='ignore')
+            self.writer.writeheader()
+        self.writer.writerow(dict( (k, self.encode(v)) for (k, v) in record.items() ))
+
+class XMLRecordWriter(RecordWriter):
+    """XML writer.
+
+    Each record is serialized as an element (named after the
+    collection name, without its trailing s), with a child element
+    per key. Non-string values are JSON-encoded.
+    """
+    def start(self):
+        self.item_name = self.name[:-1] if self.name.endswith('s') else 'item'
+        self.stream.write('<?xml version="1.0" encoding="utf-8"?>\n<%s>\n' % self.name)
+
+    def write(self, record):
+        attr = ''
+        if 'id' in record:
+            attr = ' id=%s' % quoteattr(self.encode(record['id']))
+        self.stream.write('<%s%s>' % (self.item_name, attr))
+        for k in sorted(record.keys()):
+            self.stream.write('<%s>%s</%s>' % (k, escape(self.encode(record[k])), k))
+        self.stream.write('</%s>\n' % self.item_name)
+
+    def end(self):
+        self.stream.write('</%s>\n' % self.name)
+
+RECORD_WRITERS = {
+    'json': JSONRecordWriter,
+    'ndjson': NDJSONRecordWriter,
+    'csv': CSVRecordWriter,
+    'xml': XMLRecordWriter,
+}
+
 def get_exporter(name=None):
     """Return the list of exporters.
     """
@@ -202,6 +316,30 @@ class GenericExporter:
         """
         textstream.write(str(data, 'utf-8'))
 
+    @contextlib.contextmanager
+    def output_stream(self, filename):
+        """Return a context manager for a text stream on filename.
+
+        filename may be a pathname, '-' for stdout, a text stream or a
+        binary stream (utf-8 is then used).
+        """
+        if isinstance(filename, io.TextIOBase):
+            yield filename
+        elif isinstance(filename, (io.BytesIO, io.BufferedIOBase)):
+            stream = io.TextIOWrapper(filename, encoding='utf-8', write_through=True)
+            try:
+                yield stream
+            finally:
+                stream.flush()
+                # Do not close the underlying binary stream
+                stream.detach()
+        elif filename == '-':
+            # Export to stdout
+            yield sys.stdout
+        else:
+            with open(filename, 'wt', encoding='utf-8') as fd:
+                yield fd
+
     def output(self, data, filename):
         """Output data to the specified filename.
 
@@ -214,22 +352,37 @@ class GenericExporter:
         """
         if filename is None:
             return data
-        elif isinstance(filename, io.TextIOBase):
-            self.serialize(data, filename)
-            return ""
-        elif isinstance(filename, io.BytesIO):
-            with io.StringIO() as buf:
-                self.serialize(data, buf)
-                filename.write(buf.encode('utf-8'))
-            return ""
-        elif filename == '-':
-            # Export to stdout
-            self.serialize(data, sys.stdout)
-            return ""
-        else:
-            with open(filename, 'wt', encoding='utf-8') as fd:
-                self.serialize(data, fd)
-            return ""
+        with self.output_stream(filename) as fd:
+            self.serialize(data, fd)
+        return ""
+
+    def iter_records(self):
+        """Iterate over the exported records.
+
+        Exporters whose output is a flat list of records (dicts) can
+        implement this method, and use output_records to write them
+        without building the whole data structure in memory.
+        """
+        raise NotImplementedError
+
+    def output_records(self, records, filename, format='json', name='annotations'):
+        """Output records to the specified filename.
+
+        Records are written one at a time through a RecordWriter
+        corresponding to format (see RECORD_WRITERS).
+
+        If filename is None, return the data in native form
+        (i.e. a { name: [ records ] } dict).
+        """
+        if filename is None:
+            return { name: list(records) }
+        with self.output_stream(filename) as fd:
+            writer = RECORD_WRITERS[format](fd, name)
+            writer.start()
+            for record in records:
+                writer.write(record)
+            writer.end()
+        return ""
 
     def export(self, filename=None):
         """Export the source to the specified filename.
@@ -310,8 +463,7 @@ class TemplateExporter(GenericExporter):
             stream.close()
             return value
         elif isinstance(filename, io.TextIOBase):
-            # Enforce UTF-8
-            filename.write(stream.getvalue().encode('utf-8'))
+            filename.write(stream.getvalue().decode('utf-8'))
         elif isinstance(filename, io.BytesIO):
             # Nothing to do: it is the responsibility of the caller to close the stream
             pass
@@ -341,10 +493,19 @@ class FlatJsonExporter(GenericExporter):
         """
         return expr in ('package', 'annotation-type', 'annotation-container')
 
+    def __init__(self, controller=None, source=None, callback=None):
+        super().__init__(controller, source, callback)
+        self.format = "json"
+        self.optionparser.add_option("-f", "--format",
+                                     action="store", type="choice", dest="format",
+                                     choices=tuple(RECORD_WRITERS.keys()),
+                                     default=self.format,
+                                     help=_("Output format (json, ndjson, csv or xml)"))
+
     def serialize(self, data, textstream):
         json.dump(data, textstream, skipkeys=True, ensure_ascii=False, sort_keys=True, indent=4, cls=CustomJSONEncoder)
 
-    def export(self, filename=None):
+    def iter_records(self):
         # Works if source is a package or a type
         package = self.source.ownerPackage
         media_uri = package.getMetaData(config.data.namespace, "media_uri") or self.controller.get_default_media()
@@ -366,10 +527,11 @@ class FlatJsonExporter(GenericExporter):
                 "parsed": a.content.parsed()
             }
 
-        data = { "annotations": [ flat_json(a)
-                                  for a in self.source.annotations ] }
+        for a in self.source.annotations:
+            yield flat_json(a)
 
-        return self.output(data, filename)
+    def export(self, filename=None):
+        return self.output_records(self.iter_records(), filename, self.format)
 
 def init_templateexporters():
     exporter_package = Package(uri=config.data.advenefile('exporters.xml', as_uri=True))
@@ -386,7 +548,7 @@ def init_templateexporters():
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
-    USAGE = f"{sys.argv[0]} [-o filter_options] filter_name input_file [output_file]"
+    USAGE = f"{sys.argv[0]} [-o filter_options] filter_name input_file [output_file|-]"
 
     import advene.core.controller as controller
     c = controller.AdveneController()
@@ -409,7 +571,7 @@ Available filters:
     if config.data.args[2:]:
         outputfile = config.data.args[2]
     else:
-        outputfile = ''
+        outputfile = '-'
 
     # Filter options are passed using the -o option
     # Rebuild filter option string from config.data.options.options dict
@@ -434,7 +596,7 @@ Available filters:
     c.load_package(inputfile)
     e.set_source(c.package)
 
-    if outputfile:
+    if outputfile != '-':
         outputfile = e.get_filename(outputfile)
         logger.info("Converting %s to %s using %s", inputfile, outputfile, e.name)
         e.export(outputfile)
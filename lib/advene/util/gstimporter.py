@@ -23,13 +23,45 @@ logger = logging.getLogger(__name__)
 
 from gettext import gettext as _
 
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import gi
+from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gst
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import GstPbutils
+gi.require_version('GstVideo', '1.0')
+from gi.repository import GstVideo
 
+from advene.util.analysiscache import get_cache
 import advene.util.helper as helper
-from advene.util.importer import GenericImporter
+from advene.util.importer import GenericImporter, importer_source_file, run_importer_method
 from advene.util.tools import path2uri
 
+# Bytes per pixel of packed video formats
+VIDEO_FORMAT_SIZES = {
+    'GRAY8': 1,
+    'RGB': 3, 'BGR': 3,
+    'RGBA': 4, 'BGRA': 4, 'ARGB': 4, 'ABGR': 4,
+    'RGBx': 4, 'BGRx': 4, 'xRGB': 4, 'xBGR': 4,
+}
+
+# numpy dtypes of audio sample formats
+AUDIO_FORMAT_TYPES = {
+    'S8': 'i1', 'U8': 'u1',
+    'S16LE': '<i2', 'S16BE': '>i2', 'U16LE': '<u2', 'U16BE': '>u2',
+    'S32LE': '<i4', 'S32BE': '>i4', 'U32LE': '<u4', 'U32BE': '>u4',
+    'F32LE': '<f4', 'F32BE': '>f4', 'F64LE': '<f8', 'F64BE': '>f8',
+}
+
 class GstImporter(GenericImporter):
     """GstImporter - Gstreamer importer
 
@@ -54,15 +86,86 @@ class GstImporter(GenericImporter):
     data, and call the `.convert` method only in the `do_finalize`
     method.
 
+    Setting the `frame_format` class attribute to 'array' makes
+    `process_frame` receive the frame data as a numpy array view on
+    the mapped buffer, shaped according to the negotiated caps:
+    (height, width, bytes per pixel) for packed video formats,
+    (samples, channels) for audio. The view is only valid during the
+    `process_frame` call. If `frame_batch_size` is greater than 1,
+    frames (of either format) are copied into a (frame_batch_size,
+    ...) array and the `process_frames` method is called for each
+    batch instead, with `date` and `pts` lists, so that the analysis
+    can be vectorised.
+
     You can see examples of usage in the `plugins.soundenveloppe`
     plugin (for audio, using Gstreamer message metadata) and
-    `plugins.dominantcolor` (for video, using frame data).
+    `plugins.dominantcolor` (for video, using batches of frame arrays).
+
+    Importers that define the `media_type` class attribute ('audio'
+    or 'video', according to the decoded stream expected by their
+    pipeline elements) can be combined by the CompositeGstImporter,
+    which decodes the media only once for all of them.
+
+    Importers whose results can be expressed as a list of
+    timestamped events, each depending only on a limited amount of
+    preceding media data, can set the `shardable` class attribute and
+    implement the `shard_events` and `restore_shard_events`
+    methods. The media can then be split into time ranges (shards)
+    processed in parallel by independent pipelines, each in its own
+    process. Each shard starts `shard_overlap` ms before its range
+    (so that the analysis state is settled when the range begins),
+    and events are merged before calling `do_finalize` as for a
+    serial run.
+
+    The annotation data emitted through `convert` is stored in the
+    analysis cache, and reused when the same analysis is run with the
+    same options on the same media.
     """
     name = _("GStreamer generic importer")
+    media_type = None
+    shardable = False
+    # 'bytes' or 'array': data type of the frames passed to process_frame
+    frame_format = 'bytes'
+    # Number of frames passed to process_frames
+    frame_batch_size = 1
+    # Options which do not influence the analysis results
+    cache_ignored_options = ('offset', 'use_cache', 'shards', 'shard_overlap')
 
     def __init__(self, *p, **kw):
         super(GstImporter, self).__init__(*p, **kw)
         self.is_finalized = False
+        # CompositeGstImporter instance, when used as a branch of a composite pipeline
+        self.composite = None
+        # (begin, end) time range in ms processed by a shard
+        # pipeline. end is None for the last shard.
+        self.shard_range = None
+        self.shards = 1
+        self.shard_overlap = 2000
+        # Frame batch being filled: (data array, dates, pts)
+        self.frame_batch = None
+        # (caps, GstVideo.VideoInfo) for the last video frame
+        self.video_info = None
+        # Set when the processing is interrupted by the user
+        self.interrupted = False
+        self.use_cache = True
+        # Analysis cache key and emitted rows, when they are recorded
+        self.cache_key = None
+        self.cache_rows = None
+        self.optionparser.add_option("--no-cache",
+                                     action="store_false", dest="use_cache", default=self.use_cache,
+                                     help=_("Do not use cached analysis results"))
+        if self.shardable:
+            self.optionparser.add_option("--shards",
+                                         action="store", type="int", dest="shards", default=self.shards,
+                                         help=_("Number of time ranges processed in parallel"))
+            self.optionparser.add_option("--shard-overlap",
+                                         action="store", type="int", dest="shard_overlap", default=self.shard_overlap,
+                                         help=_("Duration (in ms) of media processed before each time range, so that the analysis state is settled."))
+
+    def check_requirements(self):
+        if (self.frame_format == 'array' or self.frame_batch_size > 1) and numpy is None:
+            return [ _("The numpy module is required.") ]
+        return []
 
     @staticmethod
     def can_handle(fname):
@@ -79,12 +182,21 @@ class GstImporter(GenericImporter):
         # stop pipeline, convert last buffered elements...
         if self.is_finalized:
             return
+        if self.composite is not None:
+            # The pipeline is shared: let the composite importer
+            # decide when to stop it.
+            self.composite.child_finalized(self)
+            return
         self.is_finalized = True
         GObject.idle_add(lambda: self.pipeline.set_state(Gst.State.NULL) and False)
         logger.debug("Doing finalize")
         def wrapper():
-            if hasattr(self, 'do_finalize'):
+            self.flush_frames()
+            # Shard pipelines only collect events, which are
+            # converted by the parent importer.
+            if hasattr(self, 'do_finalize') and self.shard_range is None:
                 self.do_finalize()
+                self.cache_store()
             self.end_callback()
             return False
         # Make sure finalize is called in the context of the main thread
@@ -137,14 +249,20 @@ class GstImporter(GenericImporter):
             if s.get_name() == 'progress' and self.progress is not None:
                 progress = s['percent-double'] / 100
                 if not self.progress(progress, self.progress_message(progress, message)):
+                    self.interrupted = True
                     self.finalize()
                 if s['current'] == s['total']:
                     # End of file. Use this information instead of the EOS signal, which is not always sent.
                     self.finalize()
             else:
-                self.do_process_message(s, bus)
+                self.process_element_message(message, bus)
         return True
 
+    def process_element_message(self, message, bus=None):
+        """Dispatch a Gst.Message to the custom message handling method.
+        """
+        return self.do_process_message(message.get_structure(), bus)
+
     def setup_importer(self, filename):
         """Setup a new import session:
         - initialize annotation type/package
@@ -167,6 +285,76 @@ class GstImporter(GenericImporter):
     #    """
     #    return True
 
+    #def process_frames(self, frames):
+    #    """Frame batch process method
+    #    It will be called for each batch of frame_batch_size frames
+    #    (the last one can be smaller), with a dict containing
+    #      data: numpy array, date: list of dts, pts: list of pts
+    #    """
+    #    return True
+
+    def handles_frames(self):
+        return hasattr(self, 'process_frame') or hasattr(self, 'process_frames')
+
+    def get_video_info(self, caps):
+        """Return the GstVideo.VideoInfo for the given caps.
+
+        It is cached, since caps do not change for every frame.
+        """
+        if self.video_info is None or not self.video_info[0].is_equal(caps):
+            try:
+                info = GstVideo.VideoInfo.new_from_caps(caps)
+            except AttributeError:
+                # GStreamer < 1.20
+                info = GstVideo.VideoInfo()
+                info.from_caps(caps)
+            self.video_info = (caps, info)
+        return self.video_info[1]
+
+    def frame_array(self, caps, mapinfo):
+        """Return a numpy array view on the mapped buffer data.
+        """
+        s = caps.get_structure(0)
+        fmt = s.get_value('format')
+        data = mapinfo.data
+        if s.get_name() == 'video/x-raw':
+            bpp = VIDEO_FORMAT_SIZES.get(fmt)
+            if bpp is None:
+                # Planar or unknown formats: return the raw data
+                return numpy.frombuffer(data, dtype=numpy.uint8)
+            # Rows may be padded (e.g. to 4-byte boundaries), and
+            # the buffer may hold data after the image: use the
+            # layout defined by the caps.
+            info = self.get_video_info(caps)
+            return numpy.ndarray(shape=(info.height, info.width, bpp),
+                                 dtype=numpy.uint8,
+                                 buffer=data,
+                                 offset=info.offset[0],
+                                 strides=(info.stride[0], bpp, 1))
+        elif s.get_name() == 'audio/x-raw':
+            dtype = numpy.dtype(AUDIO_FORMAT_TYPES.get(fmt, 'u1'))
+            channels = s.get_value('channels') or 1
+            samples = numpy.frombuffer(data, dtype=dtype)
+            if s.get_value('layout') == 'non-interleaved':
+                return samples.reshape(channels, -1).T
+            return samples.reshape(-1, channels)
+        return numpy.frombuffer(data, dtype=numpy.uint8)
+
+    def flush_frames(self):
+        """Pass the buffered frames to process_frames.
+        """
+        if self.frame_batch is None:
+            return
+        data, dates, pts = self.frame_batch
+        self.frame_batch = None
+        if dates:
+            self.process_frames({
+                "data": data[:len(dates)],
+                "date": dates,
+                "pts": pts,
+                "media": self.uri
+            })
+
     def frame_handler(self, element):
         """Convert frame before passing it to self.process_frame as a dict
         """
@@ -175,18 +363,248 @@ class GstImporter(GenericImporter):
         (res, mapinfo) = buf.map(Gst.MapFlags.READ)
         if not res:
             logger.warning("Error in converting buffer")
-        else:
+            return Gst.FlowReturn.OK
+        try:
             pos = element.query_position(Gst.Format.TIME)[1]
-            data = bytes(mapinfo.data)
-            self.process_frame({
-                "data": data,
-                "date": pos / Gst.MSECOND,
-                "pts": buf.pts / Gst.MSECOND,
-                "media": self.uri
-            })
+            if self.frame_format == 'bytes' and self.frame_batch_size == 1:
+                data = bytes(mapinfo.data)
+            else:
+                data = self.frame_array(sample.get_caps(), mapinfo)
+            if self.frame_batch_size > 1:
+                if self.frame_batch is not None and self.frame_batch[0].shape[1:] != data.shape:
+                    # Caps changed
+                    self.flush_frames()
+                if self.frame_batch is None:
+                    self.frame_batch = (numpy.empty((self.frame_batch_size, ) + data.shape, dtype=data.dtype), [], [])
+                batch, dates, pts = self.frame_batch
+                batch[len(dates)] = data
+                dates.append(pos / Gst.MSECOND)
+                pts.append(buf.pts / Gst.MSECOND)
+                if len(dates) == self.frame_batch_size:
+                    self.flush_frames()
+            else:
+                self.process_frame({
+                    "data": data,
+                    "date": pos / Gst.MSECOND,
+                    "pts": buf.pts / Gst.MSECOND,
+                    "media": self.uri
+                })
+        finally:
+            # Array data is a view on the mapped memory: it must not
+            # be used after this point.
+            buf.unmap(mapinfo)
         return Gst.FlowReturn.OK
 
+    def shard_events(self):
+        """Return the events detected in the processed shard.
+
+        It must return a list of (timestamp in ms, data) tuples, data
+        being picklable.
+        """
+        raise NotImplementedError
+
+    def process_shard(self, filename, shard_range):
+        """Process a time range of filename and return the detected events.
+
+        This method is run in worker processes, through
+        run_importer_method.
+        """
+        from advene.model.package import Package
+        Gst.init(None)
+        if self.package is None:
+            self.package = Package(uri='new_pkg', source=None)
+        self.shard_range = shard_range
+        loop = GLib.MainLoop()
+        self.async_process_file(filename, loop.quit)
+        loop.run()
+        return self.shard_events()
+
+    def restore_shard_events(self, events, duration):
+        """Restore the merged events from all shards.
+
+        duration is the media duration in ms. This method is called
+        before do_finalize, which must produce the same annotations as
+        if the events had been detected in a serial run.
+        """
+        raise NotImplementedError
+
+    def merge_shard_events(self, shards):
+        """Merge events from the shards.
+
+        shards is a list of (begin, end, events), in time order. Only
+        the events occuring in the shard own time range are kept, the
+        others (detected in the overlap) being handled by the previous
+        shard.
+        """
+        events = []
+        for begin, end, shard_events in shards:
+            events.extend(ev for ev in shard_events
+                          if ev[0] >= begin and (end is None or ev[0] < end))
+        return events
+
+    def shard_ranges(self, duration):
+        """Return the (begin, end) time ranges in ms for the given media duration.
+        """
+        size = int(duration / self.shards)
+        ranges = [ (i * size, (i + 1) * size) for i in range(self.shards) ]
+        # The last shard processes the media until its end
+        ranges[-1] = (ranges[-1][0], None)
+        return ranges
+
+    def async_process_shards(self, filename, end_callback, duration):
+        """Process the file as shards in a process pool.
+        """
+        self.end_callback = end_callback
+        # Create the annotation types in our package
+        self.setup_importer(filename)
+
+        options = self.option_values(ignored=('shards', 'shard_overlap'))
+        ranges = self.shard_ranges(duration)
+        # Plugin modules cannot be imported by name in the workers,
+        # the class is loaded from its source file.
+        plugin_file = importer_source_file(self.__class__)
+        logger.debug("Processing %s with shards %s", filename, ranges)
+
+        def process():
+            shards = []
+            try:
+                # The spawn method is used, since forking a process with
+                # running GLib threads is not safe.
+                with ProcessPoolExecutor(max_workers=self.shards,
+                                         mp_context=multiprocessing.get_context('spawn')) as executor:
+                    futures = [ executor.submit(run_importer_method,
+                                                plugin_file,
+                                                self.__class__.__name__,
+                                                options,
+                                                'process_shard',
+                                                filename,
+                                                (max(0, begin - self.shard_overlap),
+                                                 end + self.shard_overlap if end is not None else None))
+                                for begin, end in ranges ]
+                    for i, ((begin, end), future) in enumerate(zip(ranges, futures)):
+                        shards.append( (begin, end, future.result()) )
+                        if not self.progress(.1 + .8 * (i + 1) / len(ranges),
+                                             _("Processed %(count)d/%(total)d time ranges") % { 'count': i + 1,
+                                                                                                'total': len(ranges) }):
+                            shards = None
+                            for f in futures:
+                                f.cancel()
+                            break
+            except Exception:
+                # finalize must be called anyway, so that the import ends
+                logger.error(_("Error when processing %s"), filename, exc_info=True)
+                shards = None
+
+            def finalize():
+                self.is_finalized = True
+                if shards is not None:
+                    self.restore_shard_events(self.merge_shard_events(shards), duration)
+                    self.do_finalize()
+                    self.cache_store()
+                self.end_callback()
+                return False
+            # Make sure finalize is called in the context of the main thread
+            GObject.idle_add(finalize)
+
+        t = threading.Thread(target=process)
+        t.daemon = True
+        t.start()
+        return self.package
+
+    def option_values(self, ignored=()):
+        """Return a dict holding the importer option values.
+        """
+        return dict( (o.dest, getattr(self, o.dest))
+                     for o in self.optionparser.option_list
+                     if o.dest is not None and o.dest not in ignored and hasattr(self, o.dest) )
+
+    def cache_lookup(self, filename):
+        """Return the cached annotation data for filename, or None.
+
+        If no data is available, the data emitted through convert will
+        be recorded, to be stored by cache_store.
+        """
+        self.cache_rows = None
+        if not self.use_cache:
+            return None
+        cache = get_cache()
+        try:
+            self.cache_key = cache.key(filename, self.__class__.__name__,
+                                       self.option_values(ignored=self.cache_ignored_options))
+        except OSError:
+            # Not a local file
+            return None
+        rows, metadata = cache.get(self.cache_key)
+        if rows is None:
+            self.cache_filename = filename
+            self.cache_rows = []
+        return rows
+
+    def cache_store(self):
+        """Store the recorded annotation data in the analysis cache.
+        """
+        if self.cache_rows is not None and not self.interrupted:
+            get_cache().put(self.cache_key, self.cache_rows,
+                            filename=self.cache_filename,
+                            analyzer=self.__class__.__name__,
+                            options=self.option_values(ignored=self.cache_ignored_options))
+        self.cache_rows = None
+
+    def record_rows(self, source):
+        """Record the data from source while iterating over it.
+        """
+        for d in source:
+            row = dict(d)
+            t = row.get('type')
+            if t is None or t is self.defaulttype:
+                # Created by setup_importer
+                row.pop('type', None)
+            elif not isinstance(t, str):
+                row['type'] = t.id
+            self.cache_rows.append(row)
+            yield d
+
+    def convert(self, source):
+        if self.cache_rows is not None:
+            source = self.record_rows(source)
+        return super(GstImporter, self).convert(source)
+
+    def cache_replay(self, filename, rows, end_callback):
+        """Convert cached annotation data instead of processing the file.
+        """
+        self.end_callback = end_callback
+        self.setup_importer(filename)
+        self.progress(.5, _("Using cached analysis results"))
+        def replay():
+            self.is_finalized = True
+            self.convert(rows)
+            self.end_callback()
+            return False
+        GObject.idle_add(replay)
+        return self.package
+
+    def media_duration(self, filename):
+        """Return the media duration in ms, or None if it cannot be determined.
+        """
+        try:
+            info = GstPbutils.Discoverer().discover_uri(path2uri(filename))
+        except Exception:
+            logger.error("Cannot get media duration", exc_info=True)
+            return None
+        return info.get_duration() / Gst.MSECOND or None
+
     def async_process_file(self, filename, end_callback):
+        if self.shard_range is None and self.composite is None:
+            rows = self.cache_lookup(filename)
+            if rows is not None:
+                return self.cache_replay(filename, rows, end_callback)
+
+        if self.shardable and self.shards > 1 and self.shard_range is None and self.composite is None:
+            duration = self.media_duration(filename)
+            if duration:
+                return self.async_process_shards(filename, end_callback, duration)
+            logger.warning(_("Cannot determine media duration - processing the whole file at once"))
+
         self.end_callback = end_callback
 
         sink = 'appsink name=sink emit-signals=true sync=false max-buffers=10 drop=true'
@@ -204,8 +622,7 @@ class GstImporter(GenericImporter):
         self.decoder = self.pipeline.get_by_name('decoder')
         self.report = self.pipeline.get_by_name('report')
         self.sink = self.pipeline.get_by_name('sink')
-        if hasattr(self, 'process_frame'):
-            print("Connecting signal handler")
+        if self.handles_frames():
             self.sink.connect("new-sample", self.frame_handler)
 
         bus = self.pipeline.get_bus()
@@ -226,5 +643,178 @@ class GstImporter(GenericImporter):
         if hasattr(self, 'pipeline_postprocess'):
             self.pipeline_postprocess(self.pipeline)
 
+        if self.shard_range is not None:
+            begin, end = self.shard_range
+            # Preroll the pipeline so that it accepts the seek
+            self.pipeline.set_state(Gst.State.PAUSED)
+            self.pipeline.get_state(Gst.CLOCK_TIME_NONE)
+            self.pipeline.seek(1.0, Gst.Format.TIME,
+                               Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+                               Gst.SeekType.SET, int(begin * Gst.MSECOND),
+                               Gst.SeekType.SET if end is not None else Gst.SeekType.NONE,
+                               int(end * Gst.MSECOND) if end is not None else -1)
+
+        self.pipeline.set_state(Gst.State.PLAYING)
+        return self.package
+
+class CompositeGstImporter(GstImporter):
+    """Composite Gstreamer importer
+
+    This importer runs a number of GstImporter analyzers over a single
+    decoding of the media: the decoded video and audio streams are
+    split (using tee elements) into one branch per analyzer, each
+    branch consisting of the analyzer pipeline elements and its own
+    sink. Messages posted by elements of a branch are dispatched to
+    the corresponding analyzer, and all analyzers are finalized when
+    the whole stream has been processed.
+    """
+    name = _("Combined media analysis")
+
+    def __init__(self, *p, **kw):
+        super(CompositeGstImporter, self).__init__(*p, **kw)
+        self.analyzers = ",".join(sorted(self.available_analyzers()))
+        self.children = []
+        # Element name -> analyzer instance
+        self.element_owner = {}
+        self.optionparser.add_option("-a", "--analyzers",
+                                     action="store", type="string", dest="analyzers", default=self.analyzers,
+                                     help=_("Comma-separated list of analyzers (available: %s)") % self.analyzers)
+
+    @staticmethod
+    def available_analyzers():
+        """Return a dict (name -> class) of the importers that can be combined.
+        """
+        import advene.util.importer
+        return dict( (cl.__name__, cl)
+                     for cl in advene.util.importer.IMPORTERS
+                     if (isinstance(cl, type) and issubclass(cl, GstImporter)
+                         and cl.media_type in ('audio', 'video')) )
+
+    def child_finalized(self, child):
+        """Called when an analyzer has detected the end of its stream.
+        """
+        if all(c.is_finalized or c is child for c in self.children):
+            self.finalize()
+
+    def do_finalize(self):
+        for child in self.children:
+            child.is_finalized = True
+            if hasattr(child, 'do_finalize'):
+                logger.debug("Finalizing %s", child.name)
+                child.interrupted = self.interrupted
+                child.do_finalize()
+                child.cache_store()
+            for k, v in child.statistics.items():
+                self.statistics[k] = self.statistics.get(k, 0) + v
+
+    def process_element_message(self, message, bus=None):
+        owner = None
+        if message.src is not None:
+            owner = self.element_owner.get(message.src.get_name())
+        for child in ([ owner ] if owner is not None else self.children):
+            child.do_process_message(message.get_structure(), bus)
+        return True
+
+    def setup_children(self):
+        classes = self.available_analyzers()
+        self.children = []
+        for n in self.analyzers.split(','):
+            n = n.strip()
+            if not n:
+                continue
+            cl = classes.get(n)
+            if cl is None:
+                logger.error(_("Unknown analyzer %s"), n)
+                continue
+            child = cl(author=self.author, package=self.package,
+                       controller=self.controller, callback=self.callback)
+            child.composite = self
+            self.children.append(child)
+        return self.children
+
+    def async_process_file(self, filename, end_callback):
+        self.end_callback = end_callback
+        if self.package is None:
+            self.init_package(filename=filename)
+
+        if not self.setup_children():
+            logger.error(_("No analyzer to run"))
+            self.is_finalized = True
+            GObject.idle_add(lambda: self.end_callback() and False)
+            return self.package
+
+        # Analyzers with cached results do not need a pipeline branch
+        for child in list(self.children):
+            child.use_cache = self.use_cache
+            rows = child.cache_lookup(filename)
+            if rows is not None:
+                child.setup_importer(filename)
+                child.convert(rows)
+                child.is_finalized = True
+                for k, v in child.statistics.items():
+                    self.statistics[k] = self.statistics.get(k, 0) + v
+                self.children.remove(child)
+        if not self.children:
+            self.is_finalized = True
+            GObject.idle_add(lambda: self.end_callback() and False)
+            return self.package
+
+        self.uri = path2uri(filename)
+
+        branches = { 'video': [], 'audio': [] }
+        for i, child in enumerate(self.children):
+            child.uri = self.uri
+            branches[child.media_type].append( (i, child.setup_importer(filename)) )
+
+        # The first converter element is used to select the
+        # appropriate decoder pad, so that each stream is decoded
+        # once and then split between the analyzers.
+        converters = { 'video': 'videoconvert', 'audio': 'audioconvert' }
+        description = [ 'uridecodebin name=decoder' ]
+        report = 'progressreport silent=true update-freq=1 name=report ! '
+        for media in ('video', 'audio'):
+            if not branches[media]:
+                continue
+            description.append('decoder. ! %s ! queue ! %stee name=%stee' % (converters[media], report, media))
+            # Only report progress from a single branch
+            report = ''
+            for i, elements in branches[media]:
+                description.append('%stee. ! queue ! %s ! appsink name=sink%d emit-signals=true sync=false max-buffers=10 drop=true' % (media, elements, i))
+
+        self.pipeline = Gst.parse_launch(" ".join(description))
+        self.decoder = self.pipeline.get_by_name('decoder')
+        self.report = self.pipeline.get_by_name('report')
+        tees = [ '%stee' % media for media in branches ]
+
+        self.element_owner = {}
+        for i, child in enumerate(self.children):
+            child.pipeline = self.pipeline
+            child.decoder = self.decoder
+            child.report = self.report
+            child.sink = self.pipeline.get_by_name('sink%d' % i)
+            # Walk the branch upstream to find the analyzer elements
+            element = child.sink
+            while element is not None and element.get_name() not in tees:
+                self.element_owner[element.get_name()] = child
+                pad = element.get_static_pad('sink')
+                peer = pad.get_peer() if pad is not None else None
+                element = peer.get_parent_element() if peer is not None else None
+            if child.handles_frames():
+                child.sink.connect("new-sample", child.frame_handler)
+
+        bus = self.pipeline.get_bus()
+        bus.enable_sync_message_emission()
+        bus.connect('sync-message', self.on_bus_message)
+        bus.connect('message', self.on_bus_message)
+        bus.connect('message::error', self.on_bus_message_error)
+        bus.connect('message::warning', self.on_bus_message_warning)
+
+        self.decoder.props.uri = self.uri
+        self.progress(.1, _("Starting processing"))
+
+        for child in self.children:
+            if hasattr(child, 'pipeline_postprocess'):
+                child.pipeline_postprocess(self.pipeline)
+
         self.pipeline.set_state(Gst.State.PLAYING)
         return self.package
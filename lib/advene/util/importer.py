@@ -67,6 +67,8 @@ import logging
 import logging.config
 logger = logging.getLogger(__name__)
 
+import contextlib
+import inspect
 import json
 import os
 import optparse
@@ -136,6 +138,40 @@ def get_importer(fname, **kw):
         i=valid[0](**kw)
     return i
 
+def importer_source_file(cl):
+    """Return the source file where the importer class cl is defined.
+
+    inspect.getfile cannot be used for classes defined in plugins,
+    since plugin modules are not registered in sys.modules.
+    """
+    for v in vars(cl).values():
+        code = getattr(v, '__code__', None)
+        if code is not None:
+            return code.co_filename
+    return inspect.getfile(cl)
+
+def run_importer_method(plugin_file, classname, options, method, *args):
+    """Instanciate an importer and call one of its methods.
+
+    This function is meant to be run in a worker process (through
+    concurrent.futures): the importer class is loaded from its source
+    file, since plugin modules cannot be imported by name.
+
+    @param plugin_file: the source file of the importer class
+    @param classname: the importer class name
+    @param options: a dict of attributes to set on the instance
+    @param method: the method name
+    @return: the method return value
+    """
+    from importlib.util import spec_from_file_location, module_from_spec
+    spec = spec_from_file_location('importer_' + classname, plugin_file)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    i = getattr(module, classname)(callback=lambda value, label: True)
+    for k, v in options.items():
+        setattr(i, k, v)
+    return getattr(i, method)(*args)
+
 class GenericImporter:
     """Generic importer class
     @ivar statistics: Dictionary holding the creation statistics
@@ -293,6 +329,16 @@ class GenericImporter:
         else:
             logger.warning(" ".join(p))
 
+    def write_lock(self):
+        """Return a context manager holding the package lock for writing.
+
+        Elements are appended to the package holding it, so that the
+        webserver threads do not read a partially modified model.
+        """
+        if self.controller is not None:
+            return self.controller.package_lock.write()
+        return contextlib.nullcontext()
+
     def update_statistics(self, elementtype):
         self.statistics[elementtype] = self.statistics.get(elementtype, 0) + 1
 
@@ -348,7 +394,8 @@ class GenericImporter:
             # The package does not have a _color_palette
             pass
         at.setMetaData(config.data.namespace, 'item_color', 'here/tag_color')
-        schema.annotationTypes.append(at)
+        with self.write_lock():
+            schema.annotationTypes.append(at)
         self.update_statistics('annotation-type')
         return at
 
@@ -362,7 +409,8 @@ class GenericImporter:
         schema.title=title or "Generated schema"
         if description:
             schema.setMetaData(config.data.namespace_prefix['dc'], "description", description)
-        self.package.schemas.append(schema)
+        with self.write_lock():
+            self.package.schemas.append(schema)
         self.update_statistics('schema')
         return schema
 
@@ -387,7 +435,8 @@ class GenericImporter:
         a.date=timestamp
         a.title=title
         a.content.data = data
-        self.package.annotations.append(a)
+        with self.write_lock():
+            self.package.annotations.append(a)
         self.update_statistics('annotation')
         return a
 
@@ -454,7 +503,8 @@ class GenericImporter:
           - id
           - type (can be an annotation-type instance or a type-id)
           - mimetype (used when specifying a type-id)
-          - notify: if True, then each annotation creation will generate a AnnotationCreate signal
+          - notify: if True, then each annotation creation will generate a AnnotationCreate signal.
+            The signals are coalesced into a single AnnotationBatch notification.
           - complete: boolean. Used to mark the completeness of the annotation.
           - send: yield should return the created annotation
         """
@@ -473,71 +523,77 @@ class GenericImporter:
                 d = next(source)
         except StopIteration:
             return
-        while True:
-            try:
-                begin=helper.parse_time(d['begin'])
-            except KeyError:
-                raise Exception("Begin is mandatory")
-            if 'end' in d:
-                end=helper.parse_time(d['end'])
-            elif 'duration' in d:
-                end=begin + helper.parse_time(d['duration'])
-            else:
-                raise Exception("end or duration is missing")
-            content = d.get('content', "Default content")
-            if not isinstance(content, str):
-                content = json.dumps(content)
-            ident = d.get('id', None)
-            # Support both author and creator keys
-            author = d.get('author', d.get('creator', self.author))
-            title = d.get('title', content[:20])
-            timestamp = d.get('timestamp', self.timestamp)
-
-            type_ = d.get('type')
-            if not type_:
-                # Either None or an empty string. Set to defaulttype anyway.
-                type_ = self.defaulttype
-            elif isinstance(type_, str):
-                # A type id was specified. Dereference it, and
-                # create it if necessary.
-                type_id = type_
-                type_ = self.package.get_element_by_id(type_id)
-
-                # mimetype was the key in initial versions of the
-                # import API. But I used content_type in FlatJSON
-                # export. Let's support both.
-                mimetype = d.get('mimetype', d.get('content_type', None))
-                if type_ is None:
-                    # Not existing, create it.
-                    type_ = self.ensure_new_type(prefix=type_id,
-                                                 title=d.get('type_title', type_id),
-                                                 mimetype=mimetype,
-                                                 color=d.get('type_color', None),
-                                                 )
-            if not isinstance(type_, AnnotationType):
-                raise Exception("Error during import: the specified type id %s is not an annotation type" % type_)
-
-            a = self.create_annotation(type_=type_,
-                                       begin=begin,
-                                       end=end,
-                                       data=content,
-                                       ident=ident,
-                                       author=author,
-                                       title=title,
-                                       timestamp=timestamp)
-            self.package._modified = True
-            if 'complete' in d:
-                a.complete=d['complete']
-            if 'notify' in d and d['notify'] and self.controller is not None:
-                logger.debug("Notifying %s", a)
-                self.controller.notify('AnnotationCreate', annotation=a)
-            try:
-                if hasattr(source, 'send'):
-                    d = source.send(None)
+        if self.controller is not None:
+            # Coalesce the AnnotationCreate notifications
+            scope = self.controller.batch_notifications(comment=_("Import %s") % self.name)
+        else:
+            scope = contextlib.nullcontext()
+        with scope:
+            while True:
+                try:
+                    begin=helper.parse_time(d['begin'])
+                except KeyError:
+                    raise Exception("Begin is mandatory")
+                if 'end' in d:
+                    end=helper.parse_time(d['end'])
+                elif 'duration' in d:
+                    end=begin + helper.parse_time(d['duration'])
                 else:
-                    d = next(source)
-            except StopIteration:
-                break
+                    raise Exception("end or duration is missing")
+                content = d.get('content', "Default content")
+                if not isinstance(content, str):
+                    content = json.dumps(content)
+                ident = d.get('id', None)
+                # Support both author and creator keys
+                author = d.get('author', d.get('creator', self.author))
+                title = d.get('title', content[:20])
+                timestamp = d.get('timestamp', self.timestamp)
+
+                type_ = d.get('type')
+                if not type_:
+                    # Either None or an empty string. Set to defaulttype anyway.
+                    type_ = self.defaulttype
+                elif isinstance(type_, str):
+                    # A type id was specified. Dereference it, and
+                    # create it if necessary.
+                    type_id = type_
+                    type_ = self.package.get_element_by_id(type_id)
+
+                    # mimetype was the key in initial versions of the
+                    # import API. But I used content_type in FlatJSON
+                    # export. Let's support both.
+                    mimetype = d.get('mimetype', d.get('content_type', None))
+                    if type_ is None:
+                        # Not existing, create it.
+                        type_ = self.ensure_new_type(prefix=type_id,
+                                                     title=d.get('type_title', type_id),
+                                                     mimetype=mimetype,
+                                                     color=d.get('type_color', None),
+                                                     )
+                if not isinstance(type_, AnnotationType):
+                    raise Exception("Error during import: the specified type id %s is not an annotation type" % type_)
+
+                a = self.create_annotation(type_=type_,
+                                           begin=begin,
+                                           end=end,
+                                           data=content,
+                                           ident=ident,
+                                           author=author,
+                                           title=title,
+                                           timestamp=timestamp)
+                self.package._modified = True
+                if 'complete' in d:
+                    a.complete=d['complete']
+                if 'notify' in d and d['notify'] and self.controller is not None:
+                    logger.debug("Notifying %s", a)
+                    self.controller.notify('AnnotationCreate', annotation=a)
+                try:
+                    if hasattr(source, 'send'):
+                        d = source.send(None)
+                    else:
+                        d = next(source)
+                except StopIteration:
+                    break
 
 class ExternalAppImporter(GenericImporter):
     """External application importer.
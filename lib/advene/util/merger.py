@@ -27,6 +27,7 @@ from gettext import gettext as _
 
 import argparse
 import filecmp
+import hashlib
 import itertools
 import os
 import shutil
@@ -49,6 +50,7 @@ except ModuleNotFoundError:
     import advene.core.config as config
     config.data.fix_paths(maindir)
 from advene.core.idgenerator import Generator
+from advene.model.constants import xlinkNS
 from advene.model.package import Package
 from advene.model.annotation import Annotation, Relation
 from advene.model.schema import Schema, AnnotationType, RelationType
@@ -56,6 +58,39 @@ from advene.model.view import View
 from advene.model.query import Query
 import advene.util.helper as helper
 
+def _serialize_node(node, out):
+    """Append a canonical serialization of node to the out list.
+    """
+    if node.nodeType == node.ELEMENT_NODE:
+        out.append('\x01')
+        out.append(node.tagName)
+        if node.hasAttributes():
+            for k, v in sorted(node.attributes.items()):
+                out.append('\x02%s\x03%s' % (k, v))
+        for n in node.childNodes:
+            _serialize_node(n, out)
+        out.append('\x04')
+    elif node.nodeType in (node.TEXT_NODE, node.CDATA_SECTION_NODE):
+        out.append(node.data)
+
+def fingerprint(el):
+    """Return a fingerprint of the element data.
+
+    Elements with identical fingerprints have identical attributes,
+    fragment, content, tags and metadata. If the element content is
+    stored outside of the element (content with an URI), None is
+    returned since its data cannot be fingerprinted.
+    """
+    model = el._getModel()
+    for n in model.childNodes:
+        if (n.nodeType == n.ELEMENT_NODE
+            and n.localName == 'content'
+            and n.hasAttributeNS(xlinkNS, 'href')):
+            return None
+    out = []
+    _serialize_node(model, out)
+    return hashlib.sha1(''.join(out).encode('utf-8')).digest()
+
 class Differ:
     """Returns a structure diff of two packages.
     """
@@ -67,6 +102,66 @@ class Differ:
         # key is the id in the source package, the value the (new) id
         # in the destination package.
         self.translated_ids = {}
+        # Destination elements indexed by uri, used by
+        # destination_element during annotation/relation diffs
+        self._destination_elements = None
+
+    def index_destination(self):
+        """Build the destination element index used by destination_element.
+
+        The lookup order is the same as for Package.get_element_by_id.
+        """
+        index = {}
+        for b in (self.destination.relations, self.destination.queries,
+                  self.destination.annotations, self.destination.relationTypes,
+                  self.destination.annotationTypes, self.destination.views,
+                  self.destination.schemas):
+            index.update(b.iteritems())
+        self._destination_elements = index
+        return index
+
+    def register_destination_element(self, el):
+        """Register a newly created destination element in the index.
+        """
+        if self._destination_elements is not None:
+            self._destination_elements.setdefault(el.getUri(absolute=True), el)
+
+    def destination_element(self, id_):
+        """Return the destination element with the given id.
+
+        This is equivalent to destination.get_element_by_id, but uses
+        the destination index if it was built.
+        """
+        if self._destination_elements is None or not id_:
+            return self.destination.get_element_by_id(id_)
+        return self._destination_elements.get('#'.join((self.destination.uri, id_)))
+
+    def fingerprints(self, elements):
+        """Return a dict (id -> (element, fingerprint)) for the given elements.
+        """
+        return dict( (e.id, (e, fingerprint(e))) for e in elements )
+
+    def changed_elements(self, source_elements, destination_elements):
+        """Iterate over the (source, destination) elements that may differ.
+
+        Fingerprints are computed for both sides in a single pass,
+        and elements whose fingerprints are identical are skipped. The
+        destination element is None if there is no element with the
+        same id in the destination package. Source elements are
+        returned in their original order.
+        """
+        self.index_destination()
+        dest_fp = self.fingerprints(destination_elements)
+        for s in source_elements:
+            d = self.destination_element(s.id)
+            if d is not None:
+                entry = dest_fp.get(s.id)
+                if entry is not None and entry[0] is d:
+                    fp = entry[1]
+                    if fp is not None and fp == fingerprint(s):
+                        # Identical element. Nothing to do.
+                        continue
+            yield s, d
 
     def diff(self):
         """Iterator returning a changelist for all elements.
@@ -202,8 +297,7 @@ class Differ:
                        lambda e: str(e))
 
     def diff_annotations(self):
-        for s in self.source.annotations:
-            d=self.destination.get_element_by_id(s.id)
+        for s, d in self.changed_elements(self.source.annotations, self.destination.annotations):
             if d is None:
                 yield ('new', s, None,
                        lambda s, d: self.copy_annotation(s),
@@ -248,8 +342,7 @@ class Differ:
                        lambda e: str(e))
 
     def diff_relations(self):
-        for s in self.source.relations:
-            d=self.destination.get_element_by_id(s.id)
+        for s, d in self.changed_elements(self.source.relations, self.destination.relations):
             if d is None:
                 yield ('new', s, None,
                        lambda s, d: self.copy_relation(s),
@@ -404,6 +497,7 @@ class Differ:
         for (namespace, name, value) in s.listMetaData():
             el.setMetaData(namespace, name, value)
         self.destination.schemas.append(el)
+        self.register_destination_element(el)
         return el
 
     def copy_annotation_type(self, s, generate_id=False):
@@ -428,6 +522,7 @@ class Differ:
         for (namespace, name, value) in s.listMetaData():
             el.setMetaData(namespace, name, value)
         sch.annotationTypes.append(el)
+        self.register_destination_element(el)
         return el
 
     def copy_relation_type(self, s, generate_id=False):
@@ -450,6 +545,7 @@ class Differ:
         el.title=s.title or id_
         el.mimetype=s.mimetype
         sch.relationTypes.append(el)
+        self.register_destination_element(el)
         for (namespace, name, value) in s.listMetaData():
             el.setMetaData(namespace, name, value)
         # Handle membertypes, ensure that annotation types are defined
@@ -517,6 +613,7 @@ class Differ:
         for (namespace, name, value) in s.listMetaData():
             el.setMetaData(namespace, name, value)
         self.destination.annotations.append(el)
+        self.register_destination_element(el)
         return el
 
     def copy_relation(self, s, generate_id=False):
@@ -553,6 +650,7 @@ class Differ:
         el.content.data=s.content.data
         el.tags = s.tags
         self.destination.relations.append(el)
+        self.register_destination_element(el)
         for (namespace, name, value) in s.listMetaData():
             el.setMetaData(namespace, name, value)
         #el.title=s.title or ''
@@ -576,6 +674,7 @@ class Differ:
         for (namespace, name, value) in s.listMetaData():
             el.setMetaData(namespace, name, value)
         self.destination.queries.append(el)
+        self.register_destination_element(el)
         return el
 
     def copy_view(self, s, generate_id=False):
@@ -602,6 +701,7 @@ class Differ:
         for (namespace, name, value) in s.listMetaData():
             el.setMetaData(namespace, name, value)
         self.destination.views.append(el)
+        self.register_destination_element(el)
         return el
 
     def create_resource(self, s, d):
@@ -0,0 +1,320 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""
+Persistent package index
+========================
+
+This module maintains a SQLite database indexing the annotations,
+annotation types and tags of a collection of packages, so that they
+can be searched without loading the packages themselves.
+
+The index is updated incrementally: a package is parsed again only if
+its modification time or size changed since it was last indexed.
+
+Usage: python3 -m advene.util.packageindex [--db index.db] [--search QUERY] [dir_or_package...]
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+import os
+import shlex
+import sqlite3
+import sys
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+try:
+    import advene.core.config as config
+except ModuleNotFoundError:
+    # Try to find if we are in a development tree.
+    maindir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    if os.path.exists(os.path.join(maindir, "setup.py")):
+        # Chances are that we are in a development tree...
+        libpath = os.path.join(maindir, "lib")
+        logger.warning("You seem to have a development tree at:\n%s." % libpath)
+        sys.path.insert(0, libpath)
+    import advene.core.config as config
+    config.data.fix_paths(maindir)
+
+from advene.model.package import Package
+from advene.util.tools import path2uri
+
+PACKAGE_EXTENSIONS = ('.azp', '.xml')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS package (
+  id INTEGER PRIMARY KEY,
+  path TEXT UNIQUE NOT NULL,
+  mtime REAL NOT NULL,
+  size INTEGER NOT NULL,
+  title TEXT,
+  media TEXT,
+  annotation_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS annotationtype (
+  package INTEGER NOT NULL REFERENCES package(id) ON DELETE CASCADE,
+  id TEXT NOT NULL,
+  title TEXT,
+  schema TEXT,
+  annotation_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS annotation (
+  rowid INTEGER PRIMARY KEY,
+  package INTEGER NOT NULL REFERENCES package(id) ON DELETE CASCADE,
+  id TEXT NOT NULL,
+  type TEXT,
+  begin INTEGER,
+  end INTEGER,
+  author TEXT,
+  content TEXT,
+  tags TEXT
+);
+CREATE TABLE IF NOT EXISTS tag (
+  annotation INTEGER NOT NULL REFERENCES annotation(rowid) ON DELETE CASCADE,
+  tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS annotation_package ON annotation(package);
+CREATE INDEX IF NOT EXISTS annotation_type ON annotation(package, type);
+CREATE INDEX IF NOT EXISTS annotation_time ON annotation(begin, end);
+CREATE INDEX IF NOT EXISTS annotationtype_package ON annotationtype(package);
+CREATE INDEX IF NOT EXISTS tag_tag ON tag(tag);
+CREATE INDEX IF NOT EXISTS tag_annotation ON tag(annotation);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS annotation_fts USING fts5(content, tags, content='annotation', content_rowid='rowid');
+"""
+
+class PackageIndex:
+    """Persistent index of a collection of packages.
+
+    @ivar filename: the database filename
+    @ivar fts: True if the SQLite full-text search extension is available
+    """
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = config.data.advenefile('package_index.db', 'settings')
+        self.filename = str(filename)
+        self.db = sqlite3.connect(self.filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            logger.warning("SQLite FTS5 is not available. Using slower substring search.")
+            self.fts = False
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def package_files(self, paths):
+        """Return the package files found in the given files or directories.
+        """
+        for path in paths:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    for name in sorted(files):
+                        if name.lower().endswith(PACKAGE_EXTENSIONS):
+                            yield os.path.abspath(os.path.join(root, name))
+            elif os.path.exists(path):
+                yield os.path.abspath(path)
+            else:
+                logger.warning("%s does not exist", path)
+
+    def is_up_to_date(self, path):
+        """Check whether the indexed data for path is up-to-date.
+        """
+        st = os.stat(path)
+        row = self.db.execute("SELECT mtime, size FROM package WHERE path = ?", (path, )).fetchone()
+        return row is not None and row['mtime'] == st.st_mtime and row['size'] == st.st_size
+
+    def remove_package(self, path):
+        """Remove the data about the package stored in path.
+        """
+        row = self.db.execute("SELECT id FROM package WHERE path = ?", (path, )).fetchone()
+        if row is None:
+            return
+        if self.fts:
+            # External content FTS tables must be explicitly updated
+            self.db.execute("""INSERT INTO annotation_fts(annotation_fts, rowid, content, tags)
+                                 SELECT 'delete', rowid, content, tags FROM annotation WHERE package = ?""", (row['id'], ))
+        self.db.execute("DELETE FROM package WHERE id = ?", (row['id'], ))
+
+    def index_package(self, path):
+        """(Re)index the package stored in path.
+
+        Return True if the package could be parsed.
+        """
+        logger.info("Indexing %s", path)
+        st = os.stat(path)
+        try:
+            p = Package(path2uri(path))
+            annotations = p.annotations
+        except Exception:
+            logger.error("Cannot parse %s", path, exc_info=True)
+            return False
+
+        with self.db:
+            self.remove_package(path)
+            cur = self.db.execute("INSERT INTO package (path, mtime, size, title, media, annotation_count) VALUES (?, ?, ?, ?, ?, ?)",
+                                  (path, st.st_mtime, st.st_size, p.title, p.getMedia(), len(annotations)))
+            package_id = cur.lastrowid
+            self.db.executemany("INSERT INTO annotationtype (package, id, title, schema, annotation_count) VALUES (?, ?, ?, ?, ?)",
+                                [ (package_id, at.id, at.title, at.schema.id, len(at.annotations))
+                                  for at in p.annotationTypes ])
+            for a in annotations:
+                try:
+                    data = a.content.data
+                except Exception:
+                    data = None
+                tags = a.tags
+                cur = self.db.execute("INSERT INTO annotation (package, id, type, begin, end, author, content, tags) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                      (package_id, a.id, a.type.id, a.fragment.begin, a.fragment.end, a.author, data, " ".join(tags)))
+                rowid = cur.lastrowid
+                self.db.executemany("INSERT INTO tag (annotation, tag) VALUES (?, ?)",
+                                    [ (rowid, t) for t in tags ])
+                if self.fts:
+                    self.db.execute("INSERT INTO annotation_fts (rowid, content, tags) VALUES (?, ?, ?)",
+                                    (rowid, data, " ".join(tags)))
+        return True
+
+    def update(self, paths, prune=True):
+        """Update the index with the packages found in paths.
+
+        Only new or modified packages are parsed. If prune is True,
+        packages which do not exist anymore are removed from the index.
+
+        Return the list of (re)indexed package paths.
+        """
+        updated = []
+        for path in self.package_files(paths):
+            if self.is_up_to_date(path):
+                continue
+            if self.index_package(path):
+                updated.append(path)
+        if prune:
+            self.prune()
+        return updated
+
+    def prune(self):
+        """Remove packages that do not exist anymore.
+        """
+        with self.db:
+            for row in self.db.execute("SELECT path FROM package").fetchall():
+                if not os.path.exists(row['path']):
+                    logger.info("Removing %s from index", row['path'])
+                    self.remove_package(row['path'])
+
+    def packages(self):
+        """Return the indexed packages.
+        """
+        return [ dict(row) for row in self.db.execute("SELECT * FROM package ORDER BY path") ]
+
+    def annotation_types(self, package=None):
+        """Return the indexed annotation types, optionally restricted to a package path.
+        """
+        query = "SELECT p.path AS package, at.id, at.title, at.schema, at.annotation_count FROM annotationtype at JOIN package p ON at.package = p.id"
+        params = []
+        if package is not None:
+            query += " WHERE p.path = ?"
+            params.append(os.path.abspath(package))
+        return [ dict(row) for row in self.db.execute(query + " ORDER BY p.path, at.id", params) ]
+
+    def search(self, text=None, type=None, tag=None, begin=None, end=None, package=None, limit=None):
+        """Search annotations in the index.
+
+        @param text: words that must all be present in the content. Quoted strings are searched as phrases. With the FTS index, words are matched as tokens, not substrings.
+        @param type: annotation type id
+        @param tag: tag that annotations must have
+        @param begin: only return annotations ending after begin (in ms)
+        @param end: only return annotations beginning before end (in ms)
+        @param package: package path
+        @param limit: maximum number of results
+        @return: a list of dicts with package, id, type, begin, end, content and tags keys
+        """
+        query = """SELECT p.path AS package, a.id, a.type, a.begin, a.end, a.author, a.content, a.tags
+                     FROM annotation a JOIN package p ON a.package = p.id"""
+        where = []
+        params = []
+        if text:
+            try:
+                words = shlex.split(text)
+            except ValueError:
+                words = text.split()
+            if self.fts:
+                where.append("a.rowid IN (SELECT rowid FROM annotation_fts WHERE annotation_fts MATCH ?)")
+                params.append(" ".join('content:"%s"' % w.replace('"', '""') for w in words))
+            else:
+                for w in words:
+                    where.append("a.content LIKE ?")
+                    params.append("%" + w + "%")
+        if type is not None:
+            where.append("a.type = ?")
+            params.append(type)
+        if tag is not None:
+            where.append("a.rowid IN (SELECT annotation FROM tag WHERE tag = ?)")
+            params.append(tag)
+        if begin is not None:
+            where.append("a.end > ?")
+            params.append(int(begin))
+        if end is not None:
+            where.append("a.begin < ?")
+            params.append(int(end))
+        if package is not None:
+            where.append("p.path = ?")
+            params.append(os.path.abspath(package))
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY p.path, a.begin"
+        if limit is not None:
+            query += " LIMIT %d" % int(limit)
+        return [ dict(row) for row in self.db.execute(query, params) ]
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser("Package indexer")
+    parser.add_argument('--db', action="store", default=None,
+                        help="Index database (default: package_index.db in the settings directory)")
+    parser.add_argument('-s', '--search', action="store", default=None,
+                        help="Search annotations containing the given words")
+    parser.add_argument('-t', '--type', action="store", default=None,
+                        help="Restrict search to the given annotation type id")
+    parser.add_argument('--tag', action="store", default=None,
+                        help="Restrict search to annotations with the given tag")
+    parser.add_argument('--begin', action="store", type=int, default=None)
+    parser.add_argument('--end', action="store", type=int, default=None)
+    parser.add_argument('paths', nargs='*', help="Packages or directories to index")
+    args = parser.parse_args(saved_args)
+
+    index = PackageIndex(args.db)
+    if args.paths:
+        updated = index.update(args.paths)
+        logger.info("Indexed %d package(s)", len(updated))
+    if (args.search is not None or args.type is not None or args.tag is not None
+        or args.begin is not None or args.end is not None):
+        for res in index.search(text=args.search, type=args.type, tag=args.tag,
+                                begin=args.begin, end=args.end):
+            print("%(package)s\t%(id)s\t%(type)s\t%(begin)s\t%(end)s\t%(content)s" % dict(res, content=(res['content'] or '').replace('\n', '\\n')))
+    index.close()
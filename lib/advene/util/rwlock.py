@@ -0,0 +1,144 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Readers/writer lock.
+
+It is used to protect the packages (whose minidom-based model is not
+thread-safe) shared by the application thread and the webserver
+threads: many threads can read the model in parallel, while
+modifications are done by a single thread, with no reader active.
+
+  lock = ReadWriteLock()
+  with lock.read():
+      ...
+  with lock.write():
+      ...
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import contextlib
+import functools
+import threading
+
+class ReadWriteLock:
+    """Reentrant readers/writer lock.
+
+    The lock is reentrant for both modes, and the thread holding the
+    write lock can also acquire the read lock. A thread holding only
+    the read lock cannot acquire the write lock (it would deadlock
+    with another thread doing the same), a RuntimeError is raised.
+
+    Writers have priority: new readers wait while a writer is
+    waiting, so that a continuous flow of readers cannot starve
+    writers.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        # Read lock counts, indexed by thread id
+        self._readers = {}
+        self._writer = None
+        self._write_count = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers[me] = 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._condition:
+            count = self._readers.get(me)
+            if count is None:
+                raise RuntimeError("Releasing a read lock that is not held")
+            if count > 1:
+                self._readers[me] = count - 1
+            else:
+                del self._readers[me]
+                if not self._readers:
+                    self._condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._write_count += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("Cannot upgrade a read lock to a write lock")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._write_count = 1
+
+    def release_write(self):
+        with self._condition:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("Releasing a write lock that is not held")
+            self._write_count -= 1
+            if not self._write_count:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read(self):
+        """Hold the lock for reading in a with statement.
+        """
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write(self):
+        """Hold the lock for writing in a with statement.
+        """
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+    def is_writing(self):
+        """Check whether the current thread holds the write lock.
+        """
+        return self._writer == threading.get_ident()
+
+def write_locked(method):
+    """Decorator for methods modifying packages.
+
+    The method is run holding the package_lock attribute of its
+    instance for writing.
+    """
+    @functools.wraps(method)
+    def locked_method(self, *p, **kw):
+        with self.package_lock.write():
+            return method(self, *p, **kw)
+    return locked_method
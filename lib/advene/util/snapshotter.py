@@ -215,13 +215,21 @@ class Snapshotter:
             logger.debug("Snapshotter error when sending event for %d %s. ", t, res)
         return True
 
-    def enqueue(self, *l):
+    # Priority offset of background requests, so that they are
+    # processed after all other requests.
+    BACKGROUND_PRIORITY = 1 << 40
+
+    def enqueue(self, *l, background=False):
         """Enqueue timestamps to capture.
+
+        Timestamps enqueued with background=True are captured when
+        no other timestamp is pending.
         """
         if not self.active:
             return
+        offset = self.BACKGROUND_PRIORITY if background else 0
         for t in l:
-            self.timestamp_queue.put_nowait( (t, t) )
+            self.timestamp_queue.put_nowait( (t + offset, t) )
         logger.debug("----- enqueued elements %s (%d total)", l, self.timestamp_queue.qsize())
         self.snapshot_ready.set()
 
@@ -244,7 +252,9 @@ class Snapshotter:
                         self.timestamp_queue.get_nowait()
                     except queue.Empty:
                         break
-            (t, dummy) = self.timestamp_queue.get()
+            # The first item is the priority (offset for background
+            # requests), the second one is the timestamp.
+            (priority, t) = self.timestamp_queue.get()
             self.snapshot_ready.clear()
             self.snapshot(t)
         return True
@@ -23,6 +23,9 @@ logger = logging.getLogger(__name__)
 
 from gettext import gettext as _
 
+from concurrent.futures import ThreadPoolExecutor, wait
+import hashlib
+import json
 import os
 from pathlib import Path
 import time
@@ -34,6 +37,9 @@ import shutil
 import advene.core.config as config
 import advene.util.helper as helper
 from advene.util.exporter import GenericExporter, register_exporter
+from advene.util.merger import fingerprint
+from advene.model.package import Package
+from advene.model.tal.context import track_dependencies, stop_tracking_dependencies
 
 fragment_re           = re.compile('(.*)#(.+)')
 package_expression_re = re.compile(r'packages/(\w+)/(.*)')
@@ -49,7 +55,26 @@ class WebsiteExporter(GenericExporter):
 
     This filter does a static scraping of a set of static views, in
     order to publish them independently from Advene.
+
+    Views are rendered in the main thread (the model is not
+    thread-safe), while generated files, snapshots and resources are
+    written by a pool of worker threads. Each URL is rendered and each
+    auxiliary file is written only once.
+
+    The export progress is saved in a journal file, so that an
+    interrupted export is resumed where it stopped. The journal and
+    the rendered pages cache are stored in the settings directory
+    (see journal_path), not in the published output directory.
+
+    The journal also holds the dependencies of each rendered page: the
+    elements and the element attributes (bundles...) accessed by the
+    TALES expressions when rendering it. In incremental mode, pages
+    whose dependencies did not change since the last export are not
+    rendered again, their cached rendering is used, and unchanged
+    files are not rewritten.
     """
+    # Journal file used by previous versions, in the output directory
+    legacy_journal_name = ".advene_export.json"
     name = _("Website exporter")
     extension = ""
     mimetype = "inode/directory"
@@ -69,6 +94,9 @@ class WebsiteExporter(GenericExporter):
         self.video_url = (self.controller.package and self.controller.package.getMetaData(config.data.namespace, "media_uri")) or ""
         self.depth = 3
         self.views = ""
+        self.jobs = os.cpu_count() or 1
+        self.incremental = False
+        self.restart = False
 
         self.optionparser.add_option("-u", "--video-url",
                                      type="string",
@@ -91,6 +119,25 @@ class WebsiteExporter(GenericExporter):
                                      default=self.views,
                                      help=_("Comma-separated list of views to export - leave blank for all views"))
 
+        self.optionparser.add_option("-j", "--jobs",
+                                     action="store",
+                                     type="int",
+                                     dest="jobs",
+                                     default=self.jobs,
+                                     help=_("Number of workers used to write exported files"))
+
+        self.optionparser.add_option("-i", "--incremental",
+                                     action="store_true",
+                                     dest="incremental",
+                                     default=self.incremental,
+                                     help=_("Do not regenerate the export if the package did not change since the last export, and do not rewrite unchanged files"))
+
+        self.optionparser.add_option("--restart",
+                                     action="store_true",
+                                     dest="restart",
+                                     default=self.restart,
+                                     help=_("Ignore the journal of an interrupted export and start from scratch"))
+
     def find_video_player(self, video_url):
         p=None
         # FIXME: module introspection here to get classes
@@ -127,7 +174,7 @@ class WebsiteExporter(GenericExporter):
         if m:
             # Absolute url
             address = m.group(2)
-        elif url in (v.id for v in self.controller.package.views):
+        elif url in self.view_ids:
             # Relative url for a view
             address = 'view/'+url
         else:
@@ -223,7 +270,7 @@ class WebsiteExporter(GenericExporter):
             if m:
                 # Absolute url
                 tales = m.group(2)
-            elif url in (v.id for v in self.controller.package.views):
+            elif url in self.view_ids:
                 # Relative url.
                 tales = 'view/'+url
             else:
@@ -355,45 +402,102 @@ class WebsiteExporter(GenericExporter):
         content = self.video_player.transform_document(content)
         return content
 
+    def output_name(self, url):
+        """Return the output filename for the given URL (without fragment).
+        """
+        return self.url_translation[url].split('#', 1)[0]
+
+    def write_file(self, path, data):
+        """Write data (str or bytes) to the given path.
+
+        In incremental mode, files with identical contents are not rewritten.
+        This method is executed by the worker threads.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.incremental and path.is_file() and path.stat().st_size == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def write_cache(self, url, content):
+        """Store the rendering of the URL in the pages cache.
+
+        This method is executed by the worker threads.
+        """
+        path = self.cache_path(url)
+        if not path.parent.is_dir():
+            path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    def submit(self, func, *args):
+        """Execute func in the worker pool.
+        """
+        if self.pool is None:
+            func(*args)
+        else:
+            self.pending.append(self.pool.submit(func, *args))
+
+    def flush(self):
+        """Wait for pending writes to complete.
+        """
+        pending, self.pending = self.pending, []
+        for future in wait(pending).done:
+            # Propagate exceptions
+            future.result()
+
     def write_data(self, url, content, used_snapshots, used_overlays, used_resources):
         """Write the converted content as well as associated data.
         """
         # Write the content.
-        output = self.url_translation[url]
-        with open(self.output / output, 'w', encoding='utf-8') as f:
-            f.write(content)
+        self.submit(self.write_file, self.output / self.output_name(url), content)
 
         if not self.imgdir.is_dir():
             self.imgdir.mkdir(parents=True)
 
         # Copy snapshots
         for t in used_snapshots:
+            name = f'imagecache/{t}.png'
+            if name in self.written:
+                continue
+            self.written.add(name)
             # FIXME: not robust wrt. multiple packages/videos
-            with open(self.imgdir / f'{t}.png', 'wb') as f:
-                f.write(bytes(self.controller.package.imagecache[t]))
+            image = self.controller.package.imagecache[t]
+            self.submit(lambda path, image: self.write_file(path, bytes(image)),
+                        self.imgdir / f'{t}.png', image)
 
         # Copy overlays
         for (ident, tales) in used_overlays:
+            name = ident + tales.replace('/', '_')
+            if 'imagecache/overlay_%s.png' % name in self.written:
+                continue
             # FIXME: not robust wrt. multiple packages/videos
             a = self.controller.package.get_element_by_id(ident)
             if not a:
                 logger.error("Cannot find annotation %s for overlaying", ident)
                 continue
-            name = ident + tales.replace('/', '_')
             if tales:
                 # There is a TALES expression
                 ctx = self.controller.build_context(here=a)
                 data = ctx.evaluateValue('here' + tales)
             else:
                 data = a.content.data
-            with open(os.path.join(self.imgdir, 'overlay_%s.png' % name), 'wb') as f:
-                try:
-                    f.write(self.controller.gui.overlay(self.controller.package.imagecache[a.fragment.begin], data))
-                except TypeError:
-                    logger.exception("Error when trying to export overlayed thumbnail")
+            try:
+                image = self.controller.gui.overlay(self.controller.package.imagecache[a.fragment.begin], data)
+            except TypeError:
+                logger.exception("Error when trying to export overlayed thumbnail")
+                image = b''
+            self.written.add('imagecache/overlay_%s.png' % name)
+            self.submit(self.write_file, self.imgdir / ('overlay_%s.png' % name), image)
 
         # Copy resources
         for path in used_resources:
+            if 'resources/' + path in self.written:
+                continue
+            self.written.add('resources/' + path)
             dest = self.output / 'resources' / path
 
             d = dest.parent
@@ -404,11 +508,187 @@ class WebsiteExporter(GenericExporter):
             for element in path.split('/'):
                 r = r[element]
 
-            data = r.data
-            if isinstance(data, str):
-                data = data.encode('utf-8')
-            with open(dest, 'wb') as output:
-                output.write(data)
+            self.submit(self.write_file, dest, r.data)
+
+    def signature(self):
+        """Return a signature of the export inputs.
+
+        It is computed from the export options. The package data is
+        checked separately, through the package fingerprint and the
+        page dependencies.
+        """
+        h = hashlib.sha1(repr((self.video_url, self.depth, [ v.id for v in self.views ])).encode('utf-8'))
+        return h.hexdigest()
+
+    def element_state(self, el):
+        """Return the state of an element, used for dependencies.
+        """
+        try:
+            fp = fingerprint(el)
+        except AttributeError:
+            # Not a modeled element
+            return None
+        return fp.hex() if fp is not None else None
+
+    @staticmethod
+    def has_value_state(value):
+        """Check whether value_state can represent the value.
+
+        Other values (wrappers for metadata...) have a representation
+        depending on the object identity.
+        """
+        return (hasattr(value, 'ids')
+                or isinstance(value, (list, tuple, str, int, float, bool, type(None)))
+                or isinstance(getattr(value, 'id', None), str))
+
+    @staticmethod
+    def value_state(value):
+        """Return the state of a traversed value, used for dependencies.
+
+        Bundles and lists are represented by their element ids.
+        """
+        if hasattr(value, 'ids'):
+            data = "\n".join(value.ids())
+        elif isinstance(value, (list, tuple)):
+            data = "\n".join(getattr(v, 'id', None) or repr(v) for v in value)
+        elif isinstance(getattr(value, 'id', None), str):
+            data = value.id
+        else:
+            data = str(value)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def package_state(self):
+        """Return the state of the package own data (metadata, imports).
+        """
+        model = self.controller.package._getModel()
+        data = "".join(n.toxml()
+                       for n in model.childNodes
+                       if n.nodeType == n.ELEMENT_NODE and n.localName in ('meta', 'imports'))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def dependencies(self, url, accessed, used_overlays):
+        """Return the dependencies of a rendered page.
+
+        accessed is the list of (object, path, value) traversals done
+        when rendering the page (see
+        advene.model.tal.context.track_dependencies).
+
+        It is a dict (key -> state), the key being either an element
+        id, or element_id/path for an attribute holding elements.
+        Package attributes are all recorded, with an empty id, and
+        the empty key stands for the package own data.
+        """
+        package = self.controller.package
+        deps = {}
+        elements = [ package.get_element_by_id(i)
+                     for i in url.split('/') + [ ident for (ident, tales) in used_overlays ]
+                     if i ]
+        for (obj, path, value) in accessed:
+            if not isinstance(path, str) or callable(value):
+                path = None
+            if isinstance(obj, Package):
+                if obj is not package:
+                    continue
+                if path is not None and self.has_value_state(value):
+                    deps['/' + path] = self.value_state(value)
+                else:
+                    deps[''] = self.package_state()
+            elif hasattr(obj, '_getModel') and isinstance(getattr(obj, 'id', None), str):
+                elements.append(obj)
+                if path is not None and (hasattr(value, 'ids') or isinstance(value, (list, tuple))):
+                    deps[obj.id + '/' + path] = self.value_state(value)
+        for el in elements:
+            if el is not None and not isinstance(el, Package) and el.id not in deps:
+                deps[el.id] = self.element_state(el)
+        return deps
+
+    def dependency_state(self, key):
+        """Return the current state of a dependency key.
+
+        The states are cached during the export.
+        """
+        if key in self.dependency_states:
+            return self.dependency_states[key]
+        package = self.controller.package
+        ident, sep, path = key.partition('/')
+        el = package.get_element_by_id(ident) if ident else package
+        if not key:
+            state = self.package_state()
+        elif el is None:
+            state = None
+        elif not sep:
+            state = self.element_state(el)
+        else:
+            try:
+                state = self.value_state(self.controller.build_context(here=el).evaluateValue('here/' + path))
+            except Exception:
+                state = None
+        self.dependency_states[key] = state
+        return state
+
+    def cached_contents(self, url, deps):
+        """Return the cached rendering of the URL if its dependencies did not change.
+        """
+        if deps is None or any(state is None or self.dependency_state(key) != state
+                               for (key, state) in deps.items()):
+            return None
+        try:
+            with open(self.cache_path(url), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def journal_path(self):
+        """Return the path of the export journal.
+
+        It is stored in the settings directory, indexed by the output
+        directory path, so that it is not published with the export.
+        """
+        key = hashlib.sha1(str(self.output.resolve()).encode('utf-8')).hexdigest()
+        return Path(config.data.advenefile(('website-export', key + '.json'), 'settings'))
+
+    def cache_path(self, url):
+        """Return the path of the cached rendering of the URL.
+        """
+        return (self.journal_path().with_suffix('')
+                / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.html'))
+
+    def load_journal(self):
+        """Load the export journal.
+
+        Return None if there is no (valid) journal.
+        """
+        path = self.journal_path()
+        if not path.is_file():
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Cannot read export journal %s", path, exc_info=True)
+            return None
+
+    def save_journal(self, state, force=False):
+        """Save the export journal.
+
+        Pending writes are completed before saving, so that the
+        journal never references missing files. Unless force is True,
+        the journal is saved at most once per second.
+        """
+        now = time.time()
+        if not force and now - self.journal_time < 1:
+            return
+        self.flush()
+        state['url_translation'] = self.url_translation
+        state['written'] = sorted(self.written)
+        path = self.journal_path()
+        if not path.parent.is_dir():
+            path.parent.mkdir(parents=True)
+        with open(path.with_suffix('.tmp'), 'w', encoding='utf-8') as f:
+            # Sets are serialized as lists
+            json.dump(state, f, default=sorted)
+        path.with_suffix('.tmp').replace(path)
+        self.journal_time = now
 
     def check_requirements(self):
         self.output = Path(self.output)
@@ -451,9 +731,20 @@ class WebsiteExporter(GenericExporter):
             views.append(v)
 
         self.views = views
+        self.view_ids = set(v.id for v in self.controller.package.views)
 
         self.video_player = self.find_video_player(self.video_url)
         self.url_translation = {}
+        # Auxiliary files (snapshots, overlays, resources) already written
+        self.written = set()
+        self.pool = None
+        self.pending = []
+        self.journal_time = 0
+        self.dependency_states = {}
+
+        legacy = self.output / self.legacy_journal_name
+        if legacy.is_file():
+            legacy.unlink()
 
     def export(self, filename=None):
         # The filename parameter is the output dir
@@ -494,39 +785,112 @@ class WebsiteExporter(GenericExporter):
             view_url[v] = link
 
         progress = .01
-        depth = 1
-
-        links_to_be_processed = list(view_url.values())
 
-        while depth <= self.depth:
-            max_depth_exceeded = (depth == self.depth)
-            step = main_step / (len(links_to_be_processed) or 1)
-            if not self.callback(progress, _("Depth %d") % depth):
+        signature = self.signature()
+        package_signature = (fingerprint(self.controller.package) or b'').hex()
+        journal = None if self.restart else self.load_journal()
+        # Dependencies of the pages rendered by the previous export
+        previous_pages = {}
+        if journal is not None and journal.get('signature') != signature:
+            journal = None
+        if journal is not None and self.incremental:
+            if journal.get('complete') and journal.get('package') == package_signature:
+                self.callback(1.0, _("The export is up to date"))
                 return
-            links = set()
-            for url in links_to_be_processed:
-                if not self.callback(progress, _("Depth %(depth)d: processing %(url)s") % locals()):
+            previous_pages = journal.get('pages', {})
+        if journal is not None and journal.get('package') != package_signature:
+            if not journal.get('complete'):
+                logger.warning(_("The package was modified since the interrupted export. Restarting from scratch."))
+            journal = None
+        if journal is not None and journal.get('complete'):
+            journal = None
+
+        if journal is not None:
+            logger.info(_("Resuming interrupted export at depth %d"), journal['depth'])
+            state = journal
+            self.url_translation.update(state['url_translation'])
+            self.written = set(state['written'])
+        else:
+            state = {
+                'signature': signature,
+                'package': package_signature,
+                'complete': False,
+                'depth': 1,
+                # URLs to process at the current depth
+                'frontier': list(view_url.values()),
+                # URLs already processed at the current depth
+                'done': [],
+                # Output files already rendered
+                'rendered': [],
+                # URLs to process at the next depth
+                'next': [],
+                # Dependencies of each rendered URL
+                'pages': {},
+            }
+        pages = state['pages']
+
+        depth = state['depth']
+        links_to_be_processed = state['frontier']
+
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as self.pool:
+            while depth <= self.depth:
+                max_depth_exceeded = (depth == self.depth)
+                step = main_step / (len(links_to_be_processed) or 1)
+                if not self.callback(progress, _("Depth %d") % depth):
+                    self.save_journal(state, force=True)
                     return
-                progress += step
-                content = self.get_contents(url)
-
-                (new_links,
-                 used_snapshots,
-                 used_overlays,
-                 used_resources) = self.translate_links(content,
-                                                        url,
-                                                        max_depth_exceeded)
-                links.update(new_links)
-
-                # Write contents
-                self.write_data(url,
-                                self.fix_links(content),
-                                used_snapshots,
-                                used_overlays,
-                                used_resources)
-
-            links_to_be_processed = links
-            depth += 1
+                done = state['done'] = set(state['done'])
+                rendered = state['rendered'] = set(state['rendered'])
+                links = state['next'] = set(state['next'])
+                for url in links_to_be_processed:
+                    if url in done:
+                        progress += step
+                        continue
+                    if not self.callback(progress, _("Depth %(depth)d: processing %(url)s") % locals()):
+                        self.save_journal(state, force=True)
+                        return
+                    progress += step
+                    if self.output_name(url) not in rendered:
+                        content = self.cached_contents(url, previous_pages.get(url))
+                        if content is None:
+                            track_dependencies()
+                            try:
+                                content = self.get_contents(url)
+                            finally:
+                                accessed = stop_tracking_dependencies()
+                            if isinstance(content, str):
+                                self.submit(self.write_cache, url, content)
+                        else:
+                            accessed = None
+
+                        (new_links,
+                         used_snapshots,
+                         used_overlays,
+                         used_resources) = self.translate_links(content,
+                                                                url,
+                                                                max_depth_exceeded)
+                        links.update(new_links)
+                        if accessed is None:
+                            pages[url] = previous_pages[url]
+                        else:
+                            pages[url] = self.dependencies(url, accessed, used_overlays)
+
+                        # Write contents
+                        self.write_data(url,
+                                        self.fix_links(content),
+                                        used_snapshots,
+                                        used_overlays,
+                                        used_resources)
+                        rendered.add(self.output_name(url))
+                    done.add(url)
+                    self.save_journal(state)
+
+                links_to_be_processed = list(links)
+                depth += 1
+                state.update(depth=depth, frontier=links_to_be_processed, done=[], next=[])
+                self.save_journal(state, force=True)
+        self.pool = None
+        self.flush()
 
         if not self.callback(0.95, _("Finalizing")):
             return
@@ -606,6 +970,8 @@ class WebsiteExporter(GenericExporter):
 <p>Advene was unable to export this resource.</p>
 </body></html>""")
 
+        state['complete'] = True
+        self.save_journal(state, force=True)
         self.callback(1.0, _("Export complete"))
 
 class VideoPlayer:
@@ -0,0 +1,136 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Benchmark the notifications of a bulk import.
+
+Usage: benchmark_batch.py [rows]
+
+Import rows annotations with the notify flag, with views open (an
+incremental checker, an annotation counter and the undo manager), and
+compare the delivery of one notification per annotation with the
+coalesced AnnotationBatch notification.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+from collections import Counter
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+from advene.core.controller import AdveneController
+from advene.util.checker import CheckerEngine
+from advene.util.importer import GenericImporter
+import advene.plugins.undomanager
+
+class View:
+    """Headless view, updated like the GUI adhoc views.
+    """
+    def __init__(self, controller):
+        self.controller = controller
+        self.engine = CheckerEngine(controller.package)
+        self.calls = 0
+
+    def update_annotation(self, annotation=None, event=None):
+        self.calls += 1
+        self.engine.update_element(annotation, event)
+
+    def update_annotation_batch(self, changes):
+        self.calls += 1
+        for (annotation, event) in changes:
+            self.engine.update_element(annotation, event)
+
+def register_view(controller, view):
+    """Dispatch the events to the view, as advene.gui.main does.
+    """
+    def annotation_lifecycle(context, parameters):
+        view.update_annotation(annotation=context.evaluateValue('annotation'),
+                               event=context.evaluateValue('event'))
+    def annotation_batch_lifecycle(context, parameters):
+        view.update_annotation_batch(context.evaluateValue('changes'))
+    for event in ('AnnotationCreate', 'AnnotationEditEnd', 'AnnotationDelete'):
+        controller.event_handler.internal_rule(event=event, method=annotation_lifecycle)
+    controller.event_handler.internal_rule(event='AnnotationBatch', method=annotation_batch_lifecycle)
+
+def rows(count):
+    for i in range(count):
+        yield {
+            'begin': i * 1000,
+            'duration': 1500 if i % 10 == 0 else 900,
+            'content': "Row %d" % i,
+            'type': 'bench',
+            'notify': True,
+        }
+
+def individual_import(importer, count):
+    """Import the rows with one notification per annotation.
+    """
+    at = importer.ensure_new_type(prefix='bench')
+    for d in rows(count):
+        a = importer.create_annotation(type_=at,
+                                       begin=d['begin'],
+                                       end=d['begin'] + d['duration'],
+                                       data=d['content'],
+                                       author=importer.author,
+                                       timestamp=importer.timestamp)
+        importer.controller.notify('AnnotationCreate', annotation=a)
+
+def batch_import(importer, count):
+    """Import the rows through GenericImporter.convert.
+    """
+    importer.convert(rows(count))
+
+def measure(label, count, function):
+    controller = AdveneController()
+    controller.load_package(alias='bench')
+    advene.plugins.undomanager.register(controller)
+    view = View(controller)
+    register_view(controller, view)
+    importer = GenericImporter(package=controller.package, controller=controller)
+
+    t0 = time.time()
+    function(importer, count)
+    t1 = time.time()
+    queued = len(controller.event_queue)
+    controller.process_queue()
+    t2 = time.time()
+    print("%-12s import %.2fs, %6d queued events dispatched in %.2fs, %6d view updates, %d undo entries, total %.2fs" % (
+        label, t1 - t0, queued, t2 - t1, view.calls, len(controller.undomanager.history), t2 - t0))
+    return view
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    count = int(saved_args[0]) if saved_args else 50000
+
+    individual = measure("Individual", count, individual_import)
+    batch = measure("Batch", count, batch_import)
+    # Element ids are generated, compare the issue counts
+    if (Counter(name for (name, el, detail) in individual.engine.report())
+        != Counter(name for (name, el, detail) in batch.engine.report())):
+        print("Warning: different checker results")
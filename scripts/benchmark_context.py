@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Benchmark the construction of TALES contexts.
+
+Usage: benchmark_context.py [package_file] [iterations]
+
+Measure how many contexts per second are built by
+controller.build_context (derived from a prototype context), compared
+to the construction of a full AdveneContext for each call, and how
+many per-annotation title evaluations per second can be done.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+from advene.core.controller import AdveneController
+from advene.model.tal.context import AdveneContext
+from advene.model.tal import global_methods
+
+def full_context(controller, here):
+    """Build a context from scratch, as build_context used to do.
+    """
+    c = AdveneContext(here,
+                      options={
+                          'package_url': controller.get_default_url(root=True),
+                          'snapshot': controller.package.imagecache,
+                          'namespace_prefix': config.data.namespace_prefix,
+                          'config': config.data.web,
+                          'aliases': controller.aliases,
+                          'controller': controller,
+                      })
+    # AdveneContext used to enumerate the default methods each time
+    for name in AdveneContext.defaultMethods():
+        c.addMethod(name, global_methods.__dict__[name])
+    c.addGlobal('package', controller.package)
+    c.addGlobal('packages', controller.packages)
+    c.addGlobal('player', controller.player)
+    for name, method in config.data.global_methods.items():
+        c.addMethod(name, method)
+    c.checkpoint()
+    return c
+
+def measure(label, count, function):
+    t0 = time.time()
+    for i in range(count):
+        function(i)
+    t = time.time() - t0
+    print("%-32s %8.0f /s" % (label, count / t))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    filename = saved_args[0] if saved_args else os.path.join(maindir, 'examples', 'Nosferatu_v13.azp')
+    count = int(saved_args[1]) if len(saved_args) > 1 else 20000
+
+    controller = AdveneController()
+    controller.load_package(uri=filename, alias='bench')
+    annotations = controller.package.annotations
+    n = len(annotations)
+
+    measure("Full context", count,
+            lambda i: full_context(controller, annotations[i % n]))
+    measure("build_context", count,
+            lambda i: controller.build_context(here=annotations[i % n]))
+    measure("Full context + here/id", count,
+            lambda i: full_context(controller, annotations[i % n]).evaluateValue('here/id'))
+    measure("build_context + here/id", count,
+            lambda i: controller.build_context(here=annotations[i % n]).evaluateValue('here/id'))
@@ -0,0 +1,110 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Benchmark the package differ on synthetic packages.
+
+Usage: benchmark_differ.py [annotation_count]
+
+Two packages with the same annotations are generated, then a fraction
+of the annotations of the source package is modified, deleted or
+added. The diff is computed with the fingerprint-based Differ and with
+the previous per-element lookup, and both outputs are compared.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+from advene.model.package import Package
+from advene.model.fragment import MillisecondFragment
+from advene.util.merger import Differ
+
+class LegacyDiffer(Differ):
+    """Differ inspecting every element, as before fingerprinting.
+    """
+    def changed_elements(self, source_elements, destination_elements):
+        for s in source_elements:
+            yield s, self.destination.get_element_by_id(s.id)
+
+def generate_package(count, modified=()):
+    """Generate a package with count annotations in 50 annotation types.
+    """
+    p = Package(uri='new_pkg', source=None)
+    types = []
+    for i in range(10):
+        schema = p.createSchema(ident='schema%d' % i)
+        p.schemas.append(schema)
+        for j in range(5):
+            at = schema.createAnnotationType(ident='at%d_%d' % (i, j))
+            at.mimetype = 'text/plain'
+            schema.annotationTypes.append(at)
+            types.append(at)
+    for i in range(count):
+        a = p.createAnnotation(ident='a%d' % i, type=types[i % len(types)], author='bench',
+                               fragment=MillisecondFragment(begin=i * 1000, duration=800))
+        a.content.mimetype = 'text/plain'
+        a.content.data = 'Annotation number %d' % i
+        if i % 10 == 0:
+            a.setTags([ 'tag%d' % (i % 7) ])
+        if i in modified:
+            if i % 3 == 0:
+                a.content.data = 'Modified annotation %d' % i
+            elif i % 3 == 1:
+                a.fragment.end = a.fragment.end + 100
+            else:
+                a.setTags([ 'modified' ])
+        p.annotations.append(a)
+    return p
+
+def run(differ_class, source, destination):
+    differ = differ_class(source, destination)
+    t = time.time()
+    result = [ (name, s.id, getattr(d, 'id', None), str(value(s))[:100])
+               for (name, s, d, action, value) in differ.diff() ]
+    return time.time() - t, result
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    count = int(saved_args[0]) if saved_args else 20000
+    modified = set(range(0, count, 50))
+    logger.info("Generating packages with %d annotations", count)
+    destination = generate_package(count)
+    source = generate_package(count + count // 100, modified)
+
+    legacy_duration, legacy = run(LegacyDiffer, source, destination)
+    duration, result = run(Differ, source, destination)
+    logger.info("%d differences", len(result))
+    logger.info("Per-element diff: %.2fs", legacy_duration)
+    logger.info("Fingerprint diff: %.2fs (x%.1f)", duration, legacy_duration / max(duration, 1e-6))
+    if result != legacy:
+        logger.error("Diff outputs differ")
+        sys.exit(1)
+    logger.info("Diff outputs are identical")
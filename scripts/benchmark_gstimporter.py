@@ -0,0 +1,112 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Benchmark the combined media analysis importer.
+
+Usage: benchmark_gstimporter.py media_file [analyzer,...]
+
+The GstImporter-based analyzers are run one after the other (each of
+them decoding the media), then all together through the
+CompositeGstImporter (decoding the media once). Wall-clock durations
+and the number of created annotations per type are compared.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib
+from gi.repository import Gst
+Gst.init(None)
+
+from advene.model.package import Package
+import advene.util.importer
+from advene.util.gstimporter import CompositeGstImporter
+
+ANALYZER_PLUGINS = ('cutter', 'soundenveloppe', 'dominantcolor', 'scenechange', 'motioncells')
+
+class Controller:
+    """Minimal controller, for plugin registration.
+    """
+    def register_importer(self, imp):
+        advene.util.importer.register(imp)
+
+def load_analyzers():
+    controller = Controller()
+    for name in ANALYZER_PLUGINS:
+        try:
+            m = __import__('advene.plugins.%s' % name, fromlist=[ 'register' ])
+            m.register(controller)
+        except Exception:
+            logger.error("Cannot load %s plugin", name, exc_info=True)
+    return CompositeGstImporter.available_analyzers()
+
+def run(importer_class, filename, **options):
+    """Run an importer on filename, and return (duration, annotation count per type).
+    """
+    package = Package(uri='new_pkg', source=None)
+    i = importer_class(package=package, callback=lambda value, label: True)
+    for k, v in options.items():
+        setattr(i, k, v)
+    loop = GLib.MainLoop()
+    t = time.time()
+    i.async_process_file(filename, loop.quit)
+    loop.run()
+    duration = time.time() - t
+    return duration, dict( (at.id, len(at.annotations)) for at in package.annotationTypes )
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if not saved_args:
+        logger.error(__doc__)
+        sys.exit(1)
+    filename = saved_args[0]
+    classes = load_analyzers()
+    if len(saved_args) > 1:
+        names = saved_args[1].split(',')
+    else:
+        names = sorted(classes)
+
+    sequential_duration = 0
+    sequential = {}
+    for n in names:
+        duration, counts = run(classes[n], filename)
+        logger.info("%s: %.2fs", n, duration)
+        sequential_duration += duration
+        sequential.update(counts)
+
+    duration, combined = run(CompositeGstImporter, filename, analyzers=",".join(names))
+    logger.info("Sequential analysis: %.2fs", sequential_duration)
+    logger.info("Combined analysis: %.2fs (x%.1f)", duration, sequential_duration / max(duration, 1e-6))
+    for typeid in sorted(set(sequential) | set(combined)):
+        logger.info("%-20s sequential %6d combined %6d", typeid, sequential.get(typeid, 0), combined.get(typeid, 0))
@@ -0,0 +1,200 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Benchmark the identifier generator on a large package.
+
+Usage: benchmark_idgenerator.py [--size N] [--create N] [--legacy N]
+
+A package with N annotations is generated. The id generator is then
+initialized, N new annotations are created (id generation, existence
+check as done by the creation dialogs, creation and registration of
+the id), ids are generated from the same title (for views), and the
+ids of the created annotations are removed.
+
+The same operations are measured with the previous list-based
+generator, on a smaller number of operations (--legacy), and
+per-operation durations are compared.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+import os
+import re
+import sys
+import time
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+from advene.core.idgenerator import Generator
+from advene.model.annotation import Annotation
+from advene.model.fragment import MillisecondFragment
+from advene.model.package import Package
+import advene.util.helper as helper
+
+class LegacyGenerator(Generator):
+    """Generator storing the ids in a list, as before.
+    """
+    def exists(self, id_):
+        return id_ in self.existing
+
+    def add(self, id_):
+        self.existing.append(id_)
+
+    def remove(self, id_):
+        try:
+            self.existing.remove(id_)
+        except ValueError:
+            pass
+
+    def init(self, package):
+        self.existing = []
+        prefixes = list(self.prefix.values())
+        re_id = re.compile("^(" + "|".join(prefixes) + ")([0-9]+)")
+        last_id = dict( (k, 0) for k in prefixes )
+        for l in (package.annotations, package.relations,
+                  package.schemas,
+                  package.annotationTypes, package.relationTypes,
+                  package.views, package.queries):
+            for i in l.ids():
+                self.existing.append(i)
+                m = re_id.match(i)
+                if m:
+                    n = int(m.group(2))
+                    k = m.group(1)
+                    if last_id[k] < n:
+                        last_id[k] = n
+        self.last_used = dict(last_id)
+
+    def get_id(self, elementtype):
+        prefix = self.prefix[elementtype]
+        index = self.last_used[prefix] + 1
+        self.last_used[prefix] = index
+        return prefix + str(index)
+
+    def new_from_title(self, title):
+        root = helper.title2id(title)
+        index = 1
+        i = "%s%d" % (root, index)
+        while i in self.existing:
+            index += 1
+            i = "%s%d" % (root, index)
+        if index != 1:
+            title = "%s%d" % (title, index)
+        return title, i
+
+def generate_package(count):
+    """Generate a package with count annotations in 10 annotation types.
+    """
+    p = Package(uri='new_pkg', source=None)
+    schema = p.createSchema(ident='schema_1')
+    p.schemas.append(schema)
+    types = []
+    for i in range(10):
+        at = schema.createAnnotationType(ident='at_%d' % (i + 1))
+        at.mimetype = 'text/plain'
+        schema.annotationTypes.append(at)
+        types.append(at)
+    for i in range(count):
+        a = p.createAnnotation(ident='a%d' % (i + 1), type=types[i % len(types)], author='bench',
+                               fragment=MillisecondFragment(begin=i * 1000, duration=800))
+        p.annotations.append(a)
+    return p, types
+
+def run(generator_class, package, types, count, titles):
+    """Run the operations, and return a dictionary of durations (in s).
+
+    Only the time spent in the generator is measured.
+    """
+    durations = dict( (op, 0) for op in ('init', 'create', 'title', 'delete') )
+    t = time.perf_counter()
+    generator = generator_class(package)
+    durations['init'] = time.perf_counter() - t
+
+    created = []
+    for i in range(count):
+        t = time.perf_counter()
+        id_ = generator.get_id(Annotation)
+        if generator.exists(id_):
+            raise RuntimeError("Generated an existing id: %s" % id_)
+        durations['create'] += time.perf_counter() - t
+        a = package.createAnnotation(ident=id_, type=types[i % len(types)], author='bench',
+                                     fragment=MillisecondFragment(begin=i * 1000, duration=800))
+        package.annotations.append(a)
+        t = time.perf_counter()
+        generator.add(id_)
+        durations['create'] += time.perf_counter() - t
+        created.append(a)
+
+    for i in range(titles):
+        t = time.perf_counter()
+        title, id_ = generator.new_from_title("Bench view")
+        generator.add(id_)
+        durations['title'] += time.perf_counter() - t
+
+    # Deleting elements from the package is linear in the model
+    # itself, only remove the ids.
+    t = time.perf_counter()
+    for a in created:
+        generator.remove(a.id)
+    durations['delete'] = time.perf_counter() - t
+    return durations
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser("Identifier generator benchmark")
+    parser.add_argument('--size', action="store", type=int, default=300000,
+                        help="Number of annotations of the package")
+    parser.add_argument('--create', action="store", type=int, default=100000,
+                        help="Number of created annotations")
+    parser.add_argument('--titles', action="store", type=int, default=1000,
+                        help="Number of views created from the same title")
+    parser.add_argument('--legacy', action="store", type=int, default=1000,
+                        help="Number of created annotations with the legacy generator")
+    args = parser.parse_args(saved_args)
+    config.data.preferences['use-uuid'] = False
+
+    t = time.time()
+    package, types = generate_package(args.size)
+    logger.info("Generated a %d annotations package in %.2fs", args.size, time.time() - t)
+
+    legacy = run(LegacyGenerator, package, types, args.legacy, min(args.titles, args.legacy))
+    current = run(Generator, package, types, args.create, args.titles)
+    counts = {
+        'init': (1, 1),
+        'create': (args.legacy, args.create),
+        'title': (min(args.titles, args.legacy), args.titles),
+        'delete': (args.legacy, args.create),
+    }
+    for op, (legacy_count, count) in counts.items():
+        if not count or not legacy_count:
+            continue
+        legacy_op = legacy[op] / legacy_count
+        op_duration = current[op] / count
+        logger.info("%-7s legacy %10.3fms/op (%d), set-based %10.3fms/op (%d): %.2fs, x%.1f",
+                    op, legacy_op * 1000, legacy_count, op_duration * 1000, count,
+                    current[op], legacy_op / max(op_duration, 1e-9))
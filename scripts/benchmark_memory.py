@@ -0,0 +1,151 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Measure the memory overhead of the model objects, per annotation.
+
+Usage: benchmark_memory.py [annotation_count]
+
+A package with annotation_count annotations (and a relation for
+every 10 annotations) is generated, saved, then loaded again. The
+memory allocated (as traced by tracemalloc) is measured when loading
+the DOM, when building the annotation and relation bundles, and when
+accessing the fragment, the content and the metadata of all the
+annotations. Annotation wrappers being created on access and freed
+when they are no longer referenced, the memory freed by dropping them
+is also measured. Run it on different revisions to compare them.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+from advene.model.package import Package
+from advene.model.fragment import MillisecondFragment
+import advene.util.helper as helper
+
+def generate_package(filename, count):
+    """Generate and save a package with count annotations.
+    """
+    p = Package(uri='new_pkg', source=None)
+    schema = p.createSchema(ident='schema_1')
+    p.schemas.append(schema)
+    at = schema.createAnnotationType(ident='at_1')
+    at.mimetype = 'text/plain'
+    schema.annotationTypes.append(at)
+    rt = schema.createRelationType(ident='rt_1')
+    schema.relationTypes.append(rt)
+    previous = None
+    for i in range(count):
+        a = p.createAnnotation(ident='a%d' % i, type=at, author='bench',
+                               fragment=MillisecondFragment(begin=i * 1000, duration=800))
+        a.content.data = 'Annotation number %d' % i
+        p.annotations.append(a)
+        if i % 10 == 1:
+            r = p.createRelation(ident='r%d' % i, type=rt, members=(previous, a))
+            p.relations.append(r)
+        previous = a
+    p.save(filename)
+
+def allocated():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    count = int(saved_args[0]) if saved_args else 100000
+    filename = os.path.join(tempfile.mkdtemp(prefix='advene'), 'memory.xml')
+    t = time.time()
+    generate_package(filename, count)
+    logger.info("Generated a %d annotations package in %.2fs", count, time.time() - t)
+
+    tracemalloc.start()
+    steps = []
+    m = allocated()
+    p = Package(uri=helper.path2uri(filename))
+    steps.append(("DOM", allocated() - m))
+
+    m = allocated()
+    annotations = p.annotations
+    relations = p.relations
+    steps.append(("Bundles", allocated() - m))
+
+    # Annotation wrappers are created on access, and freed when they
+    # are no longer referenced: keep a reference on all of them.
+    m = allocated()
+    wrappers = list(annotations)
+    steps.append(("Wrappers", allocated() - m))
+
+    m = allocated()
+    for a in wrappers:
+        a.fragment
+    steps.append(("Fragments", allocated() - m))
+
+    m = allocated()
+    for a in wrappers:
+        a.content
+    steps.append(("Contents", allocated() - m))
+
+    m = allocated()
+    for a in wrappers:
+        a.getMetaData(config.data.namespace, 'description')
+    steps.append(("Metadata", allocated() - m))
+
+    m = allocated()
+    for a in wrappers:
+        a.relations
+    steps.append(("Relations", allocated() - m))
+
+    t = time.time()
+    for a in annotations:
+        a.fragment.begin
+    referenced = time.time() - t
+
+    m = allocated()
+    del wrappers, a
+    released = allocated() - m
+
+    t = time.time()
+    for a in annotations:
+        a.fragment.begin
+    unreferenced = time.time() - t
+
+    model = sum(size for (label, size) in steps[1:])
+    for label, size in steps:
+        logger.info("%-10s %10.1f bytes/annotation", label, size / count)
+    logger.info("Model objects: %.1f bytes/annotation (%.1f MB), DOM: %.1f MB",
+                model / count, model / 1024 / 1024, steps[0][1] / 1024 / 1024)
+    logger.info("Unreferenced wrappers: %.1f bytes/annotation freed, %.1f bytes/annotation kept",
+                -released / count, (model + released) / count)
+    logger.info("Fragment access for all annotations: %.3fs (referenced), %.3fs (unreferenced)",
+                referenced, unreferenced)
@@ -0,0 +1,172 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Benchmark the montage renderer.
+
+Usage: benchmark_montage.py [--duration S] [--clips N] [--workers N] [media_file]
+
+If no media file is given, a VP8/Vorbis WebM test video (with a
+keyframe every 2 seconds) is generated. A montage of N clips spread
+over the media is then rendered by re-encoding, by copying the video
+stream (re-encoding partial GOPs at cut points) and by copying the
+video stream with cut points snapped to keyframes. Rendering
+durations and output durations are compared.
+
+Re-encoding is then done with 1 to N parallel worker processes, and
+the speedup per core is reported.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib
+from gi.repository import Gst
+Gst.init(None)
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import GstPbutils
+
+from advene.model.fragment import MillisecondFragment
+import advene.util.helper as helper
+from advene.plugins.montagerenderer import MontageRenderer, smart_render_available
+
+def generate_video(filename, duration):
+    """Generate a test video of duration seconds, with a keyframe every 2s.
+    """
+    pipeline = Gst.parse_launch(
+        "videotestsrc num-buffers=%(frames)d pattern=ball ! video/x-raw,width=640,height=360,framerate=25/1 "
+        "! vp8enc keyframe-max-dist=50 deadline=1 ! webmmux name=mux ! filesink location=%(filename)s "
+        "audiotestsrc num-buffers=%(buffers)d samplesperbuffer=1000 ! audio/x-raw,rate=25000 "
+        "! audioconvert ! vorbisenc ! mux." % {
+            'frames': duration * 25,
+            'buffers': duration * 25,
+            'filename': filename,
+        })
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                                                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if msg.type == Gst.MessageType.ERROR:
+        raise RuntimeError("Cannot generate test video: %s" % str(msg.parse_error()[0]))
+
+def media_duration(uri):
+    """Return the duration of the media, in ms.
+    """
+    info = GstPbutils.Discoverer.new(10 * Gst.SECOND).discover_uri(uri)
+    return info.get_duration() // Gst.MSECOND
+
+def clips(duration, count):
+    """Return count 3s-long annotations, spread over duration (in ms).
+
+    Their begin is not aligned with the keyframes.
+    """
+    step = duration // count
+    return [ SimpleNamespace(fragment=MillisecondFragment(begin=i * step + 700,
+                                                         duration=3000))
+             for i in range(count) ]
+
+def render(uri, elements, filename, **options):
+    """Render the montage, and return (rendering duration, stream_copy, workers).
+    """
+    r = MontageRenderer(None, elements, media_uri=uri)
+    loop = GLib.MainLoop()
+    def progress(value):
+        if value is None:
+            loop.quit()
+        return True
+    t = time.time()
+    r.render(filename, progress, **options)
+    loop.run()
+    duration = time.time() - t
+    r.finalize()
+    return duration, r.stream_copy, r.workers
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser("Montage renderer benchmark")
+    parser.add_argument('--duration', action="store", type=int, default=600,
+                        help="Duration of the generated test video, in seconds")
+    parser.add_argument('--clips', action="store", type=int, default=40,
+                        help="Number of clips in the montage")
+    parser.add_argument('--workers', action="store", type=int, default=os.cpu_count(),
+                        help="Maximum number of worker processes")
+    parser.add_argument('media', nargs='?', default=None,
+                        help="Media file")
+    args = parser.parse_args(saved_args)
+
+    tmpdir = tempfile.mkdtemp(prefix='montage')
+    if args.media is None:
+        media = os.path.join(tmpdir, 'source.webm')
+        t = time.time()
+        generate_video(media, args.duration)
+        print("Generated %ds test video in %.2fs" % (args.duration, time.time() - t))
+    else:
+        media = args.media
+    uri = helper.path2uri(os.path.abspath(media))
+    ext = os.path.splitext(media)[1]
+    elements = clips(media_duration(uri), args.clips)
+    expected = sum(a.fragment.duration for a in elements)
+
+    if not smart_render_available():
+        print("Warning: smart rendering needs GES 1.20, all renderings will re-encode")
+    config.data.preferences['montage-stream-copy'] = True
+
+    results = []
+    for label, filename, options in (
+            ("Re-encode", os.path.join(tmpdir, 'reencode.webm'), { 'stream_copy': False, 'workers': 1 }),
+            ("Stream copy", os.path.join(tmpdir, 'copy' + ext), {}),
+            ("Snapped copy", os.path.join(tmpdir, 'snapped' + ext), { 'snap_to_keyframes': True }),
+    ):
+        duration, copied, workers = render(uri, elements, filename, **options)
+        output = media_duration(helper.path2uri(filename))
+        results.append(duration)
+        print("%-14s %7.2fs (%s) -> %s, %.1fs (montage %.1fs)" % (
+            label, duration, "stream copy" if copied else "re-encoded",
+            filename, output / 1000, expected / 1000))
+    print("Speedup: stream copy x%.1f, snapped copy x%.1f" % (results[0] / results[1],
+                                                             results[0] / results[2]))
+
+    # Parallel re-encoding. Do not limit the workers by memory.
+    config.data.preferences['montage-memory-budget'] = 0
+    count = 2
+    while count <= args.workers:
+        filename = os.path.join(tmpdir, 'reencode%d.webm' % count)
+        duration, copied, workers = render(uri, elements, filename, stream_copy=False, workers=count)
+        output = media_duration(helper.path2uri(filename))
+        print("%-14s %7.2fs -> %.1fs, speedup x%.2f, x%.2f per core" % (
+            "%d workers" % workers, duration, output / 1000,
+            results[0] / duration, results[0] / duration / workers))
+        count = count * 2 if count * 2 <= args.workers or count == args.workers else args.workers
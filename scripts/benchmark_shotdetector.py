@@ -0,0 +1,243 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Benchmark the Delakis shot detector on a synthetic histogram sequence.
+
+Usage: benchmark_shotdetector.py [frame_count]
+
+A sequence of grey-level histograms is generated, made of noisy shots
+separated by hard cuts, low-contrast cuts and dissolves. Shots and
+dissolves are detected with the vectorised ShotDetector and with the
+previous loop-based implementation, and both outputs are compared.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+from gettext import gettext as _
+
+import numpy
+
+from advene.plugins.goodshotdetector import ShotDetector, NB_BINS, NB_CHANNELS, K, T, MEAN_WINDOW
+
+class LegacyShotDetector:
+    """Loop-based ShotDetector, as before vectorisation.
+    """
+    def __init__(self, progress=None):
+        if progress is None:
+            progress = self.dummy_progress
+        self.progress = progress
+        self.ALPHA = 1.8
+        self.BETA = 0.10
+        self.MOTION_THRESHOLD = 0.15
+        self.SHOT_THRESHOLD     = 0.15
+        self.HIGH_CUT_THRESHOLD = 0.8
+        self.DISS_THRESHOLD = 0.4
+        self.DISS_START_THRESHOLD = 0.16
+        self.DISS_END_THRESHOLD = 0.26
+        self.DISS_MIN_FRAMES = 3
+
+
+    def dummy_progress(self, prg, label):
+        pass
+
+    def process(self, histos, mspf=40):
+        self.progress(.1, _("Computing hdiff"))
+        nbpixel = numpy.sum(histos[0])
+        #compute various histogram variations
+        hdiff = (numpy.abs(histos[:-1] - histos[1:])) / 2
+        hdiffsumchannel = numpy.sum(hdiff, axis=1)
+        histo_dist = hdiffsumchannel / nbpixel / NB_CHANNELS
+
+        self.progress(.2, _("Detecting cuts"))
+        #detect hard cut
+        cuts = numpy.flatnonzero( histo_dist >= self.HIGH_CUT_THRESHOLD )
+
+        #detect low cut
+        for f in numpy.flatnonzero(
+                (histo_dist < self.HIGH_CUT_THRESHOLD) &
+                (histo_dist >= self.SHOT_THRESHOLD)
+        ):
+            if self.__cut_detection(f, histo_dist):
+                cuts = numpy.append(cuts, f)
+
+        cuts.sort()
+        n = 1
+        yield {
+            'begin': 0,
+            'end': cuts[0] * mspf,
+            'content': str(n),
+            }
+        for b, e in zip(cuts[:-1], cuts[1:]):
+            n += 1
+            yield {
+                'begin': b * mspf,
+                'end': e * mspf,
+                'content': str(n)
+                }
+
+        self.progress(.3, _("Detecting dissolves"))
+        #detect dissolve
+        hcumul = self.__histo_cumul(histos)
+        hcumul = self.__filter_by_cut(cuts, hcumul)
+        hpixelwise = self.__histo_pixelwise(hdiff)
+        hpixelwise = hpixelwise / nbpixel / 100
+
+        for diss in self.__detect_dissolve(hcumul, hpixelwise):
+            yield {
+                'begin': diss[0] * mspf,
+                'end': diss[1] * mspf,
+                'content': 'grad',
+                }
+
+    def __detect_dissolve(self, hcumul, hpixelwise):
+        motion_frames = hpixelwise > self.MOTION_THRESHOLD
+        start = end = -1
+        for f in numpy.flatnonzero(hcumul > self.DISS_THRESHOLD):
+            #new frame not in current dissolve, record dissolve
+            if start > 0 and f > end:
+                motion = numpy.sum(motion_frames[list(range(start,end))])
+                if not motion and end - start > self.DISS_MIN_FRAMES:
+                    yield (start,end)
+                start = end = -1
+
+            if start < 0 :
+                start = end = f
+                #find lower bound
+                while start > 0 and hcumul[start] > self.DISS_START_THRESHOLD:
+                    start -= 1
+                #find upper bound
+                while end+1 < len(hcumul) and hcumul[end+1] > self.DISS_END_THRESHOLD :
+                    end += 1
+
+        #add the last dissolve
+        if start > 0 and end > 0 :
+            motion = numpy.sum(motion_frames[list(range(start,end))])
+            if not motion and end - start > self.DISS_MIN_FRAMES:
+                yield (start,end)
+
+    def __histo_pixelwise(self,hdiff):
+        r = []
+        for h in hdiff:
+            s = 0
+            for i in range(T, NB_BINS):
+                s += (h[i] * (i-T-1))
+            r.append(s)
+        return numpy.array(r)
+
+    def __histo_cumul(self, histos):
+        nbpix = numpy.sum(histos[0])
+        r = []
+        for i in range(1, len(histos)):
+            h = (histos[i] + histos[i-1]) / 2
+            c = 0
+            for k in range(1, K):
+                if i - k < 0 :
+                    break
+                c += numpy.sum(numpy.abs(h - histos[i - k])) / nbpix
+            r.append(c / K)
+        return numpy.array(r)
+
+    def __filter_by_cut(self, cuts, histo_cumul):
+        for c in cuts:
+            for i in range(K):
+                try :
+                    histo_cumul[c + i] = histo_cumul[c + i]/(K - i)
+                except IndexError:
+                    break
+        return histo_cumul
+
+    def __cut_detection(self, f, histo_dist):
+        d = histo_dist[f]
+        left_diff  = histo_dist[f - 1 - MEAN_WINDOW : f - 1] + self.BETA
+        right_diff = histo_dist[f + 1 : f + 1 + MEAN_WINDOW] + self.BETA
+
+        mean_left  = numpy.mean(left_diff)
+        mean_rigth = numpy.mean(right_diff)
+        mean_local = (mean_left + mean_rigth) / 2
+
+        adapt_threshold =  self.ALPHA * mean_local  - self.BETA
+        return d >= adapt_threshold
+
+def generate_histograms(count, nbpixel=320*240, seed=0):
+    """Generate count histograms of nbpixel pixels.
+    """
+    rng = numpy.random.default_rng(seed)
+    histos = numpy.empty((count, NB_BINS), dtype='int32')
+    current = rng.dirichlet(numpy.full(NB_BINS, .1))
+    i = 0
+    while i < count:
+        length = min(int(rng.integers(25, 250)), count - i)
+        target = rng.dirichlet(numpy.full(NB_BINS, .1))
+        kind = rng.random()
+        if kind < .2:
+            # Dissolve into the next shot
+            duration = min(12, length)
+            weights = numpy.linspace(0, 1, duration)[:, None]
+            probs = numpy.concatenate(((1 - weights) * current + weights * target,
+                                       numpy.repeat(target[None, :], length - duration, axis=0)))
+        elif kind < .4:
+            # Low contrast cut
+            target = .7 * current + .3 * target
+            probs = numpy.repeat(target[None, :], length, axis=0)
+        else:
+            # Hard cut
+            probs = numpy.repeat(target[None, :], length, axis=0)
+        # Frame noise
+        probs = numpy.clip(probs * rng.normal(1, .03, probs.shape), 0, None)
+        probs /= probs.sum(axis=1)[:, None]
+        histos[i:i+length] = (probs * nbpixel).astype('int32')
+        current = target
+        i += length
+    return histos
+
+def run(detector_class, histos):
+    t = time.time()
+    result = list(detector_class().process(histos))
+    return time.time() - t, result
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    count = int(saved_args[0]) if saved_args else 200000
+    logger.info("Generating %d histograms", count)
+    histos = generate_histograms(count)
+
+    legacy_duration, legacy = run(LegacyShotDetector, histos)
+    duration, result = run(ShotDetector, histos)
+    logger.info("%d shots, %d dissolves", len([ r for r in result if r['content'] != 'grad' ]),
+                len([ r for r in result if r['content'] == 'grad' ]))
+    logger.info("Loop-based detection: %.2fs", legacy_duration)
+    logger.info("Vectorised detection: %.2fs (x%.1f)", duration, legacy_duration / max(duration, 1e-6))
+    if result != legacy:
+        logger.error("Detection outputs differ")
+        sys.exit(1)
+    logger.info("Detection outputs are identical")
@@ -0,0 +1,144 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Load test for the webserver snapshot endpoints.
+
+Usage: benchmark_snapshots.py [--url URL --alias ALIAS] [--count N] [--clients N] [--batch-size N]
+
+Simulate web front-ends fetching all the thumbnails of a time range,
+either with one /media/snapshot request per image, or with
+/media/snapshot_positions and /media/snapshot_batch requests.
+
+If no URL is given, an embedded server is started on a new package
+whose imagecache is filled with count synthetic snapshots.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import struct
+import sys
+import time
+import urllib.request
+import zlib
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+def png(width, height, grey):
+    """Return a uniform grey PNG image.
+    """
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    raw = b''.join(b'\x00' + bytes((grey, )) * width for _ in range(height))
+    return b''.join((b'\x89PNG\r\n\x1a\n',
+                     chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)),
+                     chunk(b'IDAT', zlib.compress(raw)),
+                     chunk(b'IEND', b'')))
+
+def start_server(count, port):
+    """Start an embedded server with a package holding count snapshots.
+
+    Return the controller.
+    """
+    from advene.core.controller import AdveneController
+    from advene.core.webcherry import AdveneWebServer
+
+    controller = AdveneController()
+    controller.load_package(alias='bench')
+    controller.cached_duration = (count + 1) * 1000
+    imagecache = controller.package.imagecache
+    for i in range(count):
+        imagecache[i * 1000] = png(160, 90, i % 256)
+    controller.server = AdveneWebServer(controller=controller, port=port)
+    return controller
+
+def fetch(url):
+    with urllib.request.urlopen(url) as f:
+        return f.read()
+
+def per_image(url, alias, positions, clients):
+    with ThreadPoolExecutor(clients) as executor:
+        return sum(len(data)
+                   for data in executor.map(fetch, [ "%s/media/snapshot/%s/%d" % (url, alias, p)
+                                                     for p in positions ]))
+
+def batched(url, alias, positions, clients, batch_size):
+    batches = [ positions[i:i + batch_size] for i in range(0, len(positions), batch_size) ]
+    with ThreadPoolExecutor(clients) as executor:
+        return sum(len(data)
+                   for data in executor.map(fetch, [ "%s/media/snapshot_batch/%s?positions=%s" % (url, alias, ",".join(str(p) for p in b))
+                                                     for b in batches ]))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # Do not log each request
+    logging.getLogger('cherrypy').setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser("Snapshot endpoints load test")
+    parser.add_argument('--url', action="store", default=None,
+                        help="URL of a running Advene webserver (default: start an embedded server)")
+    parser.add_argument('--alias', action="store", default='bench',
+                        help="Package alias")
+    parser.add_argument('--port', action="store", type=int, default=12345,
+                        help="Port of the embedded server")
+    parser.add_argument('--count', action="store", type=int, default=500,
+                        help="Number of snapshots in the embedded server imagecache")
+    parser.add_argument('--clients', action="store", type=int, default=4,
+                        help="Number of concurrent clients")
+    parser.add_argument('--batch-size', action="store", type=int, default=100,
+                        help="Number of snapshots per batch request")
+    args = parser.parse_args(saved_args)
+
+    controller = None
+    url = args.url
+    if url is None:
+        controller = start_server(args.count, args.port)
+        url = "http://localhost:%d" % args.port
+        time.sleep(1)
+    url = url.rstrip('/')
+
+    try:
+        t0 = time.time()
+        positions = json.loads(fetch("%s/media/snapshot_positions/%s" % (url, args.alias)))
+        t1 = time.time()
+        print("%d snapshot positions listed in %.3fs" % (len(positions), t1 - t0))
+
+        t0 = time.time()
+        size = per_image(url, args.alias, positions, args.clients)
+        t1 = time.time()
+        print("Per-image requests: %.3fs (%d bytes, %.1f images/s)" % (t1 - t0, size, len(positions) / (t1 - t0)))
+
+        t0 = time.time()
+        size = batched(url, args.alias, positions, args.clients, args.batch_size)
+        t1 = time.time()
+        print("Batch requests:     %.3fs (%d bytes, %.1f images/s)" % (t1 - t0, size, len(positions) / (t1 - t0)))
+    finally:
+        if controller is not None:
+            controller.server.stop()
@@ -0,0 +1,157 @@
+#! /usr/bin/env python3
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Load test for concurrent package access through the webserver.
+
+Usage: loadtest_webserver.py [--clients N] [--duration S] [--unlocked] [package_file]
+
+An embedded webserver is started on the package. Concurrent clients
+fetch the number of annotations and the rendering of all the
+annotations of the package, while a writer thread (standing for the
+application thread) repeatedly creates then deletes pairs of
+annotations, each pair in a single write-locked operation.
+
+Readers should thus always see an even difference with the initial
+number of annotations, in both requests. The --unlocked option
+disables the package_lock tool of the webserver, to compare with
+unprotected access.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import cherrypy
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+(maindir, subdir) = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+if subdir == 'scripts':
+    sys.path.insert(0, os.path.join(maindir, "lib"))
+import advene.core.config as config
+config.data.fix_paths(maindir)
+
+from advene.core.controller import AdveneController
+from advene.core.webcherry import AdveneWebServer
+
+ALIAS = 'loadtest'
+
+def fetch(url):
+    with urllib.request.urlopen(url) as f:
+        return f.read().decode('utf-8')
+
+def reader(url, initial, stop):
+    """Fetch the package data until stop is set.
+
+    Return (requests, errors, inconsistencies).
+    """
+    requests = errors = inconsistencies = 0
+    while not stop.is_set():
+        try:
+            count = int(fetch("%s/packages/%s/annotations/length?mode=raw" % (url, ALIAS)))
+            listing = fetch("%s/packages/%s/annotations?mode=raw" % (url, ALIAS))
+            requests += 2
+        except (urllib.error.URLError, ValueError):
+            errors += 1
+            continue
+        if (count - initial) % 2:
+            inconsistencies += 1
+        if (listing.count('class="screenshot_container"') - initial) % 2:
+            inconsistencies += 1
+    return requests, errors, inconsistencies
+
+def writer(controller, at, stop):
+    """Create and delete pairs of annotations until stop is set.
+
+    Return the number of write operations.
+    """
+    operations = 0
+    while not stop.is_set():
+        with controller.package_lock.write():
+            pair = [ controller.create_annotation(i * 1000, at, duration=500)
+                     for i in range(2) ]
+        with controller.package_lock.write():
+            for a in pair:
+                controller.delete_element(a)
+        operations += 2
+        # Process the notifications, as the application mainloop would do
+        controller.process_queue()
+    return operations
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    # Do not log each request
+    logging.getLogger('cherrypy').setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser("Webserver concurrent access load test")
+    parser.add_argument('--port', action="store", type=int, default=12346,
+                        help="Port of the embedded server")
+    parser.add_argument('--clients', action="store", type=int, default=8,
+                        help="Number of concurrent reader clients")
+    parser.add_argument('--duration', action="store", type=float, default=10,
+                        help="Duration of the test, in seconds")
+    parser.add_argument('--unlocked', action="store_true", default=False,
+                        help="Disable the package lock in the webserver")
+    parser.add_argument('package', nargs='?', default=os.path.join(maindir, 'examples', 'Nosferatu_v13.azp'),
+                        help="Package file")
+    args = parser.parse_args(saved_args)
+
+    controller = AdveneController()
+    controller.load_package(uri=args.package, alias=ALIAS)
+    controller.cached_duration = max(a.fragment.end for a in controller.package.annotations) + 10000
+    at = controller.package.annotationTypes[0]
+    initial = len(controller.package.annotations)
+
+    controller.server = AdveneWebServer(controller=controller, port=args.port)
+    # Render each request
+    controller.server.response_cache.size = 0
+    if args.unlocked:
+        cherrypy.tree.apps[''].config['/']['tools.package_lock.on'] = False
+    url = "http://localhost:%d" % args.port
+    time.sleep(1)
+
+    stop = threading.Event()
+    try:
+        with ThreadPoolExecutor(args.clients + 1) as executor:
+            t0 = time.time()
+            readers = [ executor.submit(reader, url, initial, stop) for i in range(args.clients) ]
+            write = executor.submit(writer, controller, at, stop)
+            time.sleep(args.duration)
+            stop.set()
+            results = [ r.result() for r in readers ]
+            operations = write.result()
+            t = time.time() - t0
+    finally:
+        controller.server.stop()
+
+    requests = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    inconsistencies = sum(r[2] for r in results)
+    print("%s webserver, %d clients, %.1fs" % ("Unlocked" if args.unlocked else "Locked", args.clients, t))
+    print("Reads:  %d requests (%.1f/s), %d errors, %d inconsistent counts" % (requests, requests / t, errors, inconsistencies))
+    print("Writes: %d operations (%.1f/s)" % (operations, operations / t))
+    print("Final annotation count: %d (initial %d)" % (len(controller.package.annotations), initial))
@@ -0,0 +1,87 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Tests for the evaluation cache.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
+# The configuration module parses the command line options
+sys.argv = sys.argv[:1]
+
+from advene.core.evaluationcache import EvaluationCache
+from advene.model.package import Package
+from advene.model.fragment import MillisecondFragment
+
+def create_package():
+    p = Package(uri='new_pkg', source=None)
+    schema = p.createSchema(ident='schema_1')
+    p.schemas.append(schema)
+    types = []
+    for ident in ('at_1', 'at_2'):
+        at = schema.createAnnotationType(ident=ident)
+        at.mimetype = 'text/plain'
+        schema.annotationTypes.append(at)
+        types.append(at)
+    for i, begin in enumerate((5000, 1000, 3000, 1000, 4000, 2000)):
+        a = p.createAnnotation(ident='a%d' % i, type=types[i % 2],
+                               fragment=MillisecondFragment(begin=begin, duration=500))
+        p.annotations.append(a)
+    return p, types
+
+def ids(annotations):
+    return [ a.id for a in annotations ]
+
+def test_type_annotations():
+    p, types = create_package()
+    cache = EvaluationCache(p)
+    for at in types:
+        assert ids(cache.type_annotations(at)) == ids(at.annotations)
+    assert ids(cache.type_annotations(types[0])) == [ 'a2', 'a4', 'a0' ]
+    assert ids(cache.type_annotations(types[1])) == [ 'a1', 'a3', 'a5' ]
+
+def test_unnotified_modification():
+    p, types = create_package()
+    cache = EvaluationCache(p)
+    cache.type_annotations(types[0])
+    a = p.createAnnotation(ident='new', type=types[0],
+                           fragment=MillisecondFragment(begin=0, duration=500))
+    p.annotations.append(a)
+    # The annotation count changed: the annotations are sorted again
+    assert ids(cache.type_annotations(types[0])) == [ 'new', 'a2', 'a4', 'a0' ]
+
+def test_clear():
+    p, types = create_package()
+    cache = EvaluationCache(p)
+    cache.type_annotations(types[0])
+    cache.colors[('a0', 'color')] = '#ff0000'
+    cache.titles['a0'] = 'Title'
+    generation = cache.generation
+    p.annotations[0].fragment.begin = 1500
+    cache.clear()
+    assert cache.generation == generation + 1
+    assert cache.colors == {} and cache.titles == {}
+    assert ids(cache.type_annotations(types[0])) == [ 'a0', 'a2', 'a4' ]
+
+def test_content_modification_clears_cache():
+    p, types = create_package()
+    p._evaluation_cache = cache = EvaluationCache(p)
+    cache.titles['a0'] = 'Title'
+    p.annotations[0].content.data = 'New title'
+    assert cache.titles == {}
@@ -0,0 +1,93 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Tests for the coalescing of batched annotation notifications.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
+# The configuration module parses the command line options
+sys.argv = sys.argv[:1]
+
+pytest.importorskip('gi')
+controller = pytest.importorskip('advene.core.controller')
+NotificationBatch = controller.NotificationBatch
+
+def add(notification_batch, event_name, annotation, **kw):
+    kw['annotation'] = annotation
+    notification_batch.add(event_name, (), kw)
+
+def test_create_then_delete_cancels():
+    batch = NotificationBatch()
+    add(batch, 'AnnotationCreate', 'a')
+    add(batch, 'AnnotationEditEnd', 'a')
+    add(batch, 'AnnotationDelete', 'a')
+    assert batch.changes == {}
+
+def test_create_then_edit_is_a_create():
+    batch = NotificationBatch()
+    add(batch, 'AnnotationCreate', 'a')
+    add(batch, 'AnnotationEditEnd', 'a')
+    add(batch, 'AnnotationEditEnd', 'a')
+    assert batch.changes == { 'a': 'AnnotationCreate' }
+
+def test_delete_then_create_is_an_edit():
+    batch = NotificationBatch()
+    add(batch, 'AnnotationDelete', 'a')
+    add(batch, 'AnnotationCreate', 'a')
+    assert batch.changes == { 'a': 'AnnotationEditEnd' }
+
+def test_edit_then_delete_is_a_delete():
+    batch = NotificationBatch()
+    add(batch, 'AnnotationEditEnd', 'a')
+    add(batch, 'AnnotationDelete', 'a')
+    assert batch.changes == { 'a': 'AnnotationDelete' }
+
+def test_changes_order_and_pending_events():
+    batch = NotificationBatch()
+    batch.add('PackageEditEnd', (), { 'package': 'p' })
+    add(batch, 'AnnotationEditEnd', 'b')
+    batch.add('TagUpdate', (), { 'tag': 't' })
+    add(batch, 'AnnotationCreate', 'a')
+    add(batch, 'AnnotationEditEnd', 'b')
+    assert list(batch.changes.items()) == [ ('b', 'AnnotationEditEnd'),
+                                            ('a', 'AnnotationCreate') ]
+    # The AnnotationBatch notification (None) takes the place of
+    # the first annotation event.
+    assert [ item and item[0] for item in batch.pending ] == [ 'PackageEditEnd', None, 'TagUpdate' ]
+
+def test_undone():
+    batch = NotificationBatch()
+    assert batch.undone is None
+    add(batch, 'AnnotationEditEnd', 'a', undone=True)
+    add(batch, 'AnnotationDelete', 'b', undone=True)
+    assert batch.undone is True
+    # A single event which was not generated by an undo is enough
+    add(batch, 'AnnotationCreate', 'c')
+    assert batch.undone is False
+    add(batch, 'AnnotationEditEnd', 'd', undone=True)
+    assert batch.undone is False
+
+def test_batch_id():
+    batch = NotificationBatch()
+    add(batch, 'AnnotationEditEnd', 'a', batch='first')
+    add(batch, 'AnnotationEditEnd', 'b', batch='second')
+    assert batch.batch == 'first'
@@ -0,0 +1,137 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Tests for the package readers/writer lock.
+"""
+import os
+import sys
+from threading import Event, Thread
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
+
+from advene.util.rwlock import ReadWriteLock
+
+# Delay (in s) after which a thread is considered as blocked
+BLOCKED = 0.2
+
+def start(target):
+    t = Thread(target=target, daemon=True)
+    t.start()
+    return t
+
+def test_read_is_reentrant():
+    lock = ReadWriteLock()
+    lock.acquire_read()
+    lock.acquire_read()
+    lock.release_read()
+
+    # Still held for reading: a writer must wait
+    writer = start(lambda: lock.write().__enter__())
+    writer.join(BLOCKED)
+    assert writer.is_alive()
+
+    lock.release_read()
+    writer.join(5)
+    assert not writer.is_alive()
+
+def test_write_is_reentrant():
+    lock = ReadWriteLock()
+    with lock.write():
+        with lock.write():
+            # The writer can also read
+            with lock.read():
+                assert lock.is_writing()
+        assert lock.is_writing()
+
+        reader = start(lambda: lock.read().__enter__())
+        reader.join(BLOCKED)
+        assert reader.is_alive()
+    assert not lock.is_writing()
+    reader.join(5)
+    assert not reader.is_alive()
+
+def test_read_to_write_upgrade_fails():
+    lock = ReadWriteLock()
+    with lock.read():
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    # The failed upgrade did not leave the lock in a waiting state
+    with lock.write():
+        assert lock.is_writing()
+
+def test_waiting_writer_blocks_new_readers():
+    lock = ReadWriteLock()
+    order = []
+    reading = Event()
+    release_reader = Event()
+
+    def first_reader():
+        with lock.read():
+            reading.set()
+            release_reader.wait(5)
+        order.append('first reader')
+
+    def writer():
+        with lock.write():
+            order.append('writer')
+
+    def second_reader():
+        with lock.read():
+            order.append('second reader')
+
+    threads = [ start(first_reader) ]
+    assert reading.wait(5)
+    threads.append(start(writer))
+    threads[-1].join(BLOCKED)
+    threads.append(start(second_reader))
+    threads[-1].join(BLOCKED)
+    # The second reader waits for the waiting writer, even though
+    # the lock is only held for reading.
+    assert order == []
+
+    release_reader.set()
+    for t in threads:
+        t.join(5)
+        assert not t.is_alive()
+    assert order == [ 'first reader', 'writer', 'second reader' ]
+
+def test_release_without_hold_fails():
+    lock = ReadWriteLock()
+    with pytest.raises(RuntimeError):
+        lock.release_read()
+    with pytest.raises(RuntimeError):
+        lock.release_write()
+
+    # The write lock cannot be released by another thread
+    errors = []
+    def release():
+        try:
+            lock.release_write()
+        except RuntimeError as e:
+            errors.append(e)
+    with lock.write():
+        start(release).join(5)
+        assert lock.is_writing()
+    assert len(errors) == 1
+
+    # Holding the write lock does not allow to release a read lock
+    with lock.write():
+        with pytest.raises(RuntimeError):
+            lock.release_read()
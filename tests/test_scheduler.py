@@ -0,0 +1,208 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Tests for the background job scheduler.
+"""
+import os
+import sys
+from threading import Event
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
+
+from advene.core.scheduler import JobScheduler, PRIORITY_HIGH, PRIORITY_LOW
+
+def run_all(scheduler):
+    """Run idle slices until no job can be run immediately.
+    """
+    for i in range(100):
+        if not scheduler.run_idle():
+            return
+    raise AssertionError("Jobs still runnable after 100 slices")
+
+def test_priority_order():
+    scheduler = JobScheduler()
+    order = []
+    scheduler.submit(order.append, 'low', priority=PRIORITY_LOW)
+    scheduler.submit(order.append, 'normal')
+    scheduler.submit(order.append, 'high', priority=PRIORITY_HIGH)
+    scheduler.submit(order.append, 'normal 2')
+    assert [ j.name for j in scheduler.jobs() ] == [ 'append' ] * 4
+    assert scheduler.stats()['queued'] == 4
+    run_all(scheduler)
+    assert order == [ 'high', 'normal', 'normal 2', 'low' ]
+    assert scheduler.jobs() == []
+
+def test_generator_steps():
+    scheduler = JobScheduler()
+    order = []
+    def job(name, count):
+        for i in range(count):
+            order.append((name, i))
+            yield
+        return name
+
+    results = []
+    a = scheduler.submit(job, 'a', 3, callback=results.append)
+    b = scheduler.submit(job, 'b', 2, callback=results.append)
+    run_all(scheduler)
+    # Round-robin between jobs of the same priority
+    assert order == [ ('a', 0), ('b', 0), ('a', 1), ('b', 1), ('a', 2) ]
+    assert results == [ 'b', 'a' ]
+    assert (a.state, a.result, a.steps) == ('done', 'a', 4)
+    assert b.state == 'done'
+
+def test_visible_range():
+    scheduler = JobScheduler()
+    order = []
+    for t in (0, 1000, 2000, 3000):
+        scheduler.submit(order.append, t, position=t, priority=PRIORITY_LOW)
+    scheduler.submit(order.append, 'normal')
+    scheduler.set_visible_range(1500, 3000)
+    assert [ j.position for j in scheduler.jobs() ] == [ 2000, 3000, None, 0, 1000 ]
+    run_all(scheduler)
+    assert order == [ 2000, 3000, 'normal', 0, 1000 ]
+
+def test_key():
+    scheduler = JobScheduler()
+    order = []
+    a = scheduler.submit(order.append, 'a', key='k', priority=PRIORITY_LOW)
+    scheduler.submit(order.append, 'b')
+    # Same key: the active job is returned, with the higher priority
+    assert scheduler.submit(order.append, 'c', key='k', priority=PRIORITY_HIGH) is a
+    run_all(scheduler)
+    assert order == [ 'a', 'b' ]
+    # The key is available again once the job is done
+    assert scheduler.submit(order.append, 'd', key='k') is not a
+
+def test_resource_blocking():
+    scheduler = JobScheduler()
+    order = []
+    ready = []
+    def waiting_job():
+        while not ready:
+            order.append('wait')
+            yield False
+        order.append('ready')
+
+    w = scheduler.submit(waiting_job, resource='snapshotter', priority=PRIORITY_HIGH)
+    scheduler.submit(order.append, 'same resource', resource='snapshotter')
+    scheduler.submit(order.append, 'other resource', resource='index')
+    # Only waiting jobs remain runnable in the next slice
+    assert not scheduler.run_idle()
+    assert order == [ 'wait', 'other resource' ]
+    assert w.state == 'waiting'
+
+    ready.append(True)
+    run_all(scheduler)
+    assert order == [ 'wait', 'other resource', 'ready', 'same resource' ]
+
+def test_failure():
+    scheduler = JobScheduler()
+    def failing_job():
+        yield
+        raise ValueError("failure")
+    results = []
+    job = scheduler.submit(failing_job, callback=results.append)
+    run_all(scheduler)
+    assert job.state == 'failed'
+    assert isinstance(job.error, ValueError)
+    assert results == []
+
+def test_thread_job():
+    results = []
+    callbacks = []
+    def runner(callback, result):
+        callbacks.append(callback)
+        callback(result)
+    scheduler = JobScheduler(threads=1, callback_runner=runner)
+    done = Event()
+    def callback(result):
+        results.append(result)
+        done.set()
+    job = scheduler.submit(sum, (1, 2, 3), thread=True, callback=callback)
+    scheduler.run_idle()
+    assert done.wait(5)
+    assert results == [ 6 ]
+    assert job.state == 'done'
+    # Thread job callbacks are run through the callback runner
+    assert callbacks == [ callback ]
+    scheduler.shutdown()
+
+def test_cancel():
+    scheduler = JobScheduler()
+    order = []
+    package, other = object(), object()
+    a = scheduler.submit(order.append, 'a', package=package)
+    b = scheduler.submit(order.append, 'b', package=other, key='b')
+    c = scheduler.submit(order.append, 'c', package=package)
+    assert scheduler.cancel(package=package) == 2
+    assert (a.state, b.state, c.state) == ('cancelled', 'queued', 'cancelled')
+    assert scheduler.cancel(job=a) == 0
+    assert scheduler.cancel(job=b) == 1
+    run_all(scheduler)
+    assert order == []
+    # The key of a cancelled job is available again
+    assert scheduler.submit(order.append, 'b', key='b') is not b
+
+def test_cancel_generator():
+    scheduler = JobScheduler()
+    closed = []
+    def job():
+        try:
+            while True:
+                yield
+        finally:
+            closed.append(True)
+    j = scheduler.submit(job)
+    scheduler.run_idle()
+    scheduler.cancel()
+    assert j.state == 'cancelled'
+    assert closed == [ True ]
+    run_all(scheduler)
+    assert scheduler.jobs() == []
+
+def test_cancel_running_job():
+    scheduler = JobScheduler()
+    closed = []
+    package = object()
+    def job():
+        try:
+            yield
+            # Cancel the jobs of the package, including this one
+            scheduler.cancel(package=package)
+            yield
+            closed.append('not cancelled')
+        finally:
+            closed.append(True)
+    j = scheduler.submit(job, package=package)
+    run_all(scheduler)
+    assert j.state == 'cancelled'
+    assert j.error is None
+    assert closed == [ True ]
+
+def test_cancel_itself():
+    scheduler = JobScheduler()
+    jobs = []
+    def job():
+        yield
+        scheduler.cancel(job=jobs[0])
+        yield
+    jobs.append(scheduler.submit(job))
+    run_all(scheduler)
+    assert jobs[0].state == 'cancelled'
+    assert jobs[0].error is None
@@ -0,0 +1,56 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Tests for the snapshotter timestamp queue.
+"""
+import os
+import sys
+from threading import Event, Thread
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
+
+pytest.importorskip('gi')
+snapshotter = pytest.importorskip('advene.util.snapshotter')
+
+def test_background_requests_capture_real_timestamps():
+    s = snapshotter.Snapshotter()
+    s.active = True
+    captured = []
+    done = Event()
+
+    def snapshot(t):
+        # Stand for the player: the capture is immediately available
+        captured.append(t)
+        if len(captured) == 2:
+            done.set()
+        s.snapshot_ready.set()
+        return True
+    s.snapshot = snapshot
+
+    # Enqueue before starting the thread, so that both requests are
+    # pending when the queue is processed.
+    s.enqueue(5000, background=True)
+    s.enqueue(9000)
+    Thread(target=s.process_queue, daemon=True).start()
+
+    assert done.wait(5)
+    # The normal request is captured first, and the background
+    # request with its actual timestamp.
+    assert captured == [9000, 5000]